@@ -5,11 +5,19 @@ from routes import blueprints  # Import the blueprints list instead of individua
 from sanic_ext import Extend, openapi
 from pathlib import Path
 from sanic.response import HTTPResponse, JSONResponse
-import json as json_module
-from sanic.exceptions import Unauthorized
+from sanic.exceptions import NotFound, Unauthorized
 from utils.auth import verify_token
 import time  # Add this import at the top of the file
 from database import Database, init_db, close_db  # Add these imports
+from course.course_rating import start_rating_flusher, stop_rating_flusher
+from lessons.lesson_type import LessonTypeRegistry
+from utils.invalidation import start_invalidation_listener
+from utils.blob_store import start_blob_gc, stop_blob_gc, is_blob_path
+from resources.media_jobs import start_media_workers, stop_media_workers
+from utils.http_cache import wrap_envelope
+from utils.compression import compress_response
+from utils.static_files import send_file, resolve_path, REVALIDATE_CACHE_CONTROL
+from utils.upload import UPLOAD_MAX_BYTES
 import os
 
 
@@ -20,6 +28,10 @@ load_dotenv(dotenv_path=env_path)
 
 # Initialize Sanic app
 app = Sanic("BambooGrowthApp")
+# Let upload bodies through to receive_multipart, which enforces
+# UPLOAD_MAX_BYTES itself; the extra megabyte covers multipart framing and
+# form fields, so Sanic's own limit never cuts an allowed upload short
+app.config.REQUEST_MAX_SIZE = max(app.config.REQUEST_MAX_SIZE, UPLOAD_MAX_BYTES + 1024 * 1024)
 Extend(app)
 
 # Configure CORS properly
@@ -37,33 +49,27 @@ async def custom_json_response(request, response):
     print('response', response)
     if isinstance(response, JSONResponse):
         try:
-            # If the body is bytes, decode it to string first
-            if isinstance(response.body, bytes):
-                original_json = json_module.loads(response.body.decode('utf-8'))
-            else:
-                original_json = response.body
-
-            custom_response = {
-                "status": "success" if response.status < 400 else "error",
-                "data": original_json,
-                "message": None,  # You can set this based on your needs
-                "code": response.status
-            }
-            new_response = json(custom_response, status=response.status)
+            # Splice the handler's JSON into the envelope instead of parsing
+            # and re-serializing it; lesson and page documents can be large
+            new_response = HTTPResponse(
+                wrap_envelope(response.body, response.status),
+                status=response.status,
+                content_type="application/json"
+            )
             
-            # Preserve original CORS headers
+            # Preserve original headers (CORS, ETag, Cache-Control, ...)
             for header, value in response.headers.items():
-                if header.lower().startswith("access-control-"):
+                if header.lower() not in ("content-type", "content-length"):
                     new_response.headers[header] = value
             new_response.headers["Access-Control-Allow-Origin"] = "*"  # Add CORS header
             print('new_response', new_response)
-            return new_response
+            return await compress_response(request, new_response)
         except Exception as e:
             print(e)
-            # If we can't decode the JSON, return the original response
+            # If the body can't be wrapped, return the original response
             return response
     print('response', response)
-    return response
+    return await compress_response(request, response)
 
 
 # Configure OpenAPI info
@@ -82,6 +88,22 @@ async def setup_db(app, loop):
     await init_db()
     app.ctx.db = Database
 
+# Start background jobs once the server is accepting requests
+@app.listener('after_server_start')
+async def start_background_jobs(app, loop):
+    start_rating_flusher()
+    start_blob_gc()
+    await start_invalidation_listener()
+    await start_media_workers()
+    await LessonTypeRegistry.load()
+
+# Flush pending aggregates while the pool is still open
+@app.listener('before_server_stop')
+async def stop_background_jobs(app, loop):
+    stop_blob_gc()
+    await stop_media_workers()
+    await stop_rating_flusher()
+
 # Add database cleanup on server stop
 @app.listener('after_server_stop')
 async def cleanup_db(app, loop):
@@ -97,6 +119,8 @@ async def auth_middleware(request: Request):
         # '/api/v1/user_shares', 
         '/api/v1/auth/login', 
         '/data',
+        # Peaks of files that are public under /data anyway
+        '/api/v1/waveform/',
         #'/api/v1/sync/courses',
         '/api/v1/user-lessons/results/shared/',
         # '/api/v1/data/', 
@@ -140,10 +164,26 @@ app.middleware('request')(auth_middleware)
 for blueprint in blueprints:
     app.blueprint(blueprint)
 
-# Add static file server
-app.static("/", os.path.join(os.environ.get("BASE_FRONTEND_PATH"), "index.html"), name="home")
-app.static("/data", os.environ.get("BASE_DATA_PATH"), name="data")
-app.static("/static", os.environ.get("BASE_FRONTEND_PATH"), name="static_files")
+# Static file server: validators, precompressed siblings, immutable hashed assets
+@app.route("/", methods=["GET", "HEAD"], name="home")
+@openapi.exclude()
+async def home(request):
+    return await send_file(request, os.environ.get("BASE_FRONTEND_PATH"), "index.html",
+                           cache_control=REVALIDATE_CACHE_CONTROL)
+
+@app.route("/data/<path:path>", methods=["GET", "HEAD"], name="data")
+@openapi.exclude()
+async def data_files(request, path):
+    # /data is public; stored blobs are only served by routes that check the user
+    if is_blob_path(resolve_path(os.environ.get("BASE_DATA_PATH"), path)):
+        raise NotFound("File not found")
+    # Course files keep their names across syncs, so they always revalidate
+    return await send_file(request, os.environ.get("BASE_DATA_PATH"), path, hashed_immutable=False)
+
+@app.route("/static/<path:path>", methods=["GET", "HEAD"], name="static_files")
+@openapi.exclude()
+async def static_files(request, path):
+    return await send_file(request, os.environ.get("BASE_FRONTEND_PATH"), path)
 
 # Endpoint to provide speech key
 @app.route('/api/speech-config', methods=['GET'])
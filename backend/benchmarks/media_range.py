@@ -0,0 +1,106 @@
+"""
+Compare whole-file downloads with ranged seeks against a running server.
+
+    python3 benchmarks/media_range.py --create --url http://localhost:8001
+
+--create writes a 100 MB random file to $BASE_DATA_PATH/bench/video.mp4
+(random bytes stand in for video; only the size matters here). The script
+then runs a few full downloads and many concurrent 256 KB range requests at
+random offsets, like a player seeking, and reports latency and throughput.
+"""
+from typing import List
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+import aiohttp
+
+BENCH_FILE = "bench/video.mp4"
+BENCH_FILE_SIZE = 100 * 1024 * 1024
+
+
+def create_file(data_path: str) -> str:
+    path = os.path.join(data_path, BENCH_FILE)
+    if os.path.exists(path) and os.path.getsize(path) == BENCH_FILE_SIZE:
+        return path
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        for _ in range(BENCH_FILE_SIZE // (1024 * 1024)):
+            f.write(os.urandom(1024 * 1024))
+    return path
+
+
+def summarize(label: str, timings: List[float], total_bytes: int, wall: float) -> None:
+    timings = sorted(timings)
+    p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+    print(
+        f"{label}: {len(timings)} requests, "
+        f"median {statistics.median(timings) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms, "
+        f"{total_bytes / wall / (1024 * 1024):.1f} MB/s over {wall:.2f} s"
+    )
+
+
+async def fetch(session: aiohttp.ClientSession, url: str, headers: dict, expect: int):
+    started = time.perf_counter()
+    async with session.get(url, headers=headers) as response:
+        if response.status != expect:
+            raise RuntimeError(f"Expected {expect}, got {response.status} for {headers}")
+        received = 0
+        async for chunk in response.content.iter_chunked(256 * 1024):
+            received += len(chunk)
+    return time.perf_counter() - started, received
+
+
+async def run_whole(session, url: str, count: int, concurrency: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            return await fetch(session, url, {}, 200)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(count)))
+    summarize("whole file", [t for t, _ in results], sum(n for _, n in results),
+              time.perf_counter() - started)
+
+
+async def run_ranges(session, url: str, count: int, concurrency: int, range_size: int) -> None:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        start = random.randrange(0, BENCH_FILE_SIZE - range_size)
+        headers = {"Range": f"bytes={start}-{start + range_size - 1}"}
+        async with semaphore:
+            return await fetch(session, url, headers, 206)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(count)))
+    summarize(f"{range_size // 1024} KB seeks", [t for t, _ in results],
+              sum(n for _, n in results), time.perf_counter() - started)
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8001")
+    parser.add_argument("--create", action="store_true", help="write the 100 MB test file first")
+    parser.add_argument("--whole", type=int, default=5, help="number of full downloads")
+    parser.add_argument("--seeks", type=int, default=400, help="number of range requests")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--range-size", type=int, default=256 * 1024)
+    args = parser.parse_args()
+
+    if args.create:
+        print(f"test file: {create_file(os.environ.get('BASE_DATA_PATH', 'data'))}")
+
+    url = f"{args.url.rstrip('/')}/data/{BENCH_FILE}"
+    timeout = aiohttp.ClientTimeout(total=None)
+    async with aiohttp.ClientSession(timeout=timeout, auto_decompress=False) as session:
+        await run_whole(session, url, args.whole, min(args.concurrency, args.whole))
+        await run_ranges(session, url, args.seeks, args.concurrency, args.range_size)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -3,11 +3,21 @@ from database import Database
 import uuid
 from datetime import datetime
 from decimal import Decimal
+from utils.auth import admin_required
+from course.course_rating import upsert_rating, recompute_rating_aggregates
+from search.search import tsquery_expr
+from course.sync_local_file import LANGUAGE_CHOICES
+from utils.invalidation import publish
+from utils.cache import cache_region, cached
 
 course_bp = Blueprint("course", url_prefix="/api/v1/course")
 
+course_cache = cache_region("course", ttl=60, stale_ttl=300)
+
 def serialize_course(course):
     course_dict = dict(course)
+    # Internal full-text index column, never part of the API
+    course_dict.pop('search_vector', None)
     # Convert datetime objects to ISO format strings
     for key, value in course_dict.items():
         if isinstance(value, datetime):
@@ -21,6 +31,7 @@ async def course_root(request):
     return json({"message": "Course API"})
 
 @course_bp.route("/list")
+@cached(course_cache, key="list", tags=["course"])
 async def course_list(request):
     try:
         query = """
@@ -34,6 +45,7 @@ async def course_list(request):
         return json({"error": str(e)}, status=500)
 
 @course_bp.route("/<course_hash>")
+@cached(course_cache, key="{course_hash}", tags=["course:{course_hash}"])
 async def get_course(request, course_hash):
     try:
         query = "SELECT * FROM courses WHERE hash = $1"
@@ -88,6 +100,7 @@ async def create_course(request):
         )
         
         result = await Database.fetchval(query, *values)
+        await publish("course", result)
         return json({"hash": result, "message": "Course created successfully"})
         
     except Exception as e:
@@ -134,7 +147,8 @@ async def update_course(request, course_hash):
         
         if not result:
             return json({"error": "Course not found"}, status=404)
-            
+        
+        await publish("course", course_hash)
         return json({"message": "Course updated successfully"})
         
     except Exception as e:
@@ -151,26 +165,32 @@ async def update_course_rating(request, course_hash):
         if not (0 <= rating <= 5):
             return json({"error": "Rating must be between 0 and 5"}, status=400)
         
-        query = """
-            UPDATE courses 
-            SET average_rating = COALESCE(
-                (COALESCE(average_rating, 0) + $2) / 2,
-                $2
-            )
-            WHERE hash = $1
-            RETURNING hash
-        """
-        
-        result = await Database.fetchval(query, course_hash, rating)
+        user = request.ctx.user if hasattr(request.ctx, 'user') else None
+        if not user:
+            return json({"error": "Authentication required"}, status=401)
         
-        if not result:
+        course = await Database.fetchval("SELECT hash FROM courses WHERE hash = $1", course_hash)
+        if not course:
             return json({"error": "Course not found"}, status=404)
+        
+        # One row per user; the course aggregates are updated in batches
+        result = await upsert_rating(user['hash'], course_hash, rating)
             
-        return json({"message": "Course rating updated successfully"})
+        return json({"message": "Course rating updated successfully", **result})
         
     except Exception as e:
         return json({"error": str(e)}, status=500)
 
+@course_bp.route("/ratings/recompute", methods=["POST"])
+@admin_required
+async def recompute_course_ratings(request):
+    try:
+        data = request.json or {}
+        updated = await recompute_rating_aggregates(data.get('course_hash'))
+        return json({"message": "Course ratings recomputed successfully", "updated": updated})
+    except Exception as e:
+        return json({"error": str(e)}, status=500)
+
 @course_bp.route("/<course_hash>/enroll", methods=["POST"])
 async def enroll_course(request, course_hash):
     try:
@@ -198,6 +218,7 @@ async def search_courses(request):
         language = request.args.get('language')
         difficulty = request.args.get('difficulty')
         status = request.args.get('status')
+        search_term = (request.args.get('q') or '').strip()
         
         # Build query conditions
         conditions = ["is_active = true"]
@@ -219,10 +240,19 @@ async def search_courses(request):
             conditions.append(f"status = ${param_count}")
             values.append(status)
         
+        order_by = "created_at DESC"
+        if search_term:
+            # Full-text match served by the search_vector GIN index
+            param_count += 1
+            tsq = tsquery_expr(f"${param_count}", language if language in LANGUAGE_CHOICES else None)
+            conditions.append(f"search_vector @@ {tsq}")
+            values.append(search_term)
+            order_by = f"ts_rank_cd(search_vector, {tsq}, 32) DESC, created_at DESC"
+        
         query = f"""
             SELECT * FROM courses 
             WHERE {' AND '.join(conditions)}
-            ORDER BY created_at DESC
+            ORDER BY {order_by}
         """
         
         courses = await Database.fetch(query, *values)
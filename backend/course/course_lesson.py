@@ -1,10 +1,43 @@
 from sanic import Blueprint, json
 from database import Database
 from datetime import datetime
+from utils.invalidation import publish
+from utils.cache import cache_region, cached
 import uuid
 
 lesson_bp = Blueprint("lesson", url_prefix="/api/v1/course")
 
+# order_index values are spaced ORDER_GAP apart so a single lesson can be moved
+# between two neighbours by picking a key in the gap, without renumbering.
+ORDER_GAP = 1024
+
+APPLY_ORDER_QUERY = """
+    UPDATE course_lessons cl
+    SET order_index = (o.position - 1) * $3
+    FROM UNNEST($2::text[]) WITH ORDINALITY AS o(lesson_hash, position)
+    WHERE cl.course_hash = $1 AND cl.lesson_hash = o.lesson_hash
+"""
+
+async def apply_lesson_order(db, course_hash, lesson_order):
+    """Write a full lesson order in one statement, gapped by ORDER_GAP.
+
+    `db` is either `Database` or a connection taken from `Database.atomic()`.
+    Returns the number of course_lessons rows updated.
+    """
+    status = await db.execute(APPLY_ORDER_QUERY, course_hash, list(lesson_order), ORDER_GAP)
+    return int(status.split()[-1])
+
+# Course outlines. Dropped through the invalidation bus: "course" messages
+# clear one course, "lesson" messages clear every outline since a lesson may
+# sit in any course.
+outline_cache = cache_region("course_outline", ttl=60, stale_ttl=300)
+
+def _is_visible(request):
+    return request.args.get('is_visible', 'true').lower() == 'true'
+
+def _outline_key(request, course_hash):
+    return f"{course_hash}:visible={_is_visible(request)}"
+
 def serialize_lesson(lesson):
     return {
         'course_hash': lesson['course_hash'],
@@ -23,8 +56,12 @@ def serialize_lesson(lesson):
     }
 
 @lesson_bp.route("/<course_hash>/lessons")
+@cached(outline_cache, key=_outline_key, tags=["course:{course_hash}", "lesson"])
 async def get_course_lessons(request, course_hash):
     try:
+        # Get filter parameters from query string
+        is_visible = _is_visible(request)
+        
         # First verify the course exists
         course_query = "SELECT hash FROM courses WHERE hash = $1"
         course = await Database.fetchrow(course_query, course_hash)
@@ -32,9 +69,6 @@ async def get_course_lessons(request, course_hash):
         if not course:
             return json({"error": "Course not found"}, status=404)
         
-        # Get filter parameters from query string
-        is_visible = request.args.get('is_visible', 'true').lower() == 'true'
-        
         # Updated query with specific fields from lessons table
         query = """
             SELECT 
@@ -112,12 +146,12 @@ async def create_lesson(request, course_hash):
         
         # Get the maximum order_index for the course
         max_order_query = """
-            SELECT COALESCE(MAX(order_index), -1) 
+            SELECT MAX(order_index)
             FROM course_lessons 
             WHERE course_hash = $1
         """
         max_order = await Database.fetchval(max_order_query, course_hash)
-        new_order = max_order + 1
+        new_order = 0 if max_order is None else max_order + ORDER_GAP
 
         query = """
             INSERT INTO course_lessons (
@@ -134,6 +168,7 @@ async def create_lesson(request, course_hash):
         )
         
         result = await Database.fetchval(query, *values)
+        await publish("course", course_hash)
         return json({"lesson_hash": result, "message": "Lesson created successfully"})
         
     except Exception as e:
@@ -158,7 +193,8 @@ async def update_lesson(request, course_hash, lesson_hash):
         
         if not result:
             return json({"error": "Lesson not found"}, status=404)
-            
+        
+        await publish("course", course_hash)
         return json({"message": "Lesson updated successfully"})
         
     except Exception as e:
@@ -177,7 +213,8 @@ async def delete_lesson(request, course_hash, lesson_hash):
         
         if not result:
             return json({"error": "Lesson not found"}, status=404)
-            
+        
+        await publish("course", course_hash)
         return json({"message": "Lesson deleted successfully"})
         
     except Exception as e:
@@ -192,17 +229,107 @@ async def reorder_lessons(request, course_hash):
             return json({"error": "lesson_order is required"}, status=400)
             
         lesson_order = data['lesson_order']  # List of lesson_hash in desired order
+        if not isinstance(lesson_order, list):
+            return json({"error": "lesson_order must be a list of lesson hashes"}, status=400)
         
-        # Update each lesson's order
-        for index, lesson_hash in enumerate(lesson_order):
-            query = """
-                UPDATE course_lessons
-                SET order_index = $1
-                WHERE course_hash = $2 AND lesson_hash = $3
-            """
-            await Database.execute(query, index, course_hash, lesson_hash)
+        # Apply the whole order in a single statement so it is never half-applied
+        updated = await apply_lesson_order(Database, course_hash, lesson_order)
+        await publish("course", course_hash)
             
-        return json({"message": "Lesson order updated successfully"})
+        return json({"message": "Lesson order updated successfully", "updated": updated})
         
     except Exception as e:
-        return json({"error": str(e)}, status=500) 
\ No newline at end of file
+        return json({"error": str(e)}, status=500)
+
+@lesson_bp.route("/<course_hash>/lessons/<lesson_hash>/move", methods=["POST"])
+async def move_lesson(request, course_hash, lesson_hash):
+    """Move one lesson next to another, touching a single row when possible.
+
+    Body: {"after": <lesson_hash> | null, "before": <lesson_hash> | null}.
+    `after` alone places the lesson right after that lesson, `before` alone
+    right before it; both null moves it to the start of the course. Both may
+    be given only when they name the two sides of one slot, i.e. `before`
+    follows `after` once the moved lesson is taken out; otherwise 400.
+    """
+    try:
+        data = request.json or {}
+        after = data.get('after')
+        before = data.get('before')
+
+        if lesson_hash in (after, before):
+            return json({"error": "A lesson cannot be moved relative to itself"}, status=400)
+
+        async with Database.atomic() as conn:
+            # Serialize concurrent moves within the same course
+            course = await conn.fetchval(
+                "SELECT hash FROM courses WHERE hash = $1 FOR UPDATE", course_hash
+            )
+            if not course:
+                return json({"error": "Course not found"}, status=404)
+
+            rows = await conn.fetch(
+                """
+                SELECT lesson_hash, order_index FROM course_lessons
+                WHERE course_hash = $1
+                ORDER BY order_index ASC
+                """,
+                course_hash
+            )
+            order = [row['lesson_hash'] for row in rows if row['lesson_hash'] != lesson_hash]
+            keys = {row['lesson_hash']: row['order_index'] for row in rows}
+
+            if lesson_hash not in keys:
+                return json({"error": "Lesson not found"}, status=404)
+            for anchor in (after, before):
+                if anchor is not None and anchor not in keys:
+                    return json({"error": f"Lesson not found: {anchor}"}, status=404)
+
+            if after is not None and before is not None and order.index(before) != order.index(after) + 1:
+                return json({"error": "after and before must be adjacent lessons"}, status=400)
+
+            # Resolve the target slot as an index into the order without the moved lesson
+            if after is not None:
+                position = order.index(after) + 1
+            elif before is not None:
+                position = order.index(before)
+            else:
+                position = 0
+
+            lower = keys[order[position - 1]] if position > 0 else None
+            upper = keys[order[position]] if position < len(order) else None
+
+            if lower is None and upper is None:
+                new_key = 0
+            elif lower is None:
+                new_key = upper - ORDER_GAP
+            elif upper is None:
+                new_key = lower + ORDER_GAP
+            elif upper - lower > 1:
+                new_key = (lower + upper) // 2
+            else:
+                new_key = None
+
+            if new_key is not None:
+                await conn.execute(
+                    """
+                    UPDATE course_lessons SET order_index = $3
+                    WHERE course_hash = $1 AND lesson_hash = $2
+                    """,
+                    course_hash, lesson_hash, new_key
+                )
+                touched = 1
+            else:
+                # Gap exhausted: respace the whole course once
+                order.insert(position, lesson_hash)
+                touched = await apply_lesson_order(conn, course_hash, order)
+
+        await publish("course", course_hash)
+        return json({
+            "message": "Lesson moved successfully",
+            "order_index": new_key if new_key is not None else position * ORDER_GAP,
+            "renumbered": new_key is None,
+            "updated": touched
+        })
+
+    except Exception as e:
+        return json({"error": str(e)}, status=500)
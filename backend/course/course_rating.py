@@ -0,0 +1,205 @@
+from database import Database, register_schema, logger
+from utils.invalidation import publish
+from datetime import datetime, timedelta
+import asyncio
+import os
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+TABLE_PREFIX = os.getenv('DATABASE_TABLE_PREFIX', '')
+COURSE_RATINGS_TABLE = f"{TABLE_PREFIX}_course_ratings"
+
+COURSE_RATING_DELTAS_TABLE = f"{TABLE_PREFIX}_course_rating_deltas"
+COURSE_RATING_STATE_TABLE = f"{TABLE_PREFIX}_course_rating_state"
+
+# How often queued aggregate deltas are written to the courses rows, and how
+# often aggregates are rebuilt from the ratings table to correct drift
+RATING_FLUSH_INTERVAL = float(os.getenv('RATING_FLUSH_INTERVAL', 5))
+RATING_RECOMPUTE_INTERVAL = float(os.getenv('RATING_RECOMPUTE_INTERVAL', 6 * 3600))
+
+# Advisory lock held by whoever is writing aggregates, so a flush and a
+# recompute never interleave
+RATING_AGGREGATE_LOCK = "course_rating_aggregates"
+
+register_schema(
+    f"""
+    CREATE TABLE IF NOT EXISTS {COURSE_RATINGS_TABLE} (
+        user_hash TEXT NOT NULL,
+        course_hash TEXT NOT NULL,
+        rating NUMERIC(2, 1) NOT NULL,
+        created_at TIMESTAMP NOT NULL,
+        updated_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (course_hash, user_hash)
+    )
+    """,
+    "ALTER TABLE courses ADD COLUMN IF NOT EXISTS rating_sum NUMERIC NOT NULL DEFAULT 0",
+    "ALTER TABLE courses ADD COLUMN IF NOT EXISTS rating_count INTEGER NOT NULL DEFAULT 0",
+    # Deltas are written with the rating itself and drained by the flush, so
+    # every worker's ratings reach the aggregates exactly once
+    f"""
+    CREATE TABLE IF NOT EXISTS {COURSE_RATING_DELTAS_TABLE} (
+        id BIGSERIAL PRIMARY KEY,
+        course_hash TEXT NOT NULL,
+        sum_delta NUMERIC NOT NULL,
+        count_delta INTEGER NOT NULL
+    )
+    """,
+    # Single row: when the periodic recompute last ran, on any worker
+    f"""
+    CREATE TABLE IF NOT EXISTS {COURSE_RATING_STATE_TABLE} (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        recomputed_at TIMESTAMP NOT NULL
+    )
+    """,
+)
+
+_flush_task = None
+
+
+async def upsert_rating(user_hash: str, course_hash: str, rating: float) -> dict:
+    """
+    Store one user's rating and queue the O(1) aggregate delta.
+
+    The previous rating is read in the same statement so a changed rating
+    only moves rating_sum, while a first rating also bumps rating_count.
+    """
+    query = f"""
+        WITH previous AS (
+            SELECT rating FROM {COURSE_RATINGS_TABLE}
+            WHERE course_hash = $2 AND user_hash = $1
+            FOR UPDATE
+        ), saved AS (
+            INSERT INTO {COURSE_RATINGS_TABLE} (
+                user_hash, course_hash, rating, created_at, updated_at
+            ) VALUES ($1, $2, $3, $4, $4)
+            ON CONFLICT (course_hash, user_hash)
+            DO UPDATE SET rating = EXCLUDED.rating, updated_at = EXCLUDED.updated_at
+            RETURNING rating
+        ), delta AS (
+            INSERT INTO {COURSE_RATING_DELTAS_TABLE} (course_hash, sum_delta, count_delta)
+            SELECT $2, s.rating - COALESCE(p.rating, 0),
+                   CASE WHEN p.rating IS NULL THEN 1 ELSE 0 END
+            FROM saved s
+            LEFT JOIN previous p ON TRUE
+            WHERE s.rating IS DISTINCT FROM p.rating
+        )
+        SELECT (SELECT rating FROM previous) AS previous_rating,
+               (SELECT rating FROM saved) AS rating
+    """
+    row = await Database.fetchrow(query, user_hash, course_hash, rating, datetime.utcnow())
+    previous = row['previous_rating']
+
+    return {
+        "course_hash": course_hash,
+        "user_hash": user_hash,
+        "rating": float(row['rating']),
+        "previous_rating": float(previous) if previous is not None else None
+    }
+
+
+async def flush_rating_aggregates() -> int:
+    """
+    Drain the queued deltas into courses in one statement; returns courses
+    touched. Skipped while another worker is flushing or recomputing.
+
+    Nothing is published: rating aggregates reach readers through the course
+    cache's TTL instead of evicting popular courses every few seconds.
+    """
+    async with Database.atomic() as conn:
+        if not await conn.fetchval("SELECT pg_try_advisory_xact_lock(hashtext($1))",
+                                   RATING_AGGREGATE_LOCK):
+            return 0
+        status = await conn.execute(f"""
+            WITH drained AS (
+                DELETE FROM {COURSE_RATING_DELTAS_TABLE}
+                RETURNING course_hash, sum_delta, count_delta
+            ), d AS (
+                SELECT course_hash, SUM(sum_delta) AS sum_delta, SUM(count_delta) AS count_delta
+                FROM drained
+                GROUP BY course_hash
+            )
+            UPDATE courses c
+            SET rating_sum = c.rating_sum + d.sum_delta,
+                rating_count = c.rating_count + d.count_delta,
+                average_rating = CASE
+                    WHEN c.rating_count + d.count_delta > 0
+                    THEN (c.rating_sum + d.sum_delta) / (c.rating_count + d.count_delta)
+                END
+            FROM d
+            WHERE c.hash = d.course_hash
+        """)
+    return int(status.split()[-1])
+
+
+async def recompute_rating_aggregates(course_hash: str = None, periodic: bool = False) -> int:
+    """
+    Rebuild rating_sum/rating_count/average_rating from the ratings table.
+    periodic=True only runs if no worker has done so within
+    RATING_RECOMPUTE_INTERVAL, and returns 0 otherwise.
+    """
+    condition = "WHERE c.hash = $1" if course_hash else ""
+    delta_condition = "WHERE course_hash = $1" if course_hash else ""
+    params = [course_hash] if course_hash else []
+    # One statement, one snapshot: the deltas dropped are exactly those of
+    # the ratings the rebuild reads, since both commit together
+    query = f"""
+        WITH drained AS (
+            DELETE FROM {COURSE_RATING_DELTAS_TABLE} {delta_condition}
+        )
+        UPDATE courses c
+        SET (rating_sum, rating_count, average_rating) = (
+            SELECT COALESCE(SUM(r.rating), 0), COUNT(*), AVG(r.rating)
+            FROM {COURSE_RATINGS_TABLE} r
+            WHERE r.course_hash = c.hash
+        )
+        {condition}
+    """
+    async with Database.atomic() as conn:
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", RATING_AGGREGATE_LOCK)
+        if periodic:
+            now = datetime.utcnow()
+            due = await conn.fetchval(
+                f"""
+                INSERT INTO {COURSE_RATING_STATE_TABLE} AS state (id, recomputed_at)
+                VALUES (TRUE, $1)
+                ON CONFLICT (id) DO UPDATE SET recomputed_at = EXCLUDED.recomputed_at
+                WHERE state.recomputed_at < $2
+                RETURNING TRUE
+                """,
+                now, now - timedelta(seconds=RATING_RECOMPUTE_INTERVAL)
+            )
+            if not due:
+                return 0
+        status = await conn.execute(query, *params)
+    await publish("course", course_hash)
+    return int(status.split()[-1])
+
+
+async def _rating_flush_loop():
+    since_recompute = 0.0
+    while True:
+        await asyncio.sleep(RATING_FLUSH_INTERVAL)
+        since_recompute += RATING_FLUSH_INTERVAL
+        try:
+            await flush_rating_aggregates()
+            if since_recompute >= RATING_RECOMPUTE_INTERVAL:
+                since_recompute = 0.0
+                await recompute_rating_aggregates(periodic=True)
+        except Exception as e:
+            logger.error(f"Rating aggregate flush failed: {str(e)}")
+
+
+def start_rating_flusher():
+    """Start the periodic flush/recompute task on the running loop"""
+    global _flush_task
+    if _flush_task is None:
+        _flush_task = asyncio.get_event_loop().create_task(_rating_flush_loop())
+
+
+async def stop_rating_flusher():
+    """Stop the periodic task; queued deltas stay in the table for the next flush"""
+    global _flush_task
+    if _flush_task is not None:
+        _flush_task.cancel()
+        _flush_task = None
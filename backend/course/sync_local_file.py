@@ -1,4 +1,5 @@
 from sanic import Blueprint, json
+import asyncio
 import os
 import json as json_lib
 from database import Database
@@ -6,6 +7,11 @@ import uuid
 from datetime import datetime
 from decimal import Decimal
 from os import getenv
+from course.course_lesson import ORDER_GAP
+from utils.invalidation import publish
+from utils.precompress import precompress_tree
+from utils.media_clip import prewarm_clips
+from utils.waveform import generate_tree_peaks
 
 sync_course_local_bp = Blueprint("sync_course_local", url_prefix="/api/v1/sync")
 
@@ -138,6 +144,8 @@ async def sync_courses(request):
             "lessons_updated": 0,
             "errors": []
         }
+        # (file_path, lesson_content) of dubbing lessons whose clips get prewarmed
+        dubbing_lessons = []
 
         for folder_name in os.listdir(data_folder):
             folder_path = os.path.join(data_folder, folder_name) 
@@ -153,6 +161,7 @@ async def sync_courses(request):
 
                 query = "SELECT hash FROM courses WHERE folder_name = $1"
                 course_hash = await Database.fetchval(query, folder_name)
+                language_code = normalize_language_code(course_data.get('language', 'EN'))
 
                 if not course_hash:
                     course_hash = str(uuid.uuid4())[:8]
@@ -169,7 +178,6 @@ async def sync_courses(request):
                     """
                     
                     now = datetime.utcnow()
-                    language_code = normalize_language_code(course_data.get('language', 'EN'))
                     difficulty_code = normalize_difficulty(course_data.get('difficulty', 'BEG'))
                     
                     await Database.execute(
@@ -205,6 +213,7 @@ async def sync_courses(request):
 
                 # Process lessons
                 lessons = await get_lesson_files(folder_path, folder_name)
+                synced_lesson_hashes = []
                 for index, lesson in enumerate(lessons):
                     lesson_hash = str(uuid.uuid4())[:8]
                     
@@ -220,7 +229,10 @@ async def sync_courses(request):
 
                     # Use existing lesson hash or create new one
                     current_lesson_hash = existing_lesson if existing_lesson else lesson_hash
+                    synced_lesson_hashes.append(current_lesson_hash)
 
+                    # Only new lessons and changed content need their clips cut
+                    content_changed = True
                     if not existing_lesson:
                         # Create new lesson
                         create_lesson_query = """
@@ -229,10 +241,10 @@ async def sync_courses(request):
                                 lesson_resources, description, target, base_knowledges,
                                 target_knowledges, duration_minutes, is_active,
                                 is_preview, is_published, created_by, created_at, updated_at,
-                                from_course
+                                from_course, language
                             ) VALUES (
                                 $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11,
-                                true, false, true, 'SYSTEM', $12, $12, $13
+                                true, false, true, 'SYSTEM', $12, $12, $13, $14
                             )
                         """
                         now = datetime.utcnow()
@@ -250,21 +262,27 @@ async def sync_courses(request):
                             json_lib.dumps(lesson['target_knowledges']),
                             lesson['duration_minutes'],
                             now,
-                            folder_name  # Add folder_name as from_course
+                            folder_name,  # Add folder_name as from_course
+                            language_code  # Course language drives lesson text search
                         )
                         sync_results["lessons_created"] += 1
                     else:
                         # Update existing lesson
                         update_lesson_query = """
-                            UPDATE lessons 
+                            UPDATE lessons l
                             SET title = $2, lesson_type = $3, lesson_content = $4,
                                 lesson_resources = $5, description = $6, target = $7,
                                 base_knowledges = $8, target_knowledges = $9,
                                 duration_minutes = $10, updated_at = $11,
-                                from_course = $12
-                            WHERE hash = $1
+                                from_course = $12, language = $13,
+                                content_version = l.content_version + 1
+                            FROM (
+                                SELECT hash, content_hash FROM lessons WHERE hash = $1 FOR UPDATE
+                            ) previous
+                            WHERE l.hash = previous.hash
+                            RETURNING l.content_hash IS DISTINCT FROM previous.content_hash
                         """
-                        await Database.execute(
+                        content_changed = await Database.fetchval(
                             update_lesson_query,
                             current_lesson_hash,
                             lesson['title'],
@@ -277,10 +295,14 @@ async def sync_courses(request):
                             json_lib.dumps(lesson['target_knowledges']),
                             lesson['duration_minutes'],
                             datetime.utcnow(),
-                            folder_name  # Add folder_name as from_course
+                            folder_name,  # Add folder_name as from_course
+                            language_code
                         )
                         sync_results["lessons_updated"] += 1
 
+                    if lesson['lesson_type'] == 'DUBBING' and content_changed:
+                        dubbing_lessons.append((lesson['file_path'], lesson['lesson_content']))
+
                     # Check if course-lesson relationship exists
                     relation_query = """
                         SELECT course_hash FROM course_lessons 
@@ -303,7 +325,7 @@ async def sync_courses(request):
                             create_relation_query,
                             course_hash,
                             current_lesson_hash,
-                            index  # Use the loop index as order_index
+                            index * ORDER_GAP  # Gapped loop index as order_index
                         )
                     else:
                         # Update existing relationship order
@@ -316,18 +338,32 @@ async def sync_courses(request):
                             update_relation_query,
                             course_hash,
                             current_lesson_hash,
-                            index
+                            index * ORDER_GAP
                         )
 
                 # Clean up old course-lesson relationships that are no longer valid
-                current_lesson_hashes = [
-                    existing_lesson if existing_lesson else str(uuid.uuid4())[:8]
-                    for lesson in lessons
-                ]
+                await Database.execute("""
+                    DELETE FROM course_lessons
+                    WHERE course_hash = $1 AND NOT (lesson_hash = ANY($2::text[]))
+                """, course_hash, synced_lesson_hashes)
+
+                await publish("course", course_hash)
 
             except Exception as e:
                 sync_results["errors"].append(f"Error processing {folder_name}: {str(e)}")
 
+        # Lessons are rewritten in bulk, so drop every cached lesson at once
+        await publish("lesson")
+
+        # Refresh the .br/.gz siblings of course JSON served under /data
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, precompress_tree, data_folder)
+
+        # Cut sentence clips in the background so the first learners hit the cache
+        if dubbing_lessons:
+            request.app.add_task(prewarm_clips(dubbing_lessons))
+        # Waveform peaks for new or replaced course audio
+        request.app.add_task(generate_tree_peaks(data_folder))
         return json(sync_results)
 
     except Exception as e:
@@ -1,7 +1,9 @@
 import os
+import asyncio
 import asyncpg
 import logging
-from typing import Any, List, Optional, Union
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Union
 from dotenv import load_dotenv
 
 # Configure logging
@@ -15,8 +17,42 @@ load_dotenv()
 DATABASE_URL = os.getenv('DATABASE_URL')
 print(DATABASE_URL)
 
+# Idempotent DDL (CREATE ... IF NOT EXISTS, ADD COLUMN IF NOT EXISTS) registered
+# by feature modules at import time and applied once by init_db()
+_schema_statements: List[str] = []
+
+def register_schema(*statements: str) -> None:
+    """Register idempotent DDL statements to run when the pool is initialized"""
+    _schema_statements.extend(statements)
+
+def column_compression(table: str, column: str, method: str = "lz4") -> str:
+    """
+    DDL moving a TOASTable column to another compression method for values
+    written from now on. Skipped before PostgreSQL 14, when the column already
+    uses it, or when the server was built without the method.
+    """
+    return f"""
+    DO $$
+    BEGIN
+        IF current_setting('server_version_num')::int >= 140000 THEN
+            IF (
+                SELECT attcompression FROM pg_attribute
+                WHERE attrelid = '{table}'::regclass AND attname = '{column}'
+            ) IS DISTINCT FROM '{method[0]}' THEN
+                EXECUTE 'ALTER TABLE {table} ALTER COLUMN {column} SET COMPRESSION {method}';
+            END IF;
+        END IF;
+    EXCEPTION WHEN feature_not_supported OR invalid_parameter_value THEN
+        RAISE NOTICE 'compression % unavailable for {table}.{column}', '{method}';
+    END $$
+    """
+
 class Database:
     _pool: Optional[asyncpg.Pool] = None
+    _listener: Optional[asyncpg.Connection] = None
+    _subscribers: Dict[str, List[Callable[[str], Awaitable[None]]]] = {}
+    _reconnect_callbacks: List[Callable[[], Awaitable[None]]] = []
+    _reconnecting: Optional["asyncio.Future"] = None
     _min_size: int = 2
     _max_size: int = 10
     _timeout: float = 30.0  # Connection timeout in seconds
@@ -89,16 +125,122 @@ class Database:
         pool = await cls.get_pool()
         return await pool.acquire()
 
+    @classmethod
+    @asynccontextmanager
+    async def atomic(cls) -> AsyncIterator[asyncpg.Connection]:
+        """Yield a pooled connection wrapped in a transaction, released on exit"""
+        pool = await cls.get_pool()
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                yield conn
+
+    @classmethod
+    async def listen(cls, channel: str, callback: Callable[[str], Awaitable[None]]) -> None:
+        """
+        Subscribe callback(payload) to NOTIFY on channel.
+
+        All channels share one dedicated connection per process, outside the
+        pool, since a LISTEN only lasts as long as its session. If that
+        connection drops it is reopened and every channel listened to again.
+        """
+        if cls._listener is None and cls._reconnecting is None:
+            await cls._connect_listener()
+        if channel not in cls._subscribers:
+            cls._subscribers[channel] = []
+            # While reconnecting, the new connection picks the channel up
+            if cls._listener is not None:
+                await cls._listener.add_listener(channel, cls._dispatch)
+        cls._subscribers[channel].append(callback)
+
+    @classmethod
+    def on_reconnect(cls, callback: Callable[[], Awaitable[None]]) -> None:
+        """
+        Call callback() after the listener connection has been reopened.
+        NOTIFYs sent while it was down are lost, so subscribers keeping
+        local copies should drop them here.
+        """
+        cls._reconnect_callbacks.append(callback)
+
+    @classmethod
+    async def _connect_listener(cls) -> None:
+        connection = await asyncpg.connect(DATABASE_URL, timeout=cls._timeout)
+        connection.add_termination_listener(cls._listener_lost)
+        for channel in cls._subscribers:
+            await connection.add_listener(channel, cls._dispatch)
+        cls._listener = connection
+
+    @classmethod
+    def _listener_lost(cls, connection) -> None:
+        if connection is not cls._listener:
+            # Closed by close_db
+            return
+        cls._listener = None
+        logger.warning("LISTEN connection lost, reconnecting")
+        cls._reconnecting = asyncio.ensure_future(cls._reconnect_listener())
+
+    @classmethod
+    async def _reconnect_listener(cls) -> None:
+        delay = 1.0
+        try:
+            while True:
+                try:
+                    await cls._connect_listener()
+                    break
+                except Exception as e:
+                    logger.error(f"LISTEN reconnect failed, retrying in {delay:.0f}s: {str(e)}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 30.0)
+        finally:
+            cls._reconnecting = None
+        logger.info("LISTEN connection restored")
+        for callback in cls._reconnect_callbacks:
+            task = asyncio.ensure_future(callback())
+            task.add_done_callback(_log_callback_error)
+
+    @classmethod
+    def _dispatch(cls, connection, pid, channel, payload) -> None:
+        for callback in cls._subscribers.get(channel, []):
+            task = asyncio.ensure_future(callback(payload))
+            task.add_done_callback(_log_callback_error)
+
+    @classmethod
+    async def notify(cls, channel: str, payload: str = "") -> None:
+        """Send NOTIFY on channel to every listening process"""
+        await cls.execute("SELECT pg_notify($1, $2)", channel, payload)
+
+def _log_callback_error(task: "asyncio.Future") -> None:
+    if not task.cancelled() and task.exception():
+        logger.error(f"Notification callback failed: {task.exception()}")
+
 async def init_db() -> None:
     """Initialize the database connection pool"""
     try:
         await Database.get_pool()
+        await apply_schema()
     except Exception as e:
         logger.error(f"Database initialization failed: {str(e)}")
         raise
 
+async def apply_schema() -> None:
+    """Apply all registered DDL statements"""
+    if not _schema_statements:
+        return
+    async with Database.atomic() as conn:
+        # Several workers start at once; serialize so IF NOT EXISTS does not race
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext('bamboo_schema'))")
+        for statement in _schema_statements:
+            await conn.execute(statement)
+    logger.info(f"Applied {len(_schema_statements)} schema statements")
+
 async def close_db() -> None:
     """Close the database connection pool"""
+    if Database._reconnecting:
+        Database._reconnecting.cancel()
+        Database._reconnecting = None
+    if Database._listener:
+        listener, Database._listener = Database._listener, None
+        await listener.close()
+    Database._subscribers = {}
     if Database._pool:
         try:
             await Database._pool.close()
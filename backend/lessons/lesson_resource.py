@@ -1,6 +1,9 @@
 from sanic import Blueprint
 from sanic.response import json
 from sanic.exceptions import InvalidUsage, NotFound
+from database import Database, register_schema
+from utils.ownership import owned_write, write_error, authenticated
+from datetime import datetime
 import asyncpg
 import os
 from dotenv import load_dotenv
@@ -10,7 +13,81 @@ TABLE_PREFIX = os.getenv('DATABASE_TABLE_PREFIX', '')
 
 lesson_resource_bp = Blueprint('lesson_resource_bp', url_prefix='/api/lesson-resources')
 
+# Upper bound on hashes accepted by the batch lookups
+MAX_BATCH_SIZE = 500
+
+# The primary key serves lookups by lesson, the second index lookups by resource
+register_schema(
+    """
+    CREATE TABLE IF NOT EXISTS {0}_lesson_resources (
+        lesson_hash TEXT NOT NULL,
+        resource_hash TEXT NOT NULL,
+        order_index INTEGER NOT NULL DEFAULT 0,
+        is_visible BOOLEAN NOT NULL DEFAULT true,
+        created_at TIMESTAMP NOT NULL DEFAULT now(),
+        PRIMARY KEY (lesson_hash, resource_hash)
+    )
+    """.format(TABLE_PREFIX),
+    """
+    CREATE INDEX IF NOT EXISTS {0}_lesson_resources_resource_idx
+    ON {0}_lesson_resources (resource_hash, lesson_hash)
+    """.format(TABLE_PREFIX),
+)
+
+LESSON_RESOURCE_COLUMNS = """
+    lr.lesson_hash, lr.resource_hash, lr.order_index, lr.is_visible, lr.created_at,
+    r.title as resource_name, r.description as resource_description,
+    r.resource_type, r.status as resource_status
+"""
+
+RESOURCE_LESSON_COLUMNS = """
+    lr.lesson_hash, lr.resource_hash, lr.order_index, lr.is_visible, lr.created_at,
+    l.title as lesson_name, l.description as lesson_description, l.lesson_type
+"""
+
+def serialize_row(row):
+    row_dict = dict(row)
+    for key, value in row_dict.items():
+        if isinstance(value, datetime):
+            row_dict[key] = value.isoformat()
+    return row_dict
+
+def batch_hashes(request, name):
+    """
+    Hashes from a JSON body list or a query parameter (repeated and/or
+    comma-separated). InvalidUsage if there are more than MAX_BATCH_SIZE.
+    """
+    if request.method == "POST":
+        values = (request.json or {}).get(name) or []
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise InvalidUsage(f"{name} must be a list of strings")
+    else:
+        values = []
+        for value in request.args.getlist(name, []):
+            values.extend(value.split(','))
+    hashes = list(dict.fromkeys(value.strip() for value in values if value.strip()))
+    if len(hashes) > MAX_BATCH_SIZE:
+        raise InvalidUsage(f"At most {MAX_BATCH_SIZE} {name} per request")
+    return hashes
+
+def course_hash_arg(request):
+    if request.method == "POST":
+        return (request.json or {}).get('course_hash')
+    return request.args.get('course_hash')
+
+# Appended to a write on the associations: links may only be changed by
+# whoever may change the lesson ({owner} is filled in by owned_write)
+LESSON_OWNED = "EXISTS (SELECT 1 FROM lessons WHERE hash = $1 AND {owner})"
+
+def group_rows(rows, key, hashes):
+    """{hash: [rows]} with an entry, possibly empty, for every requested hash"""
+    grouped = {hash: [] for hash in hashes}
+    for row in rows:
+        grouped.setdefault(row[key], []).append(serialize_row(row))
+    return grouped
+
 @lesson_resource_bp.post("/create")
+@authenticated
 async def create_lesson_resource(request):
     """Create a new lesson resource association"""
     data = request.json
@@ -20,27 +97,30 @@ async def create_lesson_resource(request):
             raise InvalidUsage(f"Missing required field: {field}")
     
     try:
-        pool = request.app.ctx.db_pool
-        
         query = """
             INSERT INTO {}_lesson_resources (
                 lesson_hash, resource_hash, order_index, is_visible
-            ) VALUES ($1, $2, $3, $4)
+            )
+            SELECT $1::text, $2::text, $3::int, $4::boolean
+            WHERE {}
             RETURNING lesson_hash, resource_hash, order_index, is_visible, created_at
-        """.format(TABLE_PREFIX)
+        """.format(TABLE_PREFIX, LESSON_OWNED)
         
-        result = await pool.fetchrow(
-            query,
-            data['lesson_hash'],
-            data['resource_hash'],
-            data.get('order_index', 0),
-            data.get('is_visible', True)
+        write = await owned_write(
+            Database, "lessons", data['lesson_hash'], request.ctx.user, query, [
+                data['lesson_hash'],
+                data['resource_hash'],
+                data.get('order_index', 0),
+                data.get('is_visible', True)
+            ]
         )
+        if not write.written:
+            return write_error(write, "lesson")
         
         return json({
             'status': 'success',
             'message': 'Lesson resource created successfully',
-            'data': dict(result)
+            'data': serialize_row(write.row)
         })
         
     except asyncpg.UniqueViolationError:
@@ -57,33 +137,32 @@ async def create_lesson_resource(request):
 @lesson_resource_bp.get("/<lesson_hash>/<resource_hash>")
 async def get_lesson_resource(request, lesson_hash, resource_hash):
     """Get lesson resource details"""
-    pool = request.app.ctx.db_pool
     query = """
         SELECT lesson_hash, resource_hash, order_index, is_visible, created_at
         FROM {}_lesson_resources
         WHERE lesson_hash = $1 AND resource_hash = $2
     """.format(TABLE_PREFIX)
     
-    result = await pool.fetchrow(query, lesson_hash, resource_hash)
+    result = await Database.fetchrow(query, lesson_hash, resource_hash)
     
     if not result:
         raise NotFound('Lesson resource association not found')
         
     return json({
         'status': 'success',
-        'data': dict(result)
+        'data': serialize_row(result)
     })
 
 @lesson_resource_bp.put("/<lesson_hash>/<resource_hash>")
+@authenticated
 async def update_lesson_resource(request, lesson_hash, resource_hash):
     """Update lesson resource details"""
     data = request.json
-    pool = request.app.ctx.db_pool
-    
-    # Build update query dynamically based on provided fields
+    # Build update query dynamically based on provided fields;
+    # $1 and $2 are the lesson and resource
     update_fields = []
-    values = []
-    param_count = 1
+    values = [lesson_hash, resource_hash]
+    param_count = 3
     
     updateable_fields = ['order_index', 'is_visible']
     
@@ -99,45 +178,45 @@ async def update_lesson_resource(request, lesson_hash, resource_hash):
             'message': 'No fields to update'
         }, status=400)
     
-    values.extend([lesson_hash, resource_hash])
     query = """
         UPDATE {}_lesson_resources
         SET {}
-        WHERE lesson_hash = ${} AND resource_hash = ${}
+        WHERE lesson_hash = $1 AND resource_hash = $2 AND {}
         RETURNING *
     """.format(
         TABLE_PREFIX,
         ", ".join(update_fields),
-        param_count,
-        param_count + 1
+        LESSON_OWNED
     )
     
-    result = await pool.fetchrow(query, *values)
-    
-    if not result:
+    write = await owned_write(Database, "lessons", lesson_hash, request.ctx.user, query, values)
+    if not write.written:
+        if not (write.found and write.allowed):
+            return write_error(write, "lesson")
         raise NotFound('Lesson resource association not found')
     
     return json({
         'status': 'success',
         'message': 'Lesson resource updated successfully',
-        'data': dict(result)
+        'data': serialize_row(write.row)
     })
 
 @lesson_resource_bp.delete("/<lesson_hash>/<resource_hash>")
+@authenticated
 async def delete_lesson_resource(request, lesson_hash, resource_hash):
     """Delete a lesson resource association"""
-    pool = request.app.ctx.db_pool
-    
-    result = await pool.execute(
-        """
+    query = """
         DELETE FROM {}_lesson_resources
-        WHERE lesson_hash = $1 AND resource_hash = $2
-        """.format(TABLE_PREFIX),
-        lesson_hash,
-        resource_hash
-    )
+        WHERE lesson_hash = $1 AND resource_hash = $2 AND {}
+        RETURNING lesson_hash
+    """.format(TABLE_PREFIX, LESSON_OWNED)
     
-    if result == "DELETE 0":
+    write = await owned_write(
+        Database, "lessons", lesson_hash, request.ctx.user, query, [lesson_hash, resource_hash]
+    )
+    if not write.written:
+        if not (write.found and write.allowed):
+            return write_error(write, "lesson")
         raise NotFound('Lesson resource association not found')
     
     return json({
@@ -148,39 +227,89 @@ async def delete_lesson_resource(request, lesson_hash, resource_hash):
 @lesson_resource_bp.get("/lesson/<lesson_hash>")
 async def list_lesson_resources(request, lesson_hash):
     """List all resources for a specific lesson"""
-    pool = request.app.ctx.db_pool
-    
     query = """
-        SELECT lr.*, r.name as resource_name, r.description as resource_description
+        SELECT {1}
         FROM {0}_lesson_resources lr
         LEFT JOIN {0}_resources r ON lr.resource_hash = r.hash
         WHERE lr.lesson_hash = $1
         ORDER BY lr.order_index ASC
-    """.format(TABLE_PREFIX)
+    """.format(TABLE_PREFIX, LESSON_RESOURCE_COLUMNS)
     
-    results = await pool.fetch(query, lesson_hash)
+    results = await Database.fetch(query, lesson_hash)
     
     return json({
         'status': 'success',
-        'data': [dict(row) for row in results]
+        'data': [serialize_row(row) for row in results]
     })
 
 @lesson_resource_bp.get("/resource/<resource_hash>")
 async def list_resource_lessons(request, resource_hash):
     """List all lessons for a specific resource"""
-    pool = request.app.ctx.db_pool
-    
     query = """
-        SELECT lr.*, l.name as lesson_name, l.description as lesson_description
+        SELECT {1}
         FROM {0}_lesson_resources lr
-        LEFT JOIN {0}_lessons l ON lr.lesson_hash = l.hash
+        LEFT JOIN lessons l ON lr.lesson_hash = l.hash
         WHERE lr.resource_hash = $1
         ORDER BY lr.order_index ASC
-    """.format(TABLE_PREFIX)
+    """.format(TABLE_PREFIX, RESOURCE_LESSON_COLUMNS)
     
-    results = await pool.fetch(query, resource_hash)
+    results = await Database.fetch(query, resource_hash)
     
     return json({
         'status': 'success',
-        'data': [dict(row) for row in results]
-    }) 
\ No newline at end of file
+        'data': [serialize_row(row) for row in results]
+    })
+
+@lesson_resource_bp.route("/lessons", methods=["GET", "POST"])
+async def list_lessons_resources(request):
+    """
+    Resources of many lessons at once, grouped by lesson: pass lesson_hashes
+    (query parameter or JSON body) or a course_hash for all of its lessons,
+    not both. Every lesson gets an entry, [] if it has no resources.
+    """
+    lesson_hashes = batch_hashes(request, 'lesson_hashes')
+    course_hash = course_hash_arg(request)
+    if bool(lesson_hashes) == bool(course_hash):
+        raise InvalidUsage("Provide either lesson_hashes or course_hash")
+
+    if course_hash:
+        # The course's lessons in course order, so grouping lists them all
+        lesson_hashes = [row['lesson_hash'] for row in await Database.fetch(
+            "SELECT lesson_hash FROM course_lessons WHERE course_hash = $1 ORDER BY order_index ASC",
+            course_hash
+        )]
+
+    query = """
+        SELECT {1}
+        FROM {0}_lesson_resources lr
+        LEFT JOIN {0}_resources r ON lr.resource_hash = r.hash
+        WHERE lr.lesson_hash = ANY($1::text[])
+        ORDER BY lr.lesson_hash, lr.order_index ASC
+    """.format(TABLE_PREFIX, LESSON_RESOURCE_COLUMNS)
+    results = await Database.fetch(query, lesson_hashes)
+
+    return json({
+        'status': 'success',
+        'data': group_rows(results, 'lesson_hash', lesson_hashes)
+    })
+
+@lesson_resource_bp.route("/resources", methods=["GET", "POST"])
+async def list_resources_lessons(request):
+    """Lessons of many resources at once (resource_hashes), grouped by resource"""
+    resource_hashes = batch_hashes(request, 'resource_hashes')
+    if not resource_hashes:
+        raise InvalidUsage("Provide resource_hashes")
+
+    query = """
+        SELECT {1}
+        FROM {0}_lesson_resources lr
+        LEFT JOIN lessons l ON lr.lesson_hash = l.hash
+        WHERE lr.resource_hash = ANY($1::text[])
+        ORDER BY lr.resource_hash, lr.order_index ASC
+    """.format(TABLE_PREFIX, RESOURCE_LESSON_COLUMNS)
+    results = await Database.fetch(query, resource_hashes)
+
+    return json({
+        'status': 'success',
+        'data': group_rows(results, 'resource_hash', resource_hashes)
+    })
@@ -2,6 +2,8 @@ from sanic import Blueprint, json
 from database import Database
 from datetime import datetime
 from utils.auth import admin_required
+from utils.http_cache import envelope_bytes, strong_etag, bytes_response
+from utils.invalidation import on_invalidate, publish
 
 lesson_type_bp = Blueprint("lesson_type", url_prefix="/api/v1/lesson-types")
 
@@ -13,6 +15,60 @@ def serialize_lesson_type(lesson_type):
             lesson_type_dict[key] = value.isoformat()
     return lesson_type_dict
 
+class LessonTypeRegistry:
+    """
+    Process-wide copy of lesson_types, loaded at startup and reloaded on every
+    "lesson_type" invalidation, whichever worker made the write. Responses are
+    kept as pre-serialized bytes with their ETags.
+    """
+    _loaded = False
+    _list_body = None
+    _list_etag = None
+    _by_name = {}  # name -> (body, etag)
+    _generation = 0
+
+    @classmethod
+    async def load(cls):
+        # Reloads can overlap (a local write, its NOTIFY, a listener
+        # reconnect); only the one started last may replace the copy, so a
+        # slow reload that read older rows cannot finish last and win
+        cls._generation += 1
+        generation = cls._generation
+        query = "SELECT * FROM lesson_types ORDER BY created_at DESC"
+        lesson_types = [serialize_lesson_type(lt) for lt in await Database.fetch(query)]
+
+        by_name = {}
+        for lesson_type in lesson_types:
+            body = envelope_bytes(lesson_type)
+            by_name[lesson_type['name']] = (body, strong_etag(body))
+        list_body = envelope_bytes([lt for lt in lesson_types if lt.get('is_active')])
+
+        if generation != cls._generation:
+            return
+        cls._by_name = by_name
+        cls._list_body = list_body
+        cls._list_etag = strong_etag(list_body)
+        cls._loaded = True
+
+    @classmethod
+    async def ensure_loaded(cls):
+        if not cls._loaded:
+            await cls.load()
+
+    @classmethod
+    async def list_response(cls, request):
+        await cls.ensure_loaded()
+        return bytes_response(request, cls._list_body, etag=cls._list_etag)
+
+    @classmethod
+    async def get(cls, name):
+        """(body, etag) for one lesson type, or None"""
+        await cls.ensure_loaded()
+        return cls._by_name.get(name)
+
+# The table is small, so any change reloads all of it
+on_invalidate("lesson_type", lambda name: LessonTypeRegistry.load())
+
 @lesson_type_bp.route("/")
 async def lesson_type_root(request):
     return json({"message": "Lesson Types API"})
@@ -20,26 +76,20 @@ async def lesson_type_root(request):
 @lesson_type_bp.route("/list")
 async def lesson_type_list(request):
     try:
-        query = """
-            SELECT * FROM lesson_types 
-            WHERE is_active = true 
-            ORDER BY created_at DESC
-        """
-        lesson_types = await Database.fetch(query)
-        return json([serialize_lesson_type(lt) for lt in lesson_types])
+        return await LessonTypeRegistry.list_response(request)
     except Exception as e:
         return json({"error": str(e)}, status=500)
 
 @lesson_type_bp.route("/<name>")
 async def get_lesson_type(request, name):
     try:
-        query = "SELECT * FROM lesson_types WHERE name = $1"
-        lesson_type = await Database.fetchrow(query, name)
+        cached = await LessonTypeRegistry.get(name)
         
-        if not lesson_type:
+        if not cached:
             return json({"error": "Lesson type not found"}, status=404)
             
-        return json(serialize_lesson_type(lesson_type))
+        body, etag = cached
+        return bytes_response(request, body, etag=etag)
     except Exception as e:
         return json({"error": str(e)}, status=500)
 
@@ -80,6 +130,7 @@ async def create_lesson_type(request):
         )
         
         result = await Database.fetchval(query, *values)
+        await publish("lesson_type", result)
         return json({"name": result, "message": "Lesson type created successfully"})
         
     except Exception as e:
@@ -124,7 +175,8 @@ async def update_lesson_type(request, name):
         
         if not result:
             return json({"error": "Lesson type not found"}, status=404)
-            
+        
+        await publish("lesson_type", name)
         return json({"message": "Lesson type updated successfully"})
         
     except Exception as e:
@@ -220,7 +272,8 @@ async def toggle_lesson_type_status(request, name):
         
         if not result:
             return json({"error": "Lesson type not found"}, status=404)
-            
+        
+        await publish("lesson_type", name)
         return json({"message": "Lesson type status updated successfully"})
         
     except Exception as e:
@@ -240,7 +293,8 @@ async def delete_lesson_type(request, name):
         
         if not result:
             return json({"error": "Lesson type not found"}, status=404)
-            
+        
+        await publish("lesson_type", name)
         return json({
             "message": "Lesson type deleted successfully",
             "deleted": name
@@ -1,52 +1,98 @@
 from sanic import Blueprint, json
-from database import Database
+from sanic.exceptions import NotFound, SanicException
+from database import Database, register_schema, column_compression
 import uuid
 from datetime import datetime
 import json as json_lib  # Import json as json_lib to avoid conflict with sanic.json
-from functools import wraps
+from utils.invalidation import publish
+from utils.cache import cache_region, cached
+from search.search import tsquery_expr
+from utils.http_cache import version_etag, if_match_version, envelope_bytes, bytes_response
+from utils.media_clip import clip_cache, lesson_source_path, ClipError, CLIP_CACHE_PATH, DEFAULT_CLIP_FORMAT
+from utils.static_files import send_file
+from utils.ownership import owned_write, write_error, authenticated
+from collections import OrderedDict
+import os
 
 lessons_bp = Blueprint("lessons", url_prefix="/api/v1/lessons")
 
+# Full lesson rows include lesson_content, so this region is bounded by bytes
+lesson_cache = cache_region("lesson", ttl=60, stale_ttl=300, max_bytes=32 * 1024 * 1024)
+
 ALL_LESSON_TYPES = ['DUBBING', 'READING', 'LISTENING', 'SPEAKING', 'QUIZ', 'VIDEO', 'EXERCISE']
 LESSON_TYPES = ['DUBBING', 'SPEAKING', 'CODING', 'BASIC']
 
+# Bumped on every lesson_content write; exposed as the ETag for If-Match
+register_schema(
+    "ALTER TABLE lessons ADD COLUMN IF NOT EXISTS content_version INTEGER NOT NULL DEFAULT 1",
+    # Content address of the heavy, shared part of a lesson
+    """
+    ALTER TABLE lessons ADD COLUMN IF NOT EXISTS content_hash TEXT
+    GENERATED ALWAYS AS (md5(
+        coalesce(lesson_content::text, '') || E'\\x1f' ||
+        coalesce(target::text, '') || E'\\x1f' ||
+        coalesce(base_knowledges::text, '') || E'\\x1f' ||
+        coalesce(target_knowledges::text, '')
+    )) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS lessons_content_hash_idx ON lessons (content_hash)",
+    column_compression("lessons", "lesson_content"),
+    # lesson_content as a JSON object; empty, non-object and legacy non-JSON
+    # text all read as {} instead of failing the cast
+    """
+    CREATE OR REPLACE FUNCTION lesson_content_object(content TEXT) RETURNS jsonb
+    LANGUAGE plpgsql IMMUTABLE AS $$
+    DECLARE
+        parsed jsonb;
+    BEGIN
+        parsed := NULLIF(content, '')::jsonb;
+        RETURN CASE WHEN jsonb_typeof(parsed) = 'object' THEN parsed ELSE '{}'::jsonb END;
+    EXCEPTION WHEN invalid_text_representation THEN
+        RETURN '{}'::jsonb;
+    END
+    $$
+    """,
+)
+
+# Fields served by /content/<content_hash> instead of inline in user lessons
+CONTENT_FIELDS = ['lesson_content', 'target', 'base_knowledges', 'target_knowledges']
+# Left out of listings, which never render lesson bodies; the content columns
+# are TOASTed and would otherwise be decompressed and shipped for every row
+LISTING_DROP_FIELDS = ['search_vector'] + CONTENT_FIELDS
+
+# Serialized content bodies keyed by content_hash, bounded by total bytes.
+# Entries never go stale: a content change produces a new hash.
+CONTENT_CACHE_MAX_BYTES = int(os.getenv('LESSON_CONTENT_CACHE_BYTES', 64 * 1024 * 1024))
+_content_cache = OrderedDict()
+_content_cache_bytes = 0
+
+def _cache_content(content_hash, body):
+    global _content_cache_bytes
+    if len(body) > CONTENT_CACHE_MAX_BYTES:
+        return
+    _content_cache[content_hash] = body
+    _content_cache_bytes += len(body)
+    while _content_cache_bytes > CONTENT_CACHE_MAX_BYTES:
+        _, evicted = _content_cache.popitem(last=False)
+        _content_cache_bytes -= len(evicted)
+
+def content_url(content_hash):
+    return f"/api/v1/lessons/content/{content_hash}"
+
+# lesson_content as a JSON object, treating empty, non-object or unparsable content as {}
+CURRENT_CONTENT_SQL = "lesson_content_object(lesson_content::text)"
+
 
 def serialize_lesson(lesson):
     lesson_dict = dict(lesson)
+    # Internal full-text index column, never part of the API
+    lesson_dict.pop('search_vector', None)
     # Convert datetime objects to ISO format strings
     for key, value in lesson_dict.items():
         if isinstance(value, datetime):
             lesson_dict[key] = value.isoformat()
     return lesson_dict
 
-def check_lesson_ownership(func):
-    @wraps(func)
-    async def wrapper(request, *args, **kwargs):
-        try:
-            lesson_hash = kwargs.get('lesson_hash')
-            user = request.ctx.user if hasattr(request.ctx, 'user') else None
-            
-            if not user:
-                return json({"error": "Authentication required"}, status=401)
-            
-            # Check if user is admin
-            if user['role'] == 'admin':
-                return await func(request, *args, **kwargs)
-            
-            # Check lesson ownership
-            query = "SELECT created_by FROM lessons WHERE hash = $1"
-            created_by = await Database.fetchval(query, lesson_hash)
-            
-            if not created_by or created_by != user['hash']:
-                return json({"error": "You don't have permission to modify this lesson"}, status=403)
-            
-            return await func(request, *args, **kwargs)
-            
-        except Exception as e:
-            return json({"error": str(e)}, status=500)
-    
-    return wrapper
-
 @lessons_bp.route("/")
 async def lessons_root(request):
     return json({"message": "Lessons API"})
@@ -55,16 +101,48 @@ async def lessons_root(request):
 async def lessons_list(request):
     try:
         query = """
-            SELECT * FROM lessons 
+            SELECT to_jsonb(lessons) - $1::text[] AS item FROM lessons 
             WHERE is_active = true 
             ORDER BY created_at DESC
         """
-        lessons = await Database.fetch(query)
-        return json([serialize_lesson(lesson) for lesson in lessons])
+        lessons = await Database.fetch(query, LISTING_DROP_FIELDS)
+        return json([json_lib.loads(lesson['item']) for lesson in lessons])
+    except Exception as e:
+        return json({"error": str(e)}, status=500)
+
+@lessons_bp.route("/content/<content_hash>")
+async def get_lesson_content(request, content_hash):
+    """Lesson content by content hash; immutable, so clients may cache it forever."""
+    try:
+        body = _content_cache.get(content_hash)
+        if body is not None:
+            _content_cache.move_to_end(content_hash)
+        else:
+            query = f"""
+                SELECT {', '.join(CONTENT_FIELDS)}
+                FROM lessons
+                WHERE content_hash = $1
+                LIMIT 1
+            """
+            content = await Database.fetchrow(query, content_hash)
+            
+            if not content:
+                return json({"error": "Lesson content not found"}, status=404)
+            
+            body = envelope_bytes({"content_hash": content_hash, **dict(content)})
+            _cache_content(content_hash, body)
+        
+        return bytes_response(
+            request,
+            body,
+            etag=f'"{content_hash}"',
+            cache_control="private, max-age=31536000, immutable"
+        )
     except Exception as e:
         return json({"error": str(e)}, status=500)
 
 @lessons_bp.route("/<lesson_hash>")
+@cached(lesson_cache, key="{lesson_hash}", tags=["lesson:{lesson_hash}"])
 async def get_lesson(request, lesson_hash):
     try:
         query = "SELECT * FROM lessons WHERE hash = $1"
@@ -73,10 +151,46 @@ async def get_lesson(request, lesson_hash):
         if not lesson:
             return json({"error": "Lesson not found"}, status=404)
             
+        # The ETag is a hash of the body (set by @cached), so it changes with
+        # any field; If-Match for content patches uses content_version
         return json(serialize_lesson(lesson))
     except Exception as e:
         return json({"error": str(e)}, status=500)
 
+@lessons_bp.route("/<lesson_hash>/clip")
+async def get_lesson_clip(request, lesson_hash):
+    """
+    Audio for [start, end) seconds of a lesson's media, e.g. one dubbing
+    sentence: ?start=&end=&format=mp3|m4a|ogg&source=index.mp4
+    """
+    try:
+        file_path = await Database.fetchval("SELECT file_path FROM lessons WHERE hash = $1", lesson_hash)
+        if not file_path:
+            return json({"error": "Lesson not found"}, status=404)
+
+        source = lesson_source_path(file_path, request.args.get('source'))
+        async with clip_cache.pinned(
+            source,
+            request.args.get('start'),
+            request.args.get('end'),
+            request.args.get('format', DEFAULT_CLIP_FORMAT)
+        ) as relative:
+            # Clips are at most CLIP_MAX_SECONDS of low-bitrate speech, below
+            # send_file's streaming size, so it reads them while still pinned
+            return await send_file(request, CLIP_CACHE_PATH, relative, hashed_immutable=False,
+                                   cache_control="private, max-age=3600")
+    except NotFound:
+        return json({"error": "Lesson media not found"}, status=404)
+    except ValueError as e:
+        return json({"error": str(e)}, status=400)
+    except ClipError as e:
+        return json({"error": str(e)}, status=502)
+    except SanicException:
+        # e.g. 416 for an unsatisfiable Range
+        raise
+    except Exception as e:
+        return json({"error": str(e)}, status=500)
+
 @lessons_bp.route("/", methods=["POST"])
 async def create_lesson(request):
     try:
@@ -110,9 +224,11 @@ async def create_lesson(request):
                 hash, title, lesson_type, lesson_content, file_path,
                 description, target, base_knowledges,
                 target_knowledges, duration_minutes, is_active, is_preview,
-                is_published, created_by, created_at, updated_at, from_course
+                is_published, created_by, created_at, updated_at, from_course,
+                language
             ) VALUES (
-                $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $15, $16
+                $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $15, $16,
+                $17
             ) RETURNING hash
         """
         
@@ -133,10 +249,12 @@ async def create_lesson(request):
             data.get('is_published', False),
             created_by,
             now,
-            data.get('from_course')
+            data.get('from_course'),
+            data.get('language')
         )
         
         result = await Database.fetchval(query, *values)
+        await publish("lesson", result)
         return json({"hash": result, "message": "Lesson created successfully"})
         
     except Exception as e:
@@ -174,7 +292,7 @@ async def update_lesson(request, lesson_hash):
             'title', 'lesson_type', 'lesson_content', 'file_path',
             'thumbnail_path', 'description', 'target', 'base_knowledges',
             'target_knowledges', 'duration_minutes', 'is_active', 'is_preview',
-            'is_published', 'created_by', 'from_course'
+            'is_published', 'created_by', 'from_course', 'language'
         ]
         
         for field in updateable_fields:
@@ -186,6 +304,9 @@ async def update_lesson(request, lesson_hash):
         if not update_fields:
             return json({"error": "No valid fields to update"}, status=400)
         
+        if 'lesson_content' in data:
+            update_fields.append("content_version = content_version + 1")
+        
         # Add updated_at
         param_count += 1
         update_fields.append(f"updated_at = ${param_count}")
@@ -203,12 +324,80 @@ async def update_lesson(request, lesson_hash):
         
         if not result:
             return json({"error": "Lesson not found"}, status=404)
-            
+        
+        await publish("lesson", lesson_hash)
         return json({"message": "Lesson updated successfully"})
         
     except Exception as e:
         return json({"error": str(e)}, status=500)
 
+# Filters on these columns also get per-value counts when facets=true
+FACET_FIELDS = ['lesson_type', 'is_preview', 'is_published', 'from_course']
+
+async def fetch_lessons_with_facets(base_conditions, facet_conditions, values,
+                                    order_by, offset, page_size):
+    """
+    Fetch a page of lessons, the total and per-facet counts in one statement.
+
+    Facet counts are disjunctive: the counts for one facet apply every filter
+    except that facet's own, so the UI can show how many lessons each
+    alternative value would give.
+    """
+    match_columns = ", ".join(
+        f"({facet_conditions.get(field, 'TRUE')}) AS m_{field}" for field in FACET_FIELDS
+    )
+    all_match = " AND ".join(f"m_{field}" for field in FACET_FIELDS)
+    grouping_columns = ", ".join(f"GROUPING({field}) AS g_{field}" for field in FACET_FIELDS)
+    count_columns = ", ".join(
+        "COUNT(*) FILTER (WHERE {}) AS c_{}".format(
+            " AND ".join(f"m_{other}" for other in FACET_FIELDS if other != field), field
+        )
+        for field in FACET_FIELDS
+    )
+    grouping_sets = ", ".join(f"({field})" for field in FACET_FIELDS)
+
+    values = values + [
+        LISTING_DROP_FIELDS + [f"m_{field}" for field in FACET_FIELDS],
+        offset,
+        page_size
+    ]
+    drop_param, offset_param, limit_param = len(values) - 2, len(values) - 1, len(values)
+
+    query = f"""
+        WITH base AS (
+            SELECT lessons.*, {match_columns}
+            FROM lessons
+            WHERE {' AND '.join(base_conditions)}
+        ), matched AS (
+            SELECT * FROM base WHERE {all_match}
+        ), page AS (
+            SELECT to_jsonb(matched) - ${drop_param}::text[] AS item,
+                   ROW_NUMBER() OVER (ORDER BY {order_by}) AS position
+            FROM matched
+            ORDER BY {order_by}
+            OFFSET ${offset_param} LIMIT ${limit_param}
+        ), facet_rows AS (
+            SELECT {', '.join(FACET_FIELDS)}, {grouping_columns}, {count_columns}
+            FROM base
+            GROUP BY GROUPING SETS ({grouping_sets})
+        )
+        SELECT
+            (SELECT COUNT(*) FROM matched) AS total_count,
+            (SELECT COALESCE(json_agg(item ORDER BY position), '[]'::json) FROM page) AS items,
+            (SELECT COALESCE(json_agg(facet_rows), '[]'::json) FROM facet_rows) AS facets
+    """
+    row = await Database.fetchrow(query, *values)
+
+    facets = {field: [] for field in FACET_FIELDS}
+    for facet_row in json_lib.loads(row['facets']):
+        for field in FACET_FIELDS:
+            if facet_row[f"g_{field}"] == 0 and facet_row[f"c_{field}"]:
+                facets[field].append({"value": facet_row[field], "count": facet_row[f"c_{field}"]})
+    for counts in facets.values():
+        counts.sort(key=lambda item: item["count"], reverse=True)
+
+    return row['total_count'], json_lib.loads(row['items']), facets
+
 @lessons_bp.route("/search")
 async def search_lessons(request):
     try:
@@ -216,6 +405,9 @@ async def search_lessons(request):
         lesson_type = request.args.get('lesson_type')
         is_preview = request.args.get('is_preview')
         is_published = request.args.get('is_published')
+        from_course = request.args.get('from_course')
+        search_term = (request.args.get('q') or '').strip()
+        with_facets = request.args.get('facets', 'false').lower() == 'true'
         
         # Get pagination parameters
         page = int(request.args.get('page', 1))
@@ -230,8 +422,9 @@ async def search_lessons(request):
         # Calculate offset
         offset = (page - 1) * page_size
         
-        # Build query conditions
+        # Build query conditions; facet filters are kept apart for facet counts
         conditions = ["is_active = true"]
+        facet_conditions = {}
         values = []
         param_count = 0
         
@@ -240,51 +433,76 @@ async def search_lessons(request):
                 return json({"error": f"Invalid lesson type. Must be one of: {', '.join(LESSON_TYPES)}"}, 
                           status=400)
             param_count += 1
-            conditions.append(f"lesson_type = ${param_count}")
+            facet_conditions['lesson_type'] = f"lesson_type = ${param_count}"
             values.append(lesson_type)
             
         if is_preview is not None:
             param_count += 1
-            conditions.append(f"is_preview = ${param_count}")
+            facet_conditions['is_preview'] = f"is_preview = ${param_count}"
             values.append(is_preview.lower() == 'true')
             
         if is_published is not None:
             param_count += 1
-            conditions.append(f"is_published = ${param_count}")
+            facet_conditions['is_published'] = f"is_published = ${param_count}"
             values.append(is_published.lower() == 'true')
         
-        # Get total count
-        count_query = f"""
-            SELECT COUNT(*) FROM lessons 
-            WHERE {' AND '.join(conditions)}
-        """
-        total_count = await Database.fetchval(count_query, *values)
-        
-        # Get paginated results
-        param_count += 1
-        param_count += 1
-        query = f"""
-            SELECT * FROM lessons 
-            WHERE {' AND '.join(conditions)}
-            ORDER BY created_at DESC
-            OFFSET ${param_count-1} LIMIT ${param_count}
-        """
-        values.extend([offset, page_size])
+        if from_course:
+            param_count += 1
+            facet_conditions['from_course'] = f"from_course = ${param_count}"
+            values.append(from_course)
         
-        lessons = await Database.fetch(query, *values)
+        order_by = "created_at DESC"
+        if search_term:
+            # Full-text match served by the search_vector GIN index
+            param_count += 1
+            tsq = tsquery_expr(f"${param_count}")
+            conditions.append(f"search_vector @@ {tsq}")
+            values.append(search_term)
+            order_by = f"ts_rank_cd(search_vector, {tsq}, 32) DESC, created_at DESC"
+        
+        facets = None
+        if with_facets:
+            total_count, items, facets = await fetch_lessons_with_facets(
+                conditions, facet_conditions, values, order_by, offset, page_size
+            )
+        else:
+            conditions.extend(facet_conditions.values())
+            
+            # Get total count
+            count_query = f"""
+                SELECT COUNT(*) FROM lessons 
+                WHERE {' AND '.join(conditions)}
+            """
+            total_count = await Database.fetchval(count_query, *values)
+            
+            # Get paginated results
+            param_count += 3
+            query = f"""
+                SELECT to_jsonb(lessons) - ${param_count-2}::text[] AS item FROM lessons 
+                WHERE {' AND '.join(conditions)}
+                ORDER BY {order_by}
+                OFFSET ${param_count-1} LIMIT ${param_count}
+            """
+            values.extend([LISTING_DROP_FIELDS, offset, page_size])
+            
+            lessons = await Database.fetch(query, *values)
+            items = [json_lib.loads(lesson['item']) for lesson in lessons]
         
         # Calculate total pages
         total_pages = (total_count + page_size - 1) // page_size
         
-        return json({
-            "items": [serialize_lesson(lesson) for lesson in lessons],
+        response = {
+            "items": items,
             "pagination": {
                 "page": page,
                 "page_size": page_size,
                 "total_count": total_count,
                 "total_pages": total_pages
             }
-        })
+        }
+        if facets is not None:
+            response["facets"] = facets
+        return json(response)
         
     except ValueError as ve:
         return json({"error": "Invalid pagination parameters"}, status=400)
@@ -316,81 +534,104 @@ async def toggle_lesson_status(request, lesson_hash):
         
         if not result:
             return json({"error": "Lesson not found"}, status=404)
-            
+        
+        await publish("lesson", lesson_hash)
         return json({"message": f"Lesson {status_field} updated successfully"})
         
     except Exception as e:
         return json({"error": str(e)}, status=500)
 
 @lessons_bp.route("/<lesson_hash>", methods=["DELETE"])
-@check_lesson_ownership
+@authenticated
 async def delete_lesson(request, lesson_hash):
     try:
         # Soft delete by setting is_active to false
         query = """
             UPDATE lessons 
             SET is_active = false, updated_at = $2
-            WHERE hash = $1 
+            WHERE hash = $1 AND {owner}
             RETURNING hash
         """
         
-        result = await Database.fetchval(query, lesson_hash, datetime.utcnow())
+        write = await owned_write(
+            Database, "lessons", lesson_hash, request.ctx.user,
+            query, [lesson_hash, datetime.utcnow()]
+        )
+        if not write.written:
+            return write_error(write, "lesson")
         
-        if not result:
-            return json({"error": "Lesson not found"}, status=404)
-            
+        await publish("lesson", lesson_hash)
         return json({"message": "Lesson deleted successfully"})
         
     except Exception as e:
         return json({"error": str(e)}, status=500)
 
 @lessons_bp.route("/<lesson_hash>/content", methods=["PATCH"])
-@check_lesson_ownership
+@authenticated
 async def update_lesson_content(request, lesson_hash):
+    """
+    Merge the top-level keys of the body into lesson_content inside Postgres.
+
+    Send `If-Match: "<content_version>"` (the lesson's content_version
+    field, or the ETag of a previous patch response) to reject the write with 412 when
+    someone else changed the content since it was read. The response carries
+    only the patched keys unless `?full=true` is given.
+    """
     try:
         data = request.json
         
         if not isinstance(data, dict):
             return json({"error": "Request body must be a JSON object"}, status=400)
-            
-        # First, get the current lesson_content
-        query = "SELECT lesson_content FROM lessons WHERE hash = $1"
-        current_content = await Database.fetchval(query, lesson_hash)
         
-        if current_content is None:
-            return json({"error": "Lesson not found"}, status=404)
-            
-        try:
-            # Parse the current content
-            current_content = json_lib.loads(current_content) if current_content else {}
-        except json_lib.JSONDecodeError:
-            current_content = {}  # Reset to empty dict if current content is invalid
-            
-        # Update only the specified keys
-        current_content.update(data)
+        expected_version = if_match_version(request)
+        full = request.args.get('full', 'false').lower() == 'true'
         
-        # Update the lesson_content in the database
-        update_query = """
+        values = [json_lib.dumps(data), datetime.utcnow(), lesson_hash]
+        version_condition = ""
+        if expected_version is not None:
+            try:
+                values.append(int(expected_version))
+            except ValueError:
+                return json({"error": "If-Match must be a content version"}, status=400)
+            version_condition = f"AND content_version = ${len(values)}"
+        
+        update_query = f"""
             UPDATE lessons 
-            SET lesson_content = $1, updated_at = $2
-            WHERE hash = $3
-            RETURNING hash
+            SET lesson_content = {CURRENT_CONTENT_SQL} || $1::jsonb,
+                content_version = content_version + 1,
+                updated_at = $2
+            WHERE hash = $3 {version_condition} AND {{owner}}
+            RETURNING content_version{', lesson_content' if full else ''}
         """
         
-        result = await Database.fetchval(
-            update_query,
-            json_lib.dumps(current_content),
-            datetime.utcnow(),
-            lesson_hash
+        write = await owned_write(
+            Database, "lessons", lesson_hash, request.ctx.user, update_query, values,
+            current_columns=["content_version"]
         )
-        
-        if not result:
-            return json({"error": "Failed to update lesson content"}, status=500)
+        result = write.row
+        
+        if not write.written:
+            if not (write.found and write.allowed):
+                return write_error(write, "lesson")
+            current_version = write.current['content_version']
+            return json({
+                "error": "Lesson content was modified by someone else",
+                "content_version": current_version
+            }, status=412, headers={"ETag": version_etag(current_version)})
+        
+        await publish("lesson", lesson_hash)
+        
+        lesson_content = data
+        if full:
+            lesson_content = result['lesson_content']
+            if isinstance(lesson_content, str):
+                lesson_content = json_lib.loads(lesson_content)
             
         return json({
             "message": "Lesson content updated successfully",
-            "lesson_content": current_content
-        })
+            "content_version": result['content_version'],
+            "lesson_content": lesson_content
+        }, headers={"ETag": version_etag(result['content_version'])})
         
     except json_lib.JSONDecodeError:
         return json({"error": "Invalid JSON in request body"}, status=400)
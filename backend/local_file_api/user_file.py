@@ -9,122 +9,144 @@ import json  # Add this import
 import hashlib  # Add this import
 from models import UserSharesORM  # Add this import
 from database import get_session  # Add this import (ensure you have a session manager)
+from utils.upload import receive_multipart, discard_files, MultipartError, UploadTooLarge
+from utils.waveform import generate_peaks, PEAKS_SUFFIX
+from user.folder_index import folder_index
 
 load_dotenv()
 
 BASE_PATH = os.getenv('BASE_USER_DATA_PATH', 'data/user')
 BASE_COURSE_PATH = os.getenv('BASE_COURSE_DATA_PATH', 'data/course')
+UPLOAD_TMP_PATH = os.path.join(BASE_PATH, '.uploads')
 
 user_file_bp = Blueprint("user_file", url_prefix="api/v1/user-file")
 
+async def receive_audio_upload(request):
+    """
+    Stream the multipart body to a temp file and return (form, file) for its
+    single audio part. Anything else received is discarded.
+    """
+    try:
+        form, files = await receive_multipart(request, UPLOAD_TMP_PATH)
+    except UploadTooLarge as e:
+        raise SanicException(str(e), status_code=413)
+    except MultipartError as e:
+        raise SanicException(str(e), status_code=400)
+
+    file = files.pop("file", [None])[0]
+    await discard_files(files)
+    if file is None:
+        raise SanicException("No file part in the request", status_code=400)
+    
+    if not file.name or not file.type.startswith("audio/"):
+        await file.discard()
+        raise SanicException("Invalid file or not an audio file", status_code=400)
+    return form, file
+
 @user_file_bp.route("/")
 async def user_file_root(request):
     return sanic_json({"message": "User File API"})
 
-@user_file_bp.route("/upload-audio", methods=["POST"])
+@user_file_bp.route("/upload-audio", methods=["POST"], stream=True)
 async def upload_audio_file(request):
     if not request.ctx.user:
         raise SanicException("User not authenticated", status_code=401)
     
-    if "file" not in request.files:
-        raise SanicException("No file part in the request", status_code=400)
+    form, file = await receive_audio_upload(request)
+    try:
+        # Get course name, lesson, and user name from form data
+        course_id = form.get("course_id", "000000")
+        lesson = form.get("lesson", "0")
+        user_name = request.ctx.user.full_name  # Set user_name from request.ctx.user
 
-    file = request.files["file"][0]
-    
-    if not file.name or not file.type.startswith("audio/"):
-        raise SanicException("Invalid file or not an audio file", status_code=400)
+        # Get pronunciation data from form data
+        pronunciation_data = form.get("pronunciation_data")
+        if pronunciation_data:
+            pronunciation_data = json.loads(pronunciation_data)
 
-    # Get course name, lesson, and user name from form data
-    course_id = request.form.get("course_id", "000000")
-    lesson = request.form.get("lesson", "0")
-    user_name = request.ctx.user.full_name  # Set user_name from request.ctx.user
+        # Generate current date in YYYYMMDD format
+        current_date = datetime.now().strftime("%Y%m%d")
 
-    # Get pronunciation data from form data
-    pronunciation_data = request.form.get("pronunciation_data")
-    if pronunciation_data:
-        pronunciation_data = json.loads(pronunciation_data)
+        # Generate a unique filename based on course_id, lesson, and user_name
+        unique_string = f"{course_id}_{lesson}_{user_name}_{current_date}"
+        hashed_filename = hashlib.md5(unique_string.encode()).hexdigest()
+        filename = f"{hashed_filename}{os.path.splitext(file.name)[1]}"
 
-    # Generate current date in YYYYMMDD format
-    current_date = datetime.now().strftime("%Y%m%d")
+        # **Start of changes**
+        try:
+            session = next(get_session())
+            # Check if the hashed_filename already exists
+            existing_record = session.query(UserSharesORM).filter_by(hash=hashed_filename).first()
+            if existing_record:
+                # Delete existing record
+                session.delete(existing_record)
+                session.commit()
 
-    # Generate a unique filename based on course_id, lesson, and user_name
-    unique_string = f"{course_id}_{lesson}_{user_name}_{current_date}"
-    hashed_filename = hashlib.md5(unique_string.encode()).hexdigest()
-    filename = f"{hashed_filename}{os.path.splitext(file.name)[1]}"
-    
-    # **Start of changes**
-    try:
-        session = next(get_session())
-        # Check if the hashed_filename already exists
-        existing_record = session.query(UserSharesORM).filter_by(hash=hashed_filename).first()
-        if existing_record:
-            # Delete existing record
-            session.delete(existing_record)
-            session.commit()
-            
-            # Delete the existing file and pronunciation data if they exist
-            existing_file_path = os.path.join(BASE_PATH, existing_record.path, f"{existing_record.hash}{os.path.splitext(file.name)[1]}")
-            if os.path.exists(existing_file_path):
-                os.remove(existing_file_path)
-            pronunciation_file_path = os.path.join(BASE_PATH, existing_record.path, f"{existing_record.hash}_pronunciation.json")
+                # Delete the existing file and pronunciation data if they exist
+                existing_file_path = os.path.join(BASE_PATH, existing_record.path, f"{existing_record.hash}{os.path.splitext(file.name)[1]}")
+                if os.path.exists(existing_file_path):
+                    os.remove(existing_file_path)
+                pronunciation_file_path = os.path.join(BASE_PATH, existing_record.path, f"{existing_record.hash}_pronunciation.json")
+                if os.path.exists(pronunciation_file_path):
+                    os.remove(pronunciation_file_path)
+        except Exception as e:
+            session.rollback()
+            print(f"Error checking/deleting existing record: {str(e)}")
+        finally:
+            session.close()
+        # **End of changes**
+
+        # Define the upload directory
+        upload_dir = os.path.join(BASE_PATH, course_id, current_date)
+        os.makedirs(upload_dir, exist_ok=True)
+
+        file_path = os.path.join(upload_dir, filename)
+
+        # Delete the previous file if it exists
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            # Also delete the associated pronunciation data file if it exists
+            pronunciation_file_path = f"{file_path}_pronunciation.json"
             if os.path.exists(pronunciation_file_path):
                 os.remove(pronunciation_file_path)
-    except Exception as e:
-        session.rollback()
-        print(f"Error checking/deleting existing record: {str(e)}")
+
+        # Move the streamed audio file into place
+        await file.save(file_path)
+
+        # Save pronunciation data if available
+        if pronunciation_data:
+            pronunciation_file_path = os.path.join(upload_dir, f"{hashed_filename}_pronunciation.json")
+            with open(pronunciation_file_path, "w") as f:
+                json.dump(pronunciation_data, f)
+
+        # Add record to UserSharesORM instead of index.json
+        try:
+            session = next(get_session())
+            user_share = UserSharesORM(
+                mobile_phone=request.ctx.user.mobile_phone,
+                hash=hashed_filename,
+                path=f"{course_id}/{current_date}/",
+                course_id=course_id,
+                lesson=lesson,
+                user_name=user_name,
+                date=current_date,
+                has_pronunciation_data=bool(pronunciation_data)
+            )
+            session.add(user_share)
+            session.commit()  # Commit the transaction
+            session.close()  # Ensure the session is closed
+        except Exception as e:
+            session.rollback()  # Revert any changes due to the error
+            print(f"Error saving to database: {str(e)}")
+
+        return sanic_json({
+            "message": "Audio file and pronunciation data uploaded successfully",
+            "hash": hashed_filename,  # Changed from "filename" to "hash"
+            "path": f"{course_id}/{current_date}/{filename}"
+        }, status=201)
     finally:
-        session.close()
-    # **End of changes**
-    
-    # Define the upload directory
-    upload_dir = os.path.join(BASE_PATH, course_id, current_date)
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    file_path = os.path.join(upload_dir, filename)
-    
-    # Delete the previous file if it exists
-    if os.path.exists(file_path):
-        os.remove(file_path)
-        # Also delete the associated pronunciation data file if it exists
-        pronunciation_file_path = f"{file_path}_pronunciation.json"
-        if os.path.exists(pronunciation_file_path):
-            os.remove(pronunciation_file_path)
-
-    # Save the audio file
-    with open(file_path, "wb") as f:
-        f.write(file.body)
-
-    # Save pronunciation data if available
-    if pronunciation_data:
-        pronunciation_file_path = os.path.join(upload_dir, f"{hashed_filename}_pronunciation.json")
-        with open(pronunciation_file_path, "w") as f:
-            json.dump(pronunciation_data, f)
-
-    # Add record to UserSharesORM instead of index.json
-    try:
-        session = next(get_session())
-        user_share = UserSharesORM(
-            mobile_phone=request.ctx.user.mobile_phone,
-            hash=hashed_filename,
-            path=f"{course_id}/{current_date}/",
-            course_id=course_id,
-            lesson=lesson,
-            user_name=user_name,
-            date=current_date,
-            has_pronunciation_data=bool(pronunciation_data)
-        )
-        session.add(user_share)
-        session.commit()  # Commit the transaction
-        session.close()  # Ensure the session is closed
-    except Exception as e:
-        session.rollback()  # Revert any changes due to the error
-        print(f"Error saving to database: {str(e)}")
-
-    return sanic_json({
-        "message": "Audio file and pronunciation data uploaded successfully",
-        "hash": hashed_filename,  # Changed from "filename" to "hash"
-        "path": f"{course_id}/{current_date}/{filename}"
-    }, status=201)
+        # No-op once saved; removes the temp file on any early exit
+        await file.discard()
 
 @user_file_bp.route("/get-data/<hashed_filename>", methods=["GET"])
 async def get_data_by_hash(request, hashed_filename):
@@ -170,65 +192,67 @@ async def get_data_by_hash(request, hashed_filename):
     
     return sanic_json(response_data)
 
-@user_file_bp.route("/lesson-audio/<user_hash>/<lesson_hash>", methods=["POST"])
+@user_file_bp.route("/lesson-audio/<user_hash>/<lesson_hash>", methods=["POST"], stream=True)
 async def upload_lesson_audio(request, user_hash: str, lesson_hash: str):
     if not request.ctx.user:
         raise SanicException("User not authenticated", status_code=401)
     
-    if "file" not in request.files:
-        raise SanicException("No file part in the request", status_code=400)
+    form, file = await receive_audio_upload(request)
+    try:
+        # Get pronunciation data from form data
+        pronunciation_data = form.get("pronunciation_data")
+        if pronunciation_data:
+            pronunciation_data = json.loads(pronunciation_data)
 
-    file = request.files["file"][0]
-    
-    if not file.name or not file.type.startswith("audio/"):
-        raise SanicException("Invalid file or not an audio file", status_code=400)
+        # Generate current date in YYYYMMDD format
+        current_date = datetime.now().strftime("%Y%m%d")
 
-    # Get pronunciation data from form data
-    pronunciation_data = request.form.get("pronunciation_data")
-    if pronunciation_data:
-        pronunciation_data = json.loads(pronunciation_data)
+        # Generate a unique filename
+        unique_string = f"{user_hash}_{lesson_hash}_{current_date}"
+        hashed_filename = hashlib.md5(unique_string.encode()).hexdigest()
+        filename = f"{hashed_filename}{os.path.splitext(file.name)[1]}"
 
-    # Generate current date in YYYYMMDD format
-    current_date = datetime.now().strftime("%Y%m%d")
+        # Define the upload directory
+        upload_dir = os.path.join(BASE_PATH, user_hash, lesson_hash, current_date)
+        os.makedirs(upload_dir, exist_ok=True)
 
-    # Generate a unique filename
-    unique_string = f"{user_hash}_{lesson_hash}_{current_date}"
-    hashed_filename = hashlib.md5(unique_string.encode()).hexdigest()
-    filename = f"{hashed_filename}{os.path.splitext(file.name)[1]}"
+        file_path = os.path.join(upload_dir, filename)
 
-    # Define the upload directory
-    upload_dir = os.path.join(BASE_PATH, user_hash, lesson_hash, current_date)
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    file_path = os.path.join(upload_dir, filename)
-    
-    # Delete previous files if they exist
-    if os.path.exists(file_path):
-        os.remove(file_path)
-        pronunciation_file_path = f"{os.path.splitext(file_path)[0]}_pronunciation.json"
-        if os.path.exists(pronunciation_file_path):
-            os.remove(pronunciation_file_path)
-
-    # Save the audio file
-    with open(file_path, "wb") as f:
-        f.write(file.body)
-
-    # Save pronunciation data if available
-    if pronunciation_data:
-        pronunciation_file_path = os.path.join(upload_dir, f"{hashed_filename}_pronunciation.json")
-        with open(pronunciation_file_path, "w") as f:
-            json.dump(pronunciation_data, f)
-
-    # Create response data
-    response_data = {
-        "message": "Audio file and pronunciation data uploaded successfully",
-        "hash": hashed_filename,
-        "path": f"{user_hash}/{lesson_hash}/{current_date}/{filename}",
-        "has_pronunciation_data": bool(pronunciation_data),
-        "created_at": datetime.now().isoformat()
-    }
+        # Delete previous files if they exist
+        if os.path.exists(file_path):
+            os.remove(file_path)
+            pronunciation_file_path = f"{os.path.splitext(file_path)[0]}_pronunciation.json"
+            if os.path.exists(pronunciation_file_path):
+                os.remove(pronunciation_file_path)
+
+        # Move the streamed audio file into place
+        await file.save(file_path)
 
-    return sanic_json(response_data, status=201)
+        # Waveform peaks are computed after responding; the player asks for them later
+        request.app.add_task(generate_peaks([file_path]))
+
+        # Save pronunciation data if available
+        if pronunciation_data:
+            pronunciation_file_path = os.path.join(upload_dir, f"{hashed_filename}_pronunciation.json")
+            with open(pronunciation_file_path, "w") as f:
+                json.dump(pronunciation_data, f)
+
+        # Files were replaced as well as added; have the user's folder index recount
+        await folder_index.invalidate(user_hash)
+
+        # Create response data
+        response_data = {
+            "message": "Audio file and pronunciation data uploaded successfully",
+            "hash": hashed_filename,
+            "path": f"{user_hash}/{lesson_hash}/{current_date}/{filename}",
+            "has_pronunciation_data": bool(pronunciation_data),
+            "created_at": datetime.now().isoformat()
+        }
+
+        return sanic_json(response_data, status=201)
+    finally:
+        # No-op once saved; removes the temp file on any early exit
+        await file.discard()
 
 @user_file_bp.route("/lesson-audio/<user_hash>/<lesson_hash>/<hash>", methods=["GET"])
 async def get_lesson_audio(request, user_hash: str, lesson_hash: str, hash: str):
@@ -238,7 +262,7 @@ async def get_lesson_audio(request, user_hash: str, lesson_hash: str, hash: str)
         audio_path = os.path.join(BASE_PATH, user_hash, lesson_hash, date_folder)
         for file in os.listdir(audio_path):
             if file.startswith(hash):
-                if file.endswith('.json'):
+                if file.endswith(('.json', PEAKS_SUFFIX)):
                     continue
                 
                 # Get the pronunciation data if it exists
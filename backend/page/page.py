@@ -1,11 +1,15 @@
 from sanic import Blueprint, json, Request, HTTPResponse
-from database import Database
+from database import Database, register_schema, column_compression
+from utils.invalidation import publish
+from utils.cache import cache_region, cached
+from utils.pagination import KeysetQuery, page_limit, select_fields, wants_stream
+from page.page_revision import PAGE_REVISIONS_TABLE, record_revision, materialize_revision
+from utils.ownership import owned_write, write_error, authenticated
 import uuid
 from datetime import datetime
 import json as json_lib
-from functools import wraps
 import os
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any
 
 # Constants
 TABLE_PREFIX = os.getenv('DATABASE_TABLE_PREFIX', '')
@@ -16,11 +20,46 @@ PAGE_TYPES = [
     'resource', 'group', 'user', 'note', 'user-lesson'
 ]
 
+PAGE_FIELDS = [
+    'hash', 'page_title', 'page_type', 'page_version', 'page_content',
+    'page_history', 'created_by_hash', 'created_at', 'updated_at'
+]
+# page_history is the legacy client-written history blob; saves are now kept
+# in PAGE_REVISIONS_TABLE and the blob is only read on request
+PAGE_READ_FIELDS = [field for field in PAGE_FIELDS if field != 'page_history']
+# Content and history are only listed when asked for with ?fields=
+PAGE_LIST_FIELDS = [
+    'hash', 'page_title', 'page_type', 'page_version',
+    'created_by_hash', 'created_at', 'updated_at'
+]
+
 MAX_PAGE_SIZE = 100
 DEFAULT_PAGE_SIZE = 10
 
+# Pages are free-form notes in any language, so word search uses the
+# language-neutral 'simple' configuration; trigram indexes cover substrings.
+PAGE_SEARCH_CONFIG = 'simple'
+PAGE_HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=35, MinWords=15, MaxFragments=2"
+
+register_schema(
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"""
+    ALTER TABLE {PAGE_TABLE} ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('{PAGE_SEARCH_CONFIG}', coalesce(page_title, '')), 'A') ||
+        setweight(to_tsvector('{PAGE_SEARCH_CONFIG}', coalesce(page_content, '')), 'B')
+    ) STORED
+    """,
+    f"CREATE INDEX IF NOT EXISTS {PAGE_TABLE}_search_vector_idx ON {PAGE_TABLE} USING GIN (search_vector)",
+    f"CREATE INDEX IF NOT EXISTS {PAGE_TABLE}_title_trgm_idx ON {PAGE_TABLE} USING GIN (page_title gin_trgm_ops)",
+    f"CREATE INDEX IF NOT EXISTS {PAGE_TABLE}_content_trgm_idx ON {PAGE_TABLE} USING GIN (page_content gin_trgm_ops)",
+    column_compression(PAGE_TABLE, "page_content"),
+)
+
 page_bp = Blueprint("page", url_prefix="/api/v1/pages")
 
+page_cache = cache_region("page", ttl=30, stale_ttl=60)
+
 def serialize_page(page: Dict[str, Any]) -> Dict[str, Any]:
     """
     Serialize page dictionary by converting datetime objects to ISO format strings.
@@ -32,40 +71,13 @@ def serialize_page(page: Dict[str, Any]) -> Dict[str, Any]:
         Dict with datetime values converted to ISO format strings
     """
     page_dict = dict(page)
+    # Internal full-text index column, never part of the API
+    page_dict.pop('search_vector', None)
     return {
         key: value.isoformat() if isinstance(value, datetime) else value
         for key, value in page_dict.items()
     }
 
-def check_page_ownership(func):
-    @wraps(func)
-    async def wrapper(request: Request, *args, **kwargs) -> HTTPResponse:
-        try:
-            page_hash = kwargs.get('page_hash')
-            user: Optional[Dict[str, Any]] = getattr(request.ctx, 'user', None)
-            
-            if not user:
-                return json({"error": "Authentication required"}, status=401)
-            
-            if user['role'] == 'admin':
-                return await func(request, *args, **kwargs)
-            
-            query = f"SELECT created_by_hash FROM {PAGE_TABLE} WHERE hash = $1"
-            created_by = await Database.fetchval(query, page_hash)
-            
-            if not created_by or created_by != user['hash']:
-                return json(
-                    {"error": "You don't have permission to modify this page"},
-                    status=403
-                )
-            
-            return await func(request, *args, **kwargs)
-            
-        except Exception as e:
-            return json({"error": str(e)}, status=500)
-    
-    return wrapper
-
 # Route handlers
 @page_bp.route("/")
 async def pages_root(request: Request) -> HTTPResponse:
@@ -74,24 +86,127 @@ async def pages_root(request: Request) -> HTTPResponse:
 
 @page_bp.route("/list")
 async def pages_list(request: Request) -> HTTPResponse:
-    """List all pages ordered by creation date."""
+    """
+    List pages ordered by creation date, newest first.
+    
+    Query parameters:
+        limit: Results per page (default: 50, max: 200)
+        cursor: next_cursor from the previous page
+        fields: Comma-separated columns (default: everything but
+            page_content and page_history)
+        format: 'ndjson' streams every page, one JSON object per line
+    """
     try:
-        query = f"SELECT * FROM {PAGE_TABLE} ORDER BY created_at DESC"
-        pages = await Database.fetch(query)
-        return json([serialize_page(page) for page in pages])
+        limit = page_limit(request)
+        fields = select_fields(request, PAGE_FIELDS, PAGE_LIST_FIELDS)
+        keyset = KeysetQuery(
+            PAGE_TABLE, fields, keys=[("created_at", "timestamp"), ("hash", "text")]
+        )
+        cursor = request.args.get('cursor')
+        # Validate the cursor now: once streaming starts, errors can't
+        # become a JSON error response
+        keyset.build(cursor)
+    except ValueError as e:
+        return json({"error": str(e)}, status=400)
+    
+    if wants_stream(request):
+        return await keyset.stream(request, serialize_page, cursor)
+    
+    try:
+        return json(await keyset.fetch_page(cursor, limit, serialize_page))
+    except ValueError as e:
+        return json({"error": str(e)}, status=400)
     except Exception as e:
         return json({"error": str(e)}, status=500)
 
+def _include_history(request) -> bool:
+    return request.args.get('include_history', 'false').lower() == 'true'
+
+def serialize_revision(revision: Dict[str, Any]) -> Dict[str, Any]:
+    revision_dict = dict(revision)
+    return {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in revision_dict.items()
+    }
+
 @page_bp.route("/<page_hash>")
+@cached(
+    page_cache,
+    key=lambda request, page_hash: f"{page_hash}:history={_include_history(request)}",
+    tags=["page:{page_hash}"]
+)
 async def get_page(request, page_hash):
+    """
+    Get a page. History is left out unless ?include_history=true, which adds
+    the legacy page_history blob and the revision list.
+    """
     try:
-        query = f"SELECT * FROM {PAGE_TABLE} WHERE hash = $1"
+        include_history = _include_history(request)
+        fields = PAGE_FIELDS if include_history else PAGE_READ_FIELDS
+        query = f"SELECT {', '.join(fields)} FROM {PAGE_TABLE} WHERE hash = $1"
         page = await Database.fetchrow(query, page_hash)
         
         if not page:
             return json({"error": "Page not found"}, status=404)
+        
+        result = serialize_page(page)
+        if include_history:
+            revisions = await Database.fetch(f"""
+                SELECT revision, is_snapshot, content_length, created_by_hash, created_at
+                FROM {PAGE_REVISIONS_TABLE}
+                WHERE page_hash = $1
+                ORDER BY revision DESC
+            """, page_hash)
+            result['revisions'] = [serialize_revision(r) for r in revisions]
             
-        return json(serialize_page(page))
+        return json(result)
+    except Exception as e:
+        return json({"error": str(e)}, status=500)
+
+@page_bp.route("/<page_hash>/revisions")
+async def list_page_revisions(request, page_hash):
+    """
+    List a page's revisions, newest first.
+    
+    Query parameters:
+        limit: Results per page (default: 50, max: 200)
+        cursor: next_cursor from the previous page
+    """
+    try:
+        limit = page_limit(request)
+        keyset = KeysetQuery(
+            PAGE_REVISIONS_TABLE,
+            ['revision', 'is_snapshot', 'content_length', 'created_by_hash', 'created_at'],
+            keys=[("revision", "int")],
+            conditions=["page_hash = $1"],
+            params=[page_hash]
+        )
+        return json(await keyset.fetch_page(request.args.get('cursor'), limit, serialize_revision))
+    except ValueError as e:
+        return json({"error": str(e)}, status=400)
+    except Exception as e:
+        return json({"error": str(e)}, status=500)
+
+@page_bp.route("/<page_hash>/revisions/<revision:int>")
+async def get_page_revision(request, page_hash, revision):
+    """Page content as it was at the given revision"""
+    try:
+        content = await materialize_revision(Database, page_hash, revision)
+        
+        if content is None:
+            return json({"error": "Revision not found"}, status=404)
+        
+        meta = await Database.fetchrow(f"""
+            SELECT created_by_hash, created_at FROM {PAGE_REVISIONS_TABLE}
+            WHERE page_hash = $1 AND revision = $2
+        """, page_hash, revision)
+        
+        return json({
+            "page_hash": page_hash,
+            "revision": revision,
+            "page_content": content,
+            **serialize_revision(meta)
+        })
     except Exception as e:
         return json({"error": str(e)}, status=500)
 
@@ -136,8 +251,8 @@ async def create_page(request):
         if data.get('page_type') in ['lesson', 'user-lesson'] and data.get('page_hash'):
             page_hash = data.get('page_hash')
         
-        # Convert dictionary fields to JSON strings
-        page_history = json_lib.dumps(data.get('page_history', {}))
+        # History lives in the revisions table; the legacy column stays empty
+        page_history = json_lib.dumps({})
         
         query = f"""
             INSERT INTO {PAGE_TABLE} (
@@ -161,14 +276,18 @@ async def create_page(request):
             now
         )
         
-        result = await Database.fetchval(query, *values)
+        async with Database.atomic() as conn:
+            result = await conn.fetchval(query, *values)
+            await record_revision(conn, result, None, data.get('page_content'), created_by_hash, now)
+        
+        await publish("page", result)
         return json({"hash": result, "message": "Page created successfully"})
         
     except Exception as e:
         return json({"error": str(e)}, status=500)
 
 @page_bp.route("/<page_hash>", methods=["PUT"])
-@check_page_ownership
+@authenticated
 async def update_page(request, page_hash):
     try:
         data = request.json
@@ -178,18 +297,15 @@ async def update_page(request, page_hash):
             return json({"error": f"Invalid page type. Must be one of: {', '.join(PAGE_TYPES)}"}, 
                        status=400)
         
-        # Convert dictionary fields to JSON strings if they exist
-        if 'page_history' in data:
-            data['page_history'] = json_lib.dumps(data['page_history'])
-        
-        # Build update query dynamically based on provided fields
+        # Build update query dynamically based on provided fields.
+        # page_history is no longer written: every content change is appended
+        # to the revisions table instead.
         update_fields = []
         values = [page_hash]  # First parameter is page_hash
         param_count = 1
         
         updateable_fields = [
-            'page_content', 'page_title', 'page_type',
-            'page_version', 'page_history'
+            'page_content', 'page_title', 'page_type', 'page_version'
         ]
         
         for field in updateable_fields:
@@ -202,23 +318,41 @@ async def update_page(request, page_hash):
             return json({"error": "No valid fields to update"}, status=400)
         
         # Add updated_at
+        now = datetime.utcnow()
         param_count += 1
         update_fields.append(f"updated_at = ${param_count}")
-        values.append(datetime.utcnow())
+        values.append(now)
         
+        # The row lock orders concurrent saves and their revision numbers
         query = f"""
-            UPDATE {PAGE_TABLE} 
+            UPDATE {PAGE_TABLE} p
             SET {', '.join(update_fields)}
-            WHERE hash = $1
-            RETURNING hash
+            FROM (
+                SELECT hash, page_content FROM {PAGE_TABLE} WHERE hash = $1 FOR UPDATE
+            ) previous
+            WHERE p.hash = previous.hash AND {{owner}}
+            RETURNING p.hash, previous.page_content AS previous_content
         """
         
-        result = await Database.fetchval(query, *values)
-        
-        if not result:
-            return json({"error": "Page not found"}, status=404)
+        revision = None
+        async with Database.atomic() as conn:
+            write = await owned_write(
+                conn, PAGE_TABLE, page_hash, request.ctx.user, query, values,
+                owner_column="created_by_hash"
+            )
+            if not write.written:
+                return write_error(write, "page")
+            previous_content = write.row['previous_content']
             
-        return json({"message": "Page updated successfully"})
+            if 'page_content' in data and data['page_content'] != previous_content:
+                user = getattr(request.ctx, 'user', None)
+                revision = await record_revision(
+                    conn, page_hash, previous_content, data['page_content'],
+                    user['hash'] if user else None, now
+                )
+        
+        await publish("page", page_hash)
+        return json({"message": "Page updated successfully", "revision": revision})
         
     except Exception as e:
         return json({"error": str(e)}, status=500)
@@ -228,6 +362,10 @@ async def search_pages(request: Request) -> HTTPResponse:
     """
     Search pages with filtering and pagination.
     
+    With a search term, pages match on words (tsvector) or on substrings of
+    the title or content (pg_trgm), both index-backed, and are ordered by
+    relevance. Results carry a highlighted snippet instead of page_content.
+    
     Query parameters:
         page_type: Filter by page type
         search: Search term for title and content
@@ -259,13 +397,21 @@ async def search_pages(request: Request) -> HTTPResponse:
                 }, status=400)
             conditions.append("page_type = $1")
             values.append(page_type)
-            
+        
+        columns = ", ".join(PAGE_LIST_FIELDS)
+        tsq = rank_expr = None
         if search_term:
-            param_idx = len(values) + 1
+            values.append(search_term)
+            term = f"${len(values)}"
+            values.append(f"%{search_term}%")
+            pattern = f"${len(values)}"
+            tsq = f"websearch_to_tsquery('{PAGE_SEARCH_CONFIG}', {term})"
             conditions.append(
-                f"(page_title ILIKE ${param_idx} OR page_content ILIKE ${param_idx})"
+                f"(search_vector @@ {tsq} OR page_title ILIKE {pattern} OR page_content ILIKE {pattern})"
             )
-            values.append(f"%{search_term}%")
+            # Word matches rank by ts_rank_cd; substring-only matches still
+            # order by how closely the title resembles the term
+            rank_expr = f"ts_rank_cd(search_vector, {tsq}, 32) + word_similarity({term}, page_title)"
         
         where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
         
@@ -273,13 +419,31 @@ async def search_pages(request: Request) -> HTTPResponse:
         count_query = f"SELECT COUNT(*) FROM {PAGE_TABLE} {where_clause}"
         total_count = await Database.fetchval(count_query, *values)
         
-        # Get paginated results
-        query = f"""
-            SELECT * FROM {PAGE_TABLE} 
-            {where_clause}
-            ORDER BY created_at DESC
-            OFFSET ${len(values) + 1} LIMIT ${len(values) + 2}
-        """
+        offset_param, limit_param = len(values) + 1, len(values) + 2
+        if search_term:
+            # Rank and cut the page first so headlines are only built for its rows
+            query = f"""
+                SELECT {columns}, rank,
+                       ts_headline('{PAGE_SEARCH_CONFIG}', coalesce(page_title, ''), {tsq},
+                                   'HighlightAll=true, StartSel=<mark>, StopSel=</mark>') AS title_highlight,
+                       ts_headline('{PAGE_SEARCH_CONFIG}', coalesce(page_content, ''), {tsq},
+                                   '{PAGE_HEADLINE_OPTIONS}') AS snippet
+                FROM (
+                    SELECT {columns}, page_content, {rank_expr} AS rank
+                    FROM {PAGE_TABLE}
+                    {where_clause}
+                    ORDER BY rank DESC, created_at DESC
+                    OFFSET ${offset_param} LIMIT ${limit_param}
+                ) matched
+                ORDER BY rank DESC, created_at DESC
+            """
+        else:
+            query = f"""
+                SELECT {columns} FROM {PAGE_TABLE} 
+                {where_clause}
+                ORDER BY created_at DESC
+                OFFSET ${offset_param} LIMIT ${limit_param}
+            """
         values.extend([offset, page_size])
         
         pages = await Database.fetch(query, *values)
@@ -299,15 +463,20 @@ async def search_pages(request: Request) -> HTTPResponse:
         return json({"error": str(e)}, status=500)
 
 @page_bp.route("/<page_hash>", methods=["DELETE"])
-@check_page_ownership
+@authenticated
 async def delete_page(request, page_hash):
     try:
-        query = f"DELETE FROM {PAGE_TABLE} WHERE hash = $1 RETURNING hash"
-        result = await Database.fetchval(query, page_hash)
+        query = f"DELETE FROM {PAGE_TABLE} WHERE hash = $1 AND {{owner}} RETURNING hash"
+        async with Database.atomic() as conn:
+            write = await owned_write(
+                conn, PAGE_TABLE, page_hash, request.ctx.user, query, [page_hash],
+                owner_column="created_by_hash"
+            )
+            if not write.written:
+                return write_error(write, "page")
+            await conn.execute(f"DELETE FROM {PAGE_REVISIONS_TABLE} WHERE page_hash = $1", page_hash)
         
-        if not result:
-            return json({"error": "Page not found"}, status=404)
-            
+        await publish("page", page_hash)
         return json({"message": "Page deleted successfully"})
         
     except Exception as e:
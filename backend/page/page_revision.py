@@ -0,0 +1,146 @@
+from database import register_schema
+from typing import List, Optional
+import difflib
+import json as json_lib
+import os
+import zlib
+
+TABLE_PREFIX = os.getenv('DATABASE_TABLE_PREFIX', '')
+PAGE_REVISIONS_TABLE = f"{TABLE_PREFIX}_page_revisions"
+
+# Every Nth revision stores the full content, so materializing any version
+# replays at most N - 1 deltas
+PAGE_SNAPSHOT_INTERVAL = int(os.getenv('PAGE_SNAPSHOT_INTERVAL', 20))
+
+register_schema(
+    f"""
+    CREATE TABLE IF NOT EXISTS {PAGE_REVISIONS_TABLE} (
+        page_hash TEXT NOT NULL,
+        revision INTEGER NOT NULL,
+        is_snapshot BOOLEAN NOT NULL,
+        data BYTEA NOT NULL,
+        content_length INTEGER NOT NULL,
+        created_by_hash TEXT,
+        created_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (page_hash, revision)
+    )
+    """,
+)
+
+
+def _lines(content: Optional[str]) -> List[str]:
+    return (content or "").splitlines(keepends=True)
+
+
+def encode_delta(previous: Optional[str], content: Optional[str]) -> bytes:
+    """
+    Line-based delta from previous to content, zlib-compressed JSON:
+    ["c", i1, i2] copies previous lines i1:i2, ["i", [lines]] inserts lines.
+    """
+    old, new = _lines(previous), _lines(content)
+    ops = []
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(["c", i1, i2])
+        elif j2 > j1:
+            ops.append(["i", new[j1:j2]])
+    return zlib.compress(json_lib.dumps(ops, ensure_ascii=False).encode("utf-8"))
+
+
+def apply_delta(previous: Optional[str], data: bytes) -> str:
+    old = _lines(previous)
+    parts = []
+    for op in json_lib.loads(zlib.decompress(data)):
+        if op[0] == "c":
+            parts.extend(old[op[1]:op[2]])
+        else:
+            parts.extend(op[1])
+    return "".join(parts)
+
+
+def encode_snapshot(content: Optional[str]) -> bytes:
+    return zlib.compress((content or "").encode("utf-8"))
+
+
+def decode_snapshot(data: bytes) -> str:
+    return zlib.decompress(data).decode("utf-8")
+
+
+async def record_revision(conn, page_hash: str, previous: Optional[str], content: Optional[str],
+                          created_by_hash: Optional[str], created_at) -> int:
+    """
+    Append the revision for a page save; returns its number.
+
+    Must run on a connection inside the transaction that holds the page row
+    lock (SELECT ... FOR UPDATE), which serializes revision numbering and
+    guarantees previous is the content of the latest revision.
+    """
+    latest = await conn.fetchval(
+        f"SELECT max(revision) FROM {PAGE_REVISIONS_TABLE} WHERE page_hash = $1",
+        page_hash
+    )
+
+    if latest is None and previous is not None:
+        # Page predates revision tracking: keep what it held as revision 1
+        await conn.execute(
+            f"""
+            INSERT INTO {PAGE_REVISIONS_TABLE} (
+                page_hash, revision, is_snapshot, data, content_length,
+                created_by_hash, created_at
+            ) VALUES ($1, 1, true, $2, $3, NULL, $4)
+            """,
+            page_hash, encode_snapshot(previous), len(previous), created_at
+        )
+        latest = 1
+
+    revision = (latest or 0) + 1
+    snapshot = encode_snapshot(content)
+    is_snapshot = latest is None or (revision - 1) % PAGE_SNAPSHOT_INTERVAL == 0
+    data = snapshot
+    if not is_snapshot:
+        delta = encode_delta(previous, content)
+        # A rewrite can make the delta bigger than the content itself
+        if len(delta) < len(snapshot):
+            data = delta
+        else:
+            is_snapshot = True
+
+    await conn.execute(
+        f"""
+        INSERT INTO {PAGE_REVISIONS_TABLE} (
+            page_hash, revision, is_snapshot, data, content_length,
+            created_by_hash, created_at
+        ) VALUES ($1, $2, $3, $4, $5, $6, $7)
+        """,
+        page_hash, revision, is_snapshot, data, len(content or ""), created_by_hash, created_at
+    )
+    return revision
+
+
+async def materialize_revision(db, page_hash: str, revision: int) -> Optional[str]:
+    """Content of a page at revision, replayed from the nearest snapshot; None if absent"""
+    rows = await db.fetch(
+        f"""
+        SELECT revision, is_snapshot, data
+        FROM {PAGE_REVISIONS_TABLE}
+        WHERE page_hash = $1
+          AND revision <= $2
+          AND revision >= (
+              SELECT max(revision) FROM {PAGE_REVISIONS_TABLE}
+              WHERE page_hash = $1 AND revision <= $2 AND is_snapshot
+          )
+        ORDER BY revision
+        """,
+        page_hash, revision
+    )
+    if not rows or rows[-1]['revision'] != revision:
+        return None
+
+    content = None
+    for row in rows:
+        if row['is_snapshot']:
+            content = decode_snapshot(row['data'])
+        else:
+            content = apply_delta(content, row['data'])
+    return content
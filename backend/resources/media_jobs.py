@@ -0,0 +1,319 @@
+"""
+Background processing of audio and video resources.
+
+Jobs live in the media_jobs table, so they survive restarts and any API
+worker can run them. Each worker process runs a dispatcher that claims
+queued jobs (FOR UPDATE SKIP LOCKED) onto an asyncio queue whenever it is
+woken by a NOTIFY on MEDIA_JOBS_CHANNEL or by the poll interval, and
+consumers that run media_pipeline.process_media, whose ffmpeg steps are
+asyncio subprocesses. Claims are serialised on an advisory lock and never
+take the number of running jobs past MEDIA_JOBS_MAX_RUNNING, so that is
+the limit for the whole deployment, however many workers there are. When a
+job finishes the resource's metadata gets the results and its status flips
+from 'processing' to 'active' ('error' once attempts run out).
+"""
+from database import Database, register_schema, logger
+from datetime import datetime, timedelta
+from resources.media_pipeline import process_media
+from utils.invalidation import publish
+from utils.static_files import resolve_path
+from typing import Any, Dict, Optional
+import asyncio
+import json as json_lib
+import os
+
+TABLE_PREFIX = os.getenv('DATABASE_TABLE_PREFIX', '')
+MEDIA_JOBS_TABLE = f"{TABLE_PREFIX}_media_jobs"
+RESOURCES_TABLE = f"{TABLE_PREFIX}_resources"
+
+MEDIA_JOBS_CHANNEL = "media_jobs"
+MEDIA_OUTPUT_PATH = os.getenv(
+    'MEDIA_OUTPUT_PATH', os.path.join(os.getenv('BASE_DATA_PATH', 'data'), 'media')
+)
+# Jobs running at once across all workers
+MEDIA_JOBS_MAX_RUNNING = int(os.getenv('MEDIA_JOBS_MAX_RUNNING', os.cpu_count() or 2))
+MEDIA_JOB_MAX_ATTEMPTS = int(os.getenv('MEDIA_JOB_MAX_ATTEMPTS', 3))
+MEDIA_JOB_POLL_INTERVAL = float(os.getenv('MEDIA_JOB_POLL_INTERVAL', 30))
+# Running jobs record a heartbeat this often; one silent for
+# MEDIA_JOB_STALE_AFTER is assumed to have lost its worker
+MEDIA_JOB_HEARTBEAT_INTERVAL = float(os.getenv('MEDIA_JOB_HEARTBEAT_INTERVAL', 60))
+MEDIA_JOB_STALE_AFTER = timedelta(seconds=float(os.getenv('MEDIA_JOB_STALE_AFTER', 600)))
+
+PROCESSED_RESOURCE_TYPES = ('audio', 'video')
+
+register_schema(
+    f"""
+    CREATE TABLE IF NOT EXISTS {MEDIA_JOBS_TABLE} (
+        id BIGSERIAL PRIMARY KEY,
+        resource_hash TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at TIMESTAMP NOT NULL,
+        started_at TIMESTAMP,
+        finished_at TIMESTAMP
+    )
+    """,
+    f"""
+    CREATE INDEX IF NOT EXISTS {MEDIA_JOBS_TABLE}_queued_idx
+    ON {MEDIA_JOBS_TABLE} (id) WHERE status = 'queued'
+    """,
+    # At most one pending job per resource
+    f"""
+    CREATE UNIQUE INDEX IF NOT EXISTS {MEDIA_JOBS_TABLE}_pending_resource_idx
+    ON {MEDIA_JOBS_TABLE} (resource_hash) WHERE status IN ('queued', 'running')
+    """,
+    f"ALTER TABLE {MEDIA_JOBS_TABLE} ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP",
+)
+
+_queue: Optional[asyncio.Queue] = None
+_wakeup: Optional[asyncio.Event] = None
+_tasks = []
+# Jobs a local consumer has taken off the queue and not finished yet
+_running = 0
+
+
+def needs_processing(resource_type: str, storage_type: str, file_path: Optional[str]) -> bool:
+    return resource_type in PROCESSED_RESOURCE_TYPES and storage_type == 'file' and bool(file_path)
+
+
+async def enqueue_media_job(conn, resource_hash: str) -> None:
+    """
+    Queue processing of a resource inside the caller's transaction; the
+    NOTIFY is delivered to the dispatchers when it commits.
+    """
+    await conn.execute(
+        f"""
+        INSERT INTO {MEDIA_JOBS_TABLE} (resource_hash, created_at)
+        VALUES ($1, $2)
+        ON CONFLICT (resource_hash) WHERE status IN ('queued', 'running') DO NOTHING
+        """,
+        resource_hash, datetime.utcnow()
+    )
+    await conn.execute("SELECT pg_notify($1, $2)", MEDIA_JOBS_CHANNEL, resource_hash)
+
+
+async def _claim(limit: int):
+    """
+    Mark up to limit queued jobs running, fewer if that would exceed
+    MEDIA_JOBS_MAX_RUNNING, and return them with their resources
+    """
+    async with Database.atomic() as conn:
+        # One claim at a time, so each sees the running count the previous
+        # one committed
+        await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", MEDIA_JOBS_CHANNEL)
+        return await conn.fetch(
+            f"""
+            WITH claimed AS (
+                UPDATE {MEDIA_JOBS_TABLE}
+                SET status = 'running', attempts = attempts + 1, started_at = $2, heartbeat_at = $2
+                WHERE id IN (
+                    SELECT id FROM {MEDIA_JOBS_TABLE}
+                    WHERE status = 'queued'
+                    ORDER BY id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT LEAST($1, GREATEST($3 - (
+                        SELECT count(*) FROM {MEDIA_JOBS_TABLE} WHERE status = 'running'
+                    ), 0))
+                )
+                RETURNING id, resource_hash, attempts
+            )
+            SELECT c.id, c.resource_hash, c.attempts, r.resource_type, r.file_path
+            FROM claimed c
+            LEFT JOIN {RESOURCES_TABLE} r ON r.hash = c.resource_hash
+            """,
+            limit, datetime.utcnow(), MEDIA_JOBS_MAX_RUNNING
+        )
+
+
+async def _requeue_stale() -> None:
+    """
+    Requeue running jobs whose worker stopped sending heartbeats, or fail
+    them if they have used up their attempts
+    """
+    now = datetime.utcnow()
+    stale = "status = 'running' AND COALESCE(heartbeat_at, started_at) < $1"
+    error = "Worker stopped while processing"
+    async with Database.atomic() as conn:
+        await conn.execute(
+            f"""
+            UPDATE {MEDIA_JOBS_TABLE}
+            SET status = 'queued', error = $3
+            WHERE {stale} AND attempts < $2
+            """,
+            now - MEDIA_JOB_STALE_AFTER, MEDIA_JOB_MAX_ATTEMPTS, error
+        )
+        failed = await conn.fetch(
+            f"""
+            UPDATE {MEDIA_JOBS_TABLE}
+            SET status = 'failed', error = $3, finished_at = $4
+            WHERE {stale} AND attempts >= $2
+            RETURNING resource_hash
+            """,
+            now - MEDIA_JOB_STALE_AFTER, MEDIA_JOB_MAX_ATTEMPTS, error, now
+        )
+        for row in failed:
+            await _update_resource(conn, row['resource_hash'], None, error, now)
+    for row in failed:
+        await publish("resource", row['resource_hash'])
+
+
+async def _update_resource(conn, resource_hash: str, metadata: Optional[Dict[str, Any]],
+                           error: Optional[str], now: datetime) -> None:
+    """Record a finished job's results on its resource"""
+    # Only a resource still waiting on us changes status; one edited
+    # meanwhile (e.g. deleted) keeps what it was set to
+    await conn.execute(
+        f"""
+        UPDATE {RESOURCES_TABLE}
+        SET metadata = COALESCE(metadata::jsonb, '{{}}'::jsonb) || $2::jsonb,
+            status = CASE WHEN status = 'processing' THEN $3 ELSE status END,
+            updated_at = $4
+        WHERE hash = $1
+        """,
+        resource_hash,
+        json_lib.dumps({"media": metadata} if metadata else {"processing_error": error}),
+        'error' if error else 'active',
+        now
+    )
+
+
+async def _finish(job, metadata: Optional[Dict[str, Any]], error: Optional[str]) -> None:
+    now = datetime.utcnow()
+    retry = error is not None and job['attempts'] < MEDIA_JOB_MAX_ATTEMPTS
+    async with Database.atomic() as conn:
+        # A slot is free deployment-wide: wake every dispatcher on commit
+        await conn.execute("SELECT pg_notify($1, $2)", MEDIA_JOBS_CHANNEL, job['resource_hash'])
+        if retry:
+            await conn.execute(
+                f"UPDATE {MEDIA_JOBS_TABLE} SET status = 'queued', error = $2 WHERE id = $1",
+                job['id'], error
+            )
+            return
+        await conn.execute(
+            f"""
+            UPDATE {MEDIA_JOBS_TABLE}
+            SET status = $2, error = $3, finished_at = $4
+            WHERE id = $1
+            """,
+            job['id'], 'failed' if error else 'done', error, now
+        )
+        await _update_resource(conn, job['resource_hash'], metadata, error, now)
+    await publish("resource", job['resource_hash'])
+
+
+async def _heartbeat(job_id: int) -> None:
+    """Keep a running job from looking stale while ffmpeg works on it"""
+    while True:
+        await asyncio.sleep(MEDIA_JOB_HEARTBEAT_INTERVAL)
+        try:
+            await Database.execute(
+                f"UPDATE {MEDIA_JOBS_TABLE} SET heartbeat_at = $2 WHERE id = $1 AND status = 'running'",
+                job_id, datetime.utcnow()
+            )
+        except Exception as e:
+            logger.error(f"Media job {job_id} heartbeat failed: {str(e)}")
+
+
+async def _run_job(job) -> None:
+    if job['file_path'] is None:
+        # Resource is gone
+        await _finish(job, None, "Resource not found")
+        return
+    heartbeat = asyncio.get_event_loop().create_task(_heartbeat(job['id']))
+    try:
+        source = resolve_path(os.getenv('BASE_DATA_PATH', 'data'), job['file_path'])
+        output_dir = os.path.join(MEDIA_OUTPUT_PATH, job['resource_hash'])
+        result = await process_media(source, output_dir, job['resource_type'])
+        base = os.path.relpath(output_dir, os.getenv('BASE_DATA_PATH', 'data'))
+        # Paths as served under /data
+        for key in ("stream", "thumbnail", "peaks"):
+            if key in result:
+                result[key] = os.path.join(base, result[key])
+        await _finish(job, result, None)
+    except Exception as e:
+        logger.error(f"Media job {job['id']} for {job['resource_hash']} failed: {str(e)}")
+        await _finish(job, None, str(e) or e.__class__.__name__)
+    finally:
+        heartbeat.cancel()
+
+
+async def _consumer() -> None:
+    global _running
+    while True:
+        job = await _queue.get()
+        _running += 1
+        try:
+            await _run_job(job)
+        except Exception as e:
+            logger.error(f"Media job {job['id']} could not be recorded: {str(e)}")
+        finally:
+            _running -= 1
+            # A slot is free: let the dispatcher claim the next job now
+            _wakeup.set()
+
+
+async def _dispatcher() -> None:
+    await _requeue_stale()
+    while True:
+        try:
+            # Claim only what the local consumers can start now, leaving the
+            # rest to other workers; _claim applies the global limit
+            free = MEDIA_JOBS_MAX_RUNNING - _queue.qsize() - _running
+            if free > 0:
+                for job in await _claim(free):
+                    _queue.put_nowait(job)
+        except Exception as e:
+            logger.error(f"Media job dispatch failed: {str(e)}")
+        try:
+            await asyncio.wait_for(_wakeup.wait(), MEDIA_JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            await _requeue_stale()
+        _wakeup.clear()
+
+
+async def _on_notify(payload: str = "") -> None:
+    if _wakeup is not None:
+        _wakeup.set()
+
+
+async def start_media_workers() -> None:
+    """Start this process's dispatcher and consumers"""
+    global _queue, _wakeup
+    if _tasks:
+        return
+    _queue = asyncio.Queue()
+    _wakeup = asyncio.Event()
+    await Database.listen(MEDIA_JOBS_CHANNEL, _on_notify)
+    # Jobs queued while the listener was down are claimed right away
+    Database.on_reconnect(_on_notify)
+    loop = asyncio.get_event_loop()
+    _tasks.append(loop.create_task(_dispatcher()))
+    for _ in range(MEDIA_JOBS_MAX_RUNNING):
+        _tasks.append(loop.create_task(_consumer()))
+
+
+async def stop_media_workers() -> None:
+    """
+    Stop dispatching and hand back claimed jobs that never started. Jobs cut
+    short mid-run stay 'running' and are requeued once their heartbeat is
+    MEDIA_JOB_STALE_AFTER old.
+    """
+    for task in _tasks:
+        task.cancel()
+    _tasks.clear()
+    unstarted = []
+    while _queue is not None and not _queue.empty():
+        unstarted.append(_queue.get_nowait()['id'])
+    if unstarted:
+        try:
+            await Database.execute(
+                f"""
+                UPDATE {MEDIA_JOBS_TABLE}
+                SET status = 'queued', attempts = attempts - 1
+                WHERE id = ANY($1::bigint[]) AND status = 'running'
+                """,
+                unstarted
+            )
+        except Exception as e:
+            logger.error(f"Failed to requeue media jobs {unstarted}: {str(e)}")
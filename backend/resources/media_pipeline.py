@@ -0,0 +1,124 @@
+"""
+Processing steps for uploaded audio and video.
+
+The heavy lifting happens in ffmpeg/ffprobe children, awaited as asyncio
+subprocesses the way media_clip cuts clips; only the NumPy peak reduction
+runs in Python, on a thread. Outputs are written next to each other in one
+directory per resource; paths in the result are relative to it.
+"""
+from utils.waveform import write_peaks, peaks_path
+from typing import Any, Dict, List
+import asyncio
+import json as json_lib
+import os
+
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+FFPROBE_BINARY = os.getenv('FFPROBE_BINARY', 'ffprobe')
+MEDIA_STEP_TIMEOUT = int(os.getenv('MEDIA_STEP_TIMEOUT', 1800))
+
+# EBU R128 speech-friendly target, applied while transcoding
+LOUDNORM_FILTER = "loudnorm=I=-16:TP=-1.5:LRA=11"
+# Compact streaming renditions: AAC plays everywhere, including iOS Safari
+AUDIO_STREAM_ARGS = ["-c:a", "aac", "-b:a", "64k", "-ac", "1"]
+VIDEO_STREAM_ARGS = [
+    "-c:v", "libx264", "-preset", "veryfast", "-crf", "28",
+    "-vf", "scale=-2:'min(720,ih)'", "-pix_fmt", "yuv420p",
+    "-c:a", "aac", "-b:a", "96k"
+]
+THUMBNAIL_WIDTH = 320
+
+
+class MediaProcessingError(Exception):
+    pass
+
+
+async def _run(args: List[str], capture: bool = False) -> bytes:
+    process = await asyncio.create_subprocess_exec(
+        *args,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE if capture else asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), MEDIA_STEP_TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise MediaProcessingError(f"{os.path.basename(args[0])} timed out")
+    except asyncio.CancelledError:
+        # Worker shutting down: don't leave ffmpeg running
+        process.kill()
+        raise
+    if process.returncode != 0:
+        raise MediaProcessingError(stderr.decode(errors='replace').strip()[-500:])
+    return stdout
+
+
+async def probe(source: str) -> Dict[str, Any]:
+    """Duration in seconds and which stream kinds the file has"""
+    output = await _run([
+        FFPROBE_BINARY, "-v", "error", "-print_format", "json",
+        "-show_entries", "format=duration:stream=codec_type", source
+    ], capture=True)
+    info = json_lib.loads(output)
+    kinds = {stream.get('codec_type') for stream in info.get('streams', [])}
+    duration = info.get('format', {}).get('duration')
+    return {
+        "duration": round(float(duration), 3) if duration not in (None, "N/A") else None,
+        "has_audio": "audio" in kinds,
+        "has_video": "video" in kinds
+    }
+
+
+async def transcode(source: str, target: str, video: bool, has_audio: bool) -> None:
+    args = [FFMPEG_BINARY, "-nostdin", "-hide_banner", "-loglevel", "error", "-i", source]
+    if video:
+        args += VIDEO_STREAM_ARGS + ["-movflags", "+faststart"]
+        if not has_audio:
+            args += ["-an"]
+    else:
+        args += ["-vn"] + AUDIO_STREAM_ARGS + ["-movflags", "+faststart"]
+    if has_audio:
+        args += ["-af", LOUDNORM_FILTER]
+    await _run(args + ["-map_metadata", "-1", "-y", target])
+
+
+async def thumbnail(source: str, target: str, duration: float) -> None:
+    # A frame a little way in is more representative than the first one
+    offset = min(1.0, (duration or 0) / 2)
+    await _run([
+        FFMPEG_BINARY, "-nostdin", "-hide_banner", "-loglevel", "error",
+        "-ss", f"{offset:.3f}", "-i", source, "-frames:v", "1",
+        "-vf", f"scale={THUMBNAIL_WIDTH}:-2", "-y", target
+    ])
+
+
+async def process_media(source: str, output_dir: str, resource_type: str) -> Dict[str, Any]:
+    """
+    Run every step for one resource and return what was produced, as the
+    metadata stored on the resource.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    info = await probe(source)
+    video = resource_type == 'video' and info['has_video']
+    if not info['has_audio'] and not video:
+        raise MediaProcessingError("No audio or video stream found")
+
+    result = {"duration": info['duration']}
+
+    stream_name = "stream.mp4" if video else "stream.m4a"
+    await transcode(source, os.path.join(output_dir, stream_name), video, info['has_audio'])
+    result["stream"] = stream_name
+
+    if video:
+        await thumbnail(source, os.path.join(output_dir, "thumbnail.jpg"), info['duration'])
+        result["thumbnail"] = "thumbnail.jpg"
+
+    if info['has_audio']:
+        # Decoding the compact rendition is cheaper than the original upload;
+        # the sidecar sits where the waveform endpoint looks for it
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(None, write_peaks, os.path.join(output_dir, stream_name))
+        result["peaks"] = os.path.basename(peaks_path(stream_name))
+
+    return result
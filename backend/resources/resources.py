@@ -1,19 +1,138 @@
 from sanic import Blueprint, json
-from database import Database
+from database import Database, register_schema
+from utils.invalidation import publish
+from utils.cache import cache_region, cached
+from utils.blob_store import (
+    BLOB_UPLOAD_TMP_PATH, store_upload, get_blob, acquire, release
+)
+from utils.upload import receive_multipart, discard_files, MultipartError, UploadTooLarge
+from resources.media_jobs import needs_processing, enqueue_media_job
+from utils.ownership import owned_write, write_error, authenticated
 import uuid
 from datetime import datetime
 import json as json_lib
-from functools import wraps
 import os
 
 resources_bp = Blueprint("resources", url_prefix="/api/v1/resources")
 
+resource_cache = cache_region("resource", ttl=60, stale_ttl=300)
+
 TABLE_PREFIX = os.getenv('DATABASE_TABLE_PREFIX', '')
 
 STORAGE_TYPES = ['file', 'object']
 RESOURCE_TYPES = ['audio', 'video', 'page', 'image', 'document', 'subtitle', 'other']
 STATUS_CHOICES = ['active', 'deleted', 'processing', 'error']
 
+# File resources point at a content-addressed blob (see utils/blob_store.py)
+register_schema(
+    f"ALTER TABLE {TABLE_PREFIX}_resources ADD COLUMN IF NOT EXISTS blob_sha256 TEXT",
+    f"CREATE INDEX IF NOT EXISTS {TABLE_PREFIX}_resources_blob_sha256_idx ON {TABLE_PREFIX}_resources (blob_sha256)",
+)
+
+# Tags are a JSONB array of strings so tag filters (?, ?|, ?&) use the GIN
+# index; rows written as serialized JSON text are converted once
+register_schema(
+    f"""
+    DO $$
+    BEGIN
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = '{TABLE_PREFIX}_resources'
+              AND column_name = 'tags' AND data_type <> 'jsonb'
+        ) THEN
+            ALTER TABLE {TABLE_PREFIX}_resources ALTER COLUMN tags DROP DEFAULT;
+            ALTER TABLE {TABLE_PREFIX}_resources ALTER COLUMN tags TYPE JSONB
+                USING COALESCE(NULLIF(tags::text, ''), '[]')::jsonb;
+            UPDATE {TABLE_PREFIX}_resources SET tags = '[]'::jsonb
+                WHERE tags IS NULL OR jsonb_typeof(tags) <> 'array';
+            ALTER TABLE {TABLE_PREFIX}_resources ALTER COLUMN tags SET DEFAULT '[]'::jsonb;
+        END IF;
+    END $$
+    """,
+    f"CREATE INDEX IF NOT EXISTS {TABLE_PREFIX}_resources_tags_idx ON {TABLE_PREFIX}_resources USING GIN (tags)",
+)
+
+class BlobNotFound(Exception):
+    pass
+
+def normalize_tags(tags):
+    """Tags as a list of distinct, non-empty strings; ValueError if not a list of strings"""
+    if tags is None:
+        return []
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        raise ValueError("tags must be a list of strings")
+    return list(dict.fromkeys(tag.strip() for tag in tags if tag.strip()))
+
+def tag_args(request, name):
+    """Tags given in a query parameter, repeated and/or comma-separated"""
+    tags = []
+    for value in request.args.getlist(name, []):
+        tags.extend(tag.strip() for tag in value.split(',') if tag.strip())
+    return list(dict.fromkeys(tags))
+
+async def insert_resource(data, created_by, blob_owner=None):
+    """
+    Insert a resource row. With data['blob_sha256'] the blob's reference is
+    counted in the same transaction and its path, size and type fill in the
+    file fields; raises BlobNotFound if the blob is unknown or, with
+    blob_owner given, was not uploaded by that user. Audio and video
+    files start out 'processing' and are queued for the media pipeline.
+    """
+    content = json_lib.dumps(data.get('content', {}))
+    metadata = json_lib.dumps(data.get('metadata', {}))
+    tags = json_lib.dumps(normalize_tags(data.get('tags')))
+    resource_hash = str(uuid.uuid4())[:8]
+
+    query = f"""
+        INSERT INTO {TABLE_PREFIX}_resources (
+            hash, title, description, resource_type, storage_type,
+            file_path, file_size, mime_type, content, metadata,
+            tags, status, created_by, created_at, updated_at, blob_sha256
+        ) VALUES (
+            $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $14, $15
+        ) RETURNING hash
+    """
+
+    async with Database.atomic() as conn:
+        file_path = data.get('file_path')
+        file_size = data.get('file_size')
+        mime_type = data.get('mime_type')
+        blob_sha256 = data.get('blob_sha256')
+        if blob_sha256:
+            blob = await acquire(conn, blob_sha256, blob_owner)
+            if not blob:
+                raise BlobNotFound(blob_sha256)
+            file_path = blob['path']
+            file_size = blob['size']
+            mime_type = mime_type or blob['mime_type']
+
+        status = data.get('status')
+        process = needs_processing(data['resource_type'], data['storage_type'], file_path)
+        if not status:
+            status = 'processing' if process else 'active'
+
+        result = await conn.fetchval(
+            query,
+            resource_hash,
+            data['title'],
+            data.get('description'),
+            data['resource_type'],
+            data['storage_type'],
+            file_path,
+            file_size,
+            mime_type,
+            content,
+            metadata,
+            tags,
+            status,
+            created_by,
+            datetime.utcnow(),
+            blob_sha256
+        )
+        if process and status == 'processing':
+            await enqueue_media_job(conn, result)
+        return result
+
 def serialize_resource(resource):
     resource_dict = dict(resource)
     # Convert datetime objects to ISO format strings
@@ -22,34 +141,6 @@ def serialize_resource(resource):
             resource_dict[key] = value.isoformat()
     return resource_dict
 
-def check_resource_ownership(func):
-    @wraps(func)
-    async def wrapper(request, *args, **kwargs):
-        try:
-            resource_hash = kwargs.get('resource_hash')
-            user = request.ctx.user if hasattr(request.ctx, 'user') else None
-            
-            if not user:
-                return json({"error": "Authentication required"}, status=401)
-            
-            # Check if user is admin
-            if user['role'] == 'admin':
-                return await func(request, *args, **kwargs)
-            
-            # Check resource ownership
-            query = f"SELECT created_by FROM {TABLE_PREFIX}_resources WHERE hash = $1"
-            created_by = await Database.fetchval(query, resource_hash)
-            
-            if not created_by or created_by != user['hash']:
-                return json({"error": "You don't have permission to modify this resource"}, status=403)
-            
-            return await func(request, *args, **kwargs)
-            
-        except Exception as e:
-            return json({"error": str(e)}, status=500)
-    
-    return wrapper
-
 @resources_bp.route("/")
 async def resources_root(request):
     return json({"message": "Resources API"})
@@ -109,6 +200,25 @@ async def resources_list(request):
             conditions.append(f"status = ${param_count}")
             params.append(status)
 
+        # Tag filters, answered from the tags GIN index
+        tag = (request.args.get('tag') or '').strip()
+        if tag:
+            param_count += 1
+            conditions.append(f"tags ? ${param_count}")
+            params.append(tag)
+
+        any_tags = tag_args(request, 'any_tags')
+        if any_tags:
+            param_count += 1
+            conditions.append(f"tags ?| ${param_count}::text[]")
+            params.append(any_tags)
+
+        all_tags = tag_args(request, 'all_tags')
+        if all_tags:
+            param_count += 1
+            conditions.append(f"tags ?& ${param_count}::text[]")
+            params.append(all_tags)
+
         # Get total count
         count_query = f"""
             SELECT COUNT(*) as total 
@@ -149,7 +259,69 @@ async def resources_list(request):
     except Exception as e:
         return json({"error": str(e)}, status=500)
 
+@resources_bp.route("/tags")
+async def resources_tag_cloud(request):
+    """Tags in use with the number of resources carrying each, most used first"""
+    try:
+        user = request.ctx.user if hasattr(request.ctx, 'user') else None
+        if not user:
+            return json({"error": "Authentication required"}, status=401)
+
+        try:
+            limit = int(request.args.get('limit', 100))
+        except ValueError:
+            return json({"error": "Invalid limit parameter"}, status=400)
+        if limit < 1 or limit > 1000:
+            return json({"error": "Limit must be between 1 and 1000"}, status=400)
+
+        resource_type = request.args.get('resource_type')
+        prefix = request.args.get('prefix')
+        current_user = request.args.get('current_user', 'true').lower() == 'true'
+
+        conditions = ["status != 'deleted'"]
+        params = []
+        param_count = 0
+
+        if current_user and user['role'] not in ['admin']:
+            param_count += 1
+            conditions.append(f"created_by = ${param_count}")
+            params.append(user['hash'])
+
+        if resource_type:
+            if resource_type not in RESOURCE_TYPES:
+                return json({"error": f"Invalid resource type. Must be one of: {', '.join(RESOURCE_TYPES)}"}, 
+                          status=400)
+            param_count += 1
+            conditions.append(f"resource_type = ${param_count}")
+            params.append(resource_type)
+
+        tag_conditions = []
+        if prefix:
+            param_count += 1
+            tag_conditions.append(f"starts_with(tag, ${param_count})")
+            params.append(prefix)
+
+        param_count += 1
+        query = f"""
+            SELECT tag, COUNT(*) AS count
+            FROM {TABLE_PREFIX}_resources,
+                 jsonb_array_elements_text(tags) AS tag
+            WHERE {' AND '.join(conditions)}
+            {'AND ' + ' AND '.join(tag_conditions) if tag_conditions else ''}
+            GROUP BY tag
+            ORDER BY count DESC, tag
+            LIMIT ${param_count}
+        """
+        params.append(limit)
+
+        rows = await Database.fetch(query, *params)
+        return json({"items": [{"tag": row['tag'], "count": row['count']} for row in rows]})
+
+    except Exception as e:
+        return json({"error": str(e)}, status=500)
+
 @resources_bp.route("/<resource_hash>")
+@cached(resource_cache, key="{resource_hash}", tags=["resource:{resource_hash}"])
 async def get_resource(request, resource_hash):
     try:
         query = f"SELECT * FROM {TABLE_PREFIX}_resources WHERE hash = $1"
@@ -186,50 +358,96 @@ async def create_resource(request):
             return json({"error": f"Invalid storage type. Must be one of: {', '.join(STORAGE_TYPES)}"}, 
                        status=400)
         
-        # Generate hash
-        resource_hash = str(uuid.uuid4())[:8]
-        
-        # Convert dictionary/list fields to JSON strings
-        content = json_lib.dumps(data.get('content', {}))
-        metadata = json_lib.dumps(data.get('metadata', {}))
-        tags = json_lib.dumps(data.get('tags', []))
-        
-        query = f"""
-            INSERT INTO {TABLE_PREFIX}_resources (
-                hash, title, description, resource_type, storage_type,
-                file_path, file_size, mime_type, content, metadata,
-                tags, status, created_by, created_at, updated_at
-            ) VALUES (
-                $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $14
-            ) RETURNING hash
-        """
-        
-        now = datetime.utcnow()
-        values = (
-            resource_hash,
-            data['title'],
-            data.get('description'),
-            data['resource_type'],
-            data['storage_type'],
-            data.get('file_path'),
-            data.get('file_size'),
-            data.get('mime_type'),
-            content,
-            metadata,
-            tags,
-            data.get('status', 'active'),
-            created_by,
-            now
-        )
-        
-        result = await Database.fetchval(query, *values)
+        # blob_sha256 names content this user already uploaded (see
+        # /blobs/<sha256>), so the resource is created without uploading it
+        # again; admins may use any blob
+        if data.get('blob_sha256') and not user:
+            return json({"error": "Authentication required"}, status=401)
+        blob_owner = None if user and user['role'] == 'admin' else created_by
+        try:
+            result = await insert_resource(data, created_by, blob_owner)
+        except BlobNotFound:
+            return json({"error": "Unknown blob_sha256"}, status=404)
+        except ValueError as e:
+            return json({"error": str(e)}, status=400)
+        await publish("resource", result)
         return json({"hash": result, "message": "Resource created successfully"})
         
     except Exception as e:
         return json({"error": str(e)}, status=500)
 
+@resources_bp.route("/upload", methods=["POST"], stream=True)
+async def upload_resource(request):
+    """
+    Create a file resource from a multipart upload (file plus the create
+    fields as form fields). Content already in the blob store is not stored
+    again.
+    """
+    user = request.ctx.user if hasattr(request.ctx, 'user') else None
+    created_by = user['hash'] if user else 'SYSTEM'
+
+    try:
+        form, files = await receive_multipart(request, BLOB_UPLOAD_TMP_PATH)
+    except UploadTooLarge as e:
+        return json({"error": str(e)}, status=413)
+    except MultipartError as e:
+        return json({"error": str(e)}, status=400)
+
+    try:
+        if "file" not in files:
+            return json({"error": "Missing required field: file"}, status=400)
+        file = files["file"][0]
+
+        resource_type = form.get('resource_type') or (file.type or '').split('/')[0]
+        if resource_type not in RESOURCE_TYPES:
+            resource_type = 'other'
+
+        blob = await store_upload(file, owner=user['hash'] if user else None)
+        data = {
+            'title': form.get('title') or file.name,
+            'description': form.get('description'),
+            'resource_type': resource_type,
+            'storage_type': 'file',
+            'mime_type': file.type,
+            'blob_sha256': blob['sha256'],
+            'content': json_lib.loads(form.get('content') or '{}'),
+            'metadata': json_lib.loads(form.get('metadata') or '{}'),
+            'tags': json_lib.loads(form.get('tags') or '[]'),
+        }
+        result = await insert_resource(data, created_by)
+        await publish("resource", result)
+        return json({
+            "hash": result,
+            "blob": blob,
+            "message": "Resource created successfully"
+        })
+
+    except ValueError as e:
+        return json({"error": str(e)}, status=400)
+    except Exception as e:
+        return json({"error": str(e)}, status=500)
+    finally:
+        await discard_files(files)
+
+@resources_bp.route("/blobs/<sha256>")
+async def get_resource_blob(request, sha256):
+    """
+    Stored blob by SHA-256 among the user's own uploads, so clients can skip
+    uploading content again
+    """
+    try:
+        user = request.ctx.user if hasattr(request.ctx, 'user') else None
+        if not user:
+            return json({"error": "Authentication required"}, status=401)
+        blob = await get_blob(sha256, None if user['role'] == 'admin' else user['hash'])
+        if not blob:
+            return json({"error": "Blob not found"}, status=404)
+        return json(serialize_resource(blob))
+    except Exception as e:
+        return json({"error": str(e)}, status=500)
+
 @resources_bp.route("/<resource_hash>", methods=["PUT"])
-@check_resource_ownership
+@authenticated
 async def update_resource(request, resource_hash):
     try:
         data = request.json
@@ -249,7 +467,10 @@ async def update_resource(request, resource_hash):
         if 'metadata' in data:
             data['metadata'] = json_lib.dumps(data['metadata'])
         if 'tags' in data:
-            data['tags'] = json_lib.dumps(data['tags'])
+            try:
+                data['tags'] = json_lib.dumps(normalize_tags(data['tags']))
+            except ValueError as e:
+                return json({"error": str(e)}, status=400)
         
         # Build update query dynamically
         update_fields = []
@@ -277,19 +498,49 @@ async def update_resource(request, resource_hash):
         values.append(datetime.utcnow())
         
         query = f"""
-            UPDATE {TABLE_PREFIX}_resources 
+            UPDATE {TABLE_PREFIX}_resources r
             SET {', '.join(update_fields)}
-            WHERE hash = $1
-            RETURNING hash
+            FROM (
+                SELECT hash, status, file_path FROM {TABLE_PREFIX}_resources WHERE hash = $1 FOR UPDATE
+            ) previous
+            WHERE r.hash = previous.hash AND {{owner}}
+            RETURNING r.hash, r.status, r.blob_sha256, r.resource_type, r.storage_type, r.file_path,
+                      previous.status AS previous_status, previous.file_path AS previous_file_path
         """
         
-        result = await Database.fetchval(query, *values)
-        
-        if not result:
-            return json({"error": "Resource not found"}, status=404)
+        async with Database.atomic() as conn:
+            write = await owned_write(
+                conn, f"{TABLE_PREFIX}_resources", resource_hash, request.ctx.user, query, values
+            )
+            if not write.written:
+                return write_error(write, "resource")
+            result = write.row
             
+            # Only non-deleted resources hold a reference to their blob
+            if result['blob_sha256'] and (result['previous_status'] == 'deleted') != (result['status'] == 'deleted'):
+                if result['status'] == 'deleted':
+                    await release(conn, result['blob_sha256'])
+                elif not await acquire(conn, result['blob_sha256']):
+                    raise BlobNotFound(result['blob_sha256'])
+
+            # A new audio or video file is processed like a fresh upload,
+            # unless the caller set the status itself
+            if (result['file_path'] != result['previous_file_path']
+                    and needs_processing(result['resource_type'], result['storage_type'], result['file_path'])):
+                if 'status' not in data and result['status'] != 'deleted':
+                    await conn.execute(
+                        f"UPDATE {TABLE_PREFIX}_resources SET status = 'processing' WHERE hash = $1",
+                        resource_hash
+                    )
+                    await enqueue_media_job(conn, resource_hash)
+                elif result['status'] == 'processing':
+                    await enqueue_media_job(conn, resource_hash)
+        
+        await publish("resource", resource_hash)
         return json({"message": "Resource updated successfully"})
         
+    except BlobNotFound:
+        return json({"error": "The resource's file is no longer available"}, status=409)
     except Exception as e:
         return json({"error": str(e)}, status=500)
 
@@ -382,22 +633,34 @@ async def search_resources(request):
         return json({"error": str(e)}, status=500)
 
 @resources_bp.route("/<resource_hash>", methods=["DELETE"])
-@check_resource_ownership
+@authenticated
 async def delete_resource(request, resource_hash):
     try:
         # Soft delete by setting status to 'deleted'
         query = f"""
-            UPDATE {TABLE_PREFIX}_resources 
+            UPDATE {TABLE_PREFIX}_resources r
             SET status = 'deleted', updated_at = $2
-            WHERE hash = $1 
-            RETURNING hash
+            FROM (
+                SELECT hash, status FROM {TABLE_PREFIX}_resources WHERE hash = $1 FOR UPDATE
+            ) previous
+            WHERE r.hash = previous.hash AND {{owner}}
+            RETURNING r.hash, r.blob_sha256, previous.status AS previous_status
         """
         
-        result = await Database.fetchval(query, resource_hash, datetime.utcnow())
-        
-        if not result:
-            return json({"error": "Resource not found"}, status=404)
+        async with Database.atomic() as conn:
+            write = await owned_write(
+                conn, f"{TABLE_PREFIX}_resources", resource_hash, request.ctx.user,
+                query, [resource_hash, datetime.utcnow()]
+            )
+            if not write.written:
+                return write_error(write, "resource")
+            result = write.row
             
+            # Deleted resources stop holding their blob, which the GC may then remove
+            if result['previous_status'] != 'deleted':
+                await release(conn, result['blob_sha256'])
+        
+        await publish("resource", resource_hash)
         return json({"message": "Resource deleted successfully"})
         
     except Exception as e:
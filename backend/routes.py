@@ -1,8 +1,9 @@
 from sanic import Blueprint
 from sanic import json, response
-from utils.auth import auth_bp
+from utils.auth import auth_bp, admin_required
 from user.users import users_bp
 from utils.tts import tts_bp
+from utils.waveform import waveform_bp
 from utils.pronunciation import perform_pronunciation_assessment
 import tempfile
 from pydub import AudioSegment
@@ -12,6 +13,7 @@ from course.course import course_bp
 from course.course_lesson import lesson_bp
 from course.sync_local_file import sync_course_local_bp
 from lessons.lessons import lessons_bp
+from lessons.lesson_resource import lesson_resource_bp
 from user.user_course import user_courses_bp
 from user.user_lessons import user_lessons_bp
 from user.user_files import user_files_bp
@@ -20,6 +22,8 @@ from user.user_group import user_group_bp
 from lessons.lesson_type import lesson_type_bp
 from page.page import page_bp
 from resources.resources import resources_bp
+from search.search import search_bp
+from utils.cache import cache_stats
 
 # Create the main blueprint
 bp = Blueprint("main_blueprint", url_prefix="/api")
@@ -33,15 +37,18 @@ blueprints = [
     auth_bp,            # Auth blueprint
     users_bp,           # Users blueprint
     tts_bp,             # TTS blueprint
+    waveform_bp,        # Waveform peaks blueprint
     sync_course_local_bp, # Sync blueprint
     user_files_bp,       # User files blueprint
     user_lessons_bp,
     user_lessons_results_bp,
     lessons_bp,
+    lesson_resource_bp,
     user_group_bp,
     lesson_type_bp,
     page_bp,
-    resources_bp
+    resources_bp,
+    search_bp
 ]
 
 # Only add file-related blueprints if DATABASE_BACKEND is LOCALFILE
@@ -63,6 +70,11 @@ if database_backend == 'POSTGRESQL':
 async def hello_world(request):
     return json({"message": "Hello, Bamboo Language!"})
 
+@bp.route("/v1/cache/stats")
+@admin_required
+async def get_cache_stats(request):
+    return json(cache_stats())
+
 @bp.route('/v1/assess-pronunciation', methods=['POST'])
 async def assess_pronunciation(request):
     if 'audio' not in request.files:
@@ -0,0 +1,190 @@
+from sanic import Blueprint, json
+from database import Database, register_schema
+from course.sync_local_file import LANGUAGE_CHOICES
+from utils.pagination import encode_cursor, decode_cursor
+from datetime import datetime
+
+search_bp = Blueprint("search", url_prefix="/api/v1/search")
+
+MAX_PAGE_SIZE = 100
+DEFAULT_PAGE_SIZE = 20
+
+SEARCH_TYPES = ['all', 'course', 'lesson']
+
+# Postgres text search configuration per LANGUAGE_CHOICES code. Chinese and
+# Japanese have no built-in stemmer, so they fall back to 'simple'.
+TEXT_SEARCH_CONFIGS = {
+    'EN': 'english',
+    'ES': 'spanish',
+    'FR': 'french',
+    'DE': 'german',
+    'ZH': 'simple',
+    'JA': 'simple'
+}
+
+HEADLINE_OPTIONS = "StartSel=<mark>, StopSel=</mark>, MaxWords=35, MinWords=15, MaxFragments=2"
+
+
+def config_expr(language_column: str) -> str:
+    """SQL expression mapping a language code column to a regconfig"""
+    cases = " ".join(
+        f"WHEN '{code}' THEN '{TEXT_SEARCH_CONFIGS.get(code, 'simple')}'::regconfig"
+        for code in LANGUAGE_CHOICES
+    )
+    return f"(CASE {language_column} {cases} ELSE 'simple'::regconfig END)"
+
+
+def tsquery_expr(param: str, language: str = None) -> str:
+    """
+    SQL tsquery for a user search string.
+
+    Without a language filter the query is parsed with every configuration and
+    OR-ed together, so it matches rows stemmed with any of them while staying a
+    row-independent expression the GIN index can use.
+    """
+    if language:
+        return f"websearch_to_tsquery('{TEXT_SEARCH_CONFIGS.get(language, 'simple')}', {param})"
+    configs = sorted(set(TEXT_SEARCH_CONFIGS.values()))
+    return "(" + " || ".join(f"websearch_to_tsquery('{cfg}', {param})" for cfg in configs) + ")"
+
+
+def _weighted_vector(config: str, columns) -> str:
+    return " || ".join(
+        f"setweight(to_tsvector({config}, coalesce({column}::text, '')), '{weight}')"
+        for column, weight in columns
+    )
+
+
+register_schema(
+    "ALTER TABLE lessons ADD COLUMN IF NOT EXISTS language VARCHAR(2)",
+    f"""
+    ALTER TABLE courses ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS ({_weighted_vector(config_expr('language'), [
+        ('title', 'A'), ('description', 'B'), ('learning_objectives', 'C')
+    ])}) STORED
+    """,
+    f"""
+    ALTER TABLE lessons ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS ({_weighted_vector(config_expr('language'), [
+        ('title', 'A'), ('description', 'B'), ('target', 'C')
+    ])}) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS courses_search_vector_idx ON courses USING GIN (search_vector)",
+    "CREATE INDEX IF NOT EXISTS lessons_search_vector_idx ON lessons USING GIN (search_vector)",
+)
+
+
+def serialize_hit(hit):
+    hit_dict = dict(hit)
+    for key, value in hit_dict.items():
+        if isinstance(value, datetime):
+            hit_dict[key] = value.isoformat()
+    hit_dict['rank'] = float(hit_dict['rank'])
+    return hit_dict
+
+
+@search_bp.route("/")
+async def search(request):
+    """
+    Ranked full-text search over courses and lessons.
+
+    Query parameters:
+        q: Search string (websearch syntax: quotes, OR, -exclusion)
+        type: all, course or lesson (default: all)
+        language: Restrict to one LANGUAGE_CHOICES code
+        limit: Results per page (default: 20, max: 100)
+        cursor: next_cursor from the previous page
+    """
+    try:
+        search_term = (request.args.get('q') or '').strip()
+        search_type = request.args.get('type', 'all')
+        language = request.args.get('language')
+        cursor = request.args.get('cursor')
+
+        if not search_term:
+            return json({"error": "q is required"}, status=400)
+        if search_type not in SEARCH_TYPES:
+            return json({"error": f"Invalid type. Must be one of: {', '.join(SEARCH_TYPES)}"}, status=400)
+        if language and language not in LANGUAGE_CHOICES:
+            return json({"error": f"Invalid language. Must be one of: {', '.join(LANGUAGE_CHOICES)}"}, status=400)
+
+        try:
+            limit = min(max(1, int(request.args.get('limit', DEFAULT_PAGE_SIZE))), MAX_PAGE_SIZE)
+            after = decode_cursor(cursor) if cursor else None
+            if after is not None:
+                if not isinstance(after, list) or len(after) != 3:
+                    raise ValueError("Invalid cursor")
+                after = [float(after[0]), str(after[1]), str(after[2])]
+        except (ValueError, TypeError):
+            return json({"error": "Invalid pagination parameters"}, status=400)
+
+        values = [search_term]
+        tsq = tsquery_expr("$1", language)
+
+        language_filter = ""
+        if language:
+            values.append(language)
+            language_filter = f"AND t.language = ${len(values)}"
+
+        branches = []
+        if search_type in ('all', 'course'):
+            branches.append(f"""
+                SELECT 'course' AS kind, t.hash, t.title, t.description, t.language,
+                       NULL AS from_course, NULL AS lesson_type,
+                       ts_rank_cd(t.search_vector, {tsq}, 32) AS rank
+                FROM courses t
+                WHERE t.is_active = true AND t.search_vector @@ {tsq} {language_filter}
+            """)
+        if search_type in ('all', 'lesson'):
+            branches.append(f"""
+                SELECT 'lesson' AS kind, t.hash, t.title, t.description, t.language,
+                       t.from_course, t.lesson_type,
+                       ts_rank_cd(t.search_vector, {tsq}, 32) AS rank
+                FROM lessons t
+                WHERE t.is_active = true AND t.search_vector @@ {tsq} {language_filter}
+            """)
+
+        # Keyset paging on (rank DESC, kind, hash)
+        cursor_filter = ""
+        if after:
+            values.extend(after)
+            r, k, h = len(values) - 2, len(values) - 1, len(values)
+            cursor_filter = f"""
+                WHERE rank < ${r}::real
+                   OR (rank = ${r}::real AND (kind, hash) > (${k}, ${h}))
+            """
+
+        values.append(limit + 1)
+        # Headlines are only computed for the rows on this page
+        query = f"""
+            SELECT page.kind, page.hash, page.title, page.description, page.language,
+                   page.from_course, page.lesson_type, page.rank,
+                   ts_headline({config_expr('page.language')}, coalesce(page.title, ''),
+                               {tsq}, 'HighlightAll=true, StartSel=<mark>, StopSel=</mark>') AS title_highlight,
+                   ts_headline({config_expr('page.language')}, coalesce(page.description, ''),
+                               {tsq}, '{HEADLINE_OPTIONS}') AS snippet
+            FROM (
+                SELECT * FROM ({' UNION ALL '.join(branches)}) hits
+                {cursor_filter}
+                ORDER BY rank DESC, kind, hash
+                LIMIT ${len(values)}
+            ) page
+            ORDER BY page.rank DESC, page.kind, page.hash
+        """
+
+        hits = await Database.fetch(query, *values)
+        has_more = len(hits) > limit
+        hits = hits[:limit]
+        next_cursor = None
+        if has_more:
+            last = hits[-1]
+            next_cursor = encode_cursor([float(last['rank']), last['kind'], last['hash']])
+
+        return json({
+            "items": [serialize_hit(hit) for hit in hits],
+            "next_cursor": next_cursor,
+            "has_more": has_more
+        })
+
+    except Exception as e:
+        return json({"error": str(e)}, status=500)
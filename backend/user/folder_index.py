@@ -0,0 +1,339 @@
+"""
+Listing and usage index for user folders.
+
+Directories are read with os.scandir on a small thread pool, never on the
+event loop. Each listing is cached per directory and reused while the
+directory's mtime is unchanged; upload, rename and delete drop it
+explicitly. Listings are sorted in memory and paged with an opaque cursor.
+
+Recursive folder sizes come from one walk of a user's tree the first time
+they are needed and are then kept current by the same write hooks, so
+showing usage never walks the tree again. Other workers are told through
+the invalidation bus ("user_folder") to forget that user's listings and sizes.
+
+Hidden names and waveform sidecars are left out of listings and sizes alike.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from utils.invalidation import on_invalidate, publish
+from utils.pagination import encode_cursor, decode_cursor
+from utils.waveform import PEAKS_SUFFIX
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import asyncio
+import bisect
+import os
+
+BASE_PATH = os.getenv('BASE_USER_DATA_PATH', 'data/user')
+FOLDER_CACHE_MAX_DIRS = int(os.getenv('FOLDER_CACHE_MAX_DIRS', 4096))
+FOLDER_SORT_KEYS = ("name", "modified", "size", "type")
+
+_io_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv('FOLDER_IO_WORKERS', 4)),
+    thread_name_prefix="folder-io"
+)
+
+
+def visible(relative: str) -> bool:
+    """Whether a path relative to the user's folder is listed and counted"""
+    return all(
+        part and not part.startswith('.') and not part.endswith(PEAKS_SUFFIX)
+        for part in relative.split(os.sep)
+    )
+
+
+def _ancestors(directory: str) -> Iterable[str]:
+    """directory, then each parent up to the user's folder ("")"""
+    while True:
+        yield directory
+        if not directory:
+            return
+        directory = os.path.dirname(directory)
+
+
+def _under(key: str, relative: str) -> bool:
+    return key == relative or key.startswith(relative + os.sep)
+
+
+async def run_io(func, *args):
+    """Run a blocking filesystem call on the folder I/O pool"""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(_io_pool, func, *args)
+
+
+def _mtime_ns(path: str) -> int:
+    return os.stat(path).st_mtime_ns
+
+
+def _scan(path: str) -> Tuple[int, List[Dict[str, Any]]]:
+    # mtime is taken first, so a change during the scan makes the next
+    # request scan again
+    mtime_ns = os.stat(path).st_mtime_ns
+    entries = []
+    with os.scandir(path) as iterator:
+        for entry in iterator:
+            if not visible(entry.name):
+                continue
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                stat = entry.stat(follow_symlinks=False)
+            except FileNotFoundError:
+                continue
+            entries.append({
+                "name": entry.name,
+                "type": "folder" if is_dir else "file",
+                "size": 0 if is_dir else stat.st_size,
+                "mtime": stat.st_mtime
+            })
+    return mtime_ns, entries
+
+
+def _walk_sizes(root: str) -> Dict[str, int]:
+    """Recursive size of every visible directory under root, keyed by relative path"""
+    sizes = {}
+    order = []
+    stack = [""]
+    while stack:
+        relative = stack.pop()
+        order.append(relative)
+        sizes[relative] = 0
+        try:
+            iterator = os.scandir(os.path.join(root, relative))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        with iterator:
+            for entry in iterator:
+                if not visible(entry.name):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(os.path.join(relative, entry.name))
+                    else:
+                        sizes[relative] += entry.stat(follow_symlinks=False).st_size
+                except FileNotFoundError:
+                    continue
+    # Parents precede their children in order, so children are added up first
+    for relative in reversed(order):
+        if relative:
+            sizes[os.path.dirname(relative)] += sizes[relative]
+    return sizes
+
+
+def _sort_key(entry: Dict[str, Any], sort: str) -> List[Any]:
+    """Sort value with the name as tie-breaker; also what a cursor holds"""
+    if sort == "name":
+        return [entry["name"].lower(), entry["name"]]
+    if sort == "modified":
+        return [entry["mtime"], entry["name"]]
+    return [entry[sort], entry["name"]]
+
+
+def _encode_position(sort: str, descending: bool, key: List[Any]) -> str:
+    return encode_cursor([sort, descending, *key])
+
+
+def _decode_position(cursor: str, sort: str, descending: bool) -> List[Any]:
+    """Sort key a cursor continues after; ValueError unless it was made for this order"""
+    position = decode_cursor(cursor)
+    if not isinstance(position, list) or len(position) != 4:
+        raise ValueError("Invalid cursor")
+    cursor_sort, cursor_descending, value, name = position
+    if cursor_sort != sort or cursor_descending != descending:
+        raise ValueError("Cursor belongs to a different sort order")
+    value_types = (str,) if sort in ("name", "type") else (int, float)
+    if not isinstance(name, str) or isinstance(value, bool) or not isinstance(value, value_types):
+        raise ValueError("Invalid cursor")
+    return [value, name]
+
+
+class FolderIndex:
+    """Per-worker listing cache and size index over BASE_PATH/<user_hash>"""
+
+    def __init__(self, base: str, max_dirs: int):
+        self.base = base
+        self.max_dirs = max_dirs
+        self._listings: "OrderedDict[Tuple[str, str], Tuple[int, List[Dict[str, Any]]]]" = OrderedDict()
+        self._sizes: Dict[str, Dict[str, int]] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        # Users whose tree changed while their sizes were being walked
+        self._stale = set()
+
+    def user_root(self, user_hash: str) -> str:
+        return os.path.join(os.path.realpath(self.base), user_hash)
+
+    def resolve(self, user_hash: str, relative: Optional[str]) -> Tuple[str, str]:
+        """(absolute path, normalized relative path); ValueError if it leaves the user's folder"""
+        root = self.user_root(user_hash)
+        path = os.path.realpath(os.path.join(root, relative or ""))
+        if path == root:
+            return path, ""
+        if not path.startswith(root + os.sep):
+            raise ValueError("Path is outside the user's folder")
+        return path, os.path.relpath(path, root)
+
+    async def listing(self, user_hash: str, relative: str) -> List[Dict[str, Any]]:
+        """Visible entries of a directory; FileNotFoundError/NotADirectoryError if it isn't one"""
+        path, relative = self.resolve(user_hash, relative)
+        key = (user_hash, relative)
+        cached = self._listings.get(key)
+        if cached is not None and await run_io(_mtime_ns, path) == cached[0]:
+            self._listings.move_to_end(key)
+            return cached[1]
+
+        mtime_ns, entries = await run_io(_scan, path)
+        self._listings[key] = (mtime_ns, entries)
+        self._listings.move_to_end(key)
+        while len(self._listings) > self.max_dirs:
+            self._listings.popitem(last=False)
+        return entries
+
+    async def sizes(self, user_hash: str) -> Dict[str, int]:
+        """Recursive size of each of the user's directories, walking the tree only once"""
+        while user_hash not in self._sizes:
+            pending = self._loading.get(user_hash)
+            if pending is not None:
+                await asyncio.shield(pending)
+                continue
+            self._stale.discard(user_hash)
+            loop = asyncio.get_event_loop()
+            pending = loop.run_in_executor(_io_pool, _walk_sizes, self.user_root(user_hash))
+            self._loading[user_hash] = pending
+            try:
+                sizes = await asyncio.shield(pending)
+            finally:
+                self._loading.pop(user_hash, None)
+            if user_hash in self._stale:
+                # Missed a change while walking; count again
+                continue
+            self._sizes[user_hash] = sizes
+        return self._sizes[user_hash]
+
+    async def usage(self, user_hash: str, relative: str = "") -> int:
+        _, relative = self.resolve(user_hash, relative)
+        return (await self.sizes(user_hash)).get(relative, 0)
+
+    async def page(self, user_hash: str, relative: str, sort: str = "name",
+                   descending: bool = False, limit: int = 50,
+                   cursor: Optional[str] = None) -> Tuple[List[Dict[str, Any]], Optional[str], int]:
+        """
+        One page of a directory as (items, next_cursor, total). Folders carry
+        their recursive size. ValueError for an unknown sort key or a bad cursor.
+        """
+        if sort not in FOLDER_SORT_KEYS:
+            raise ValueError(f"Invalid sort key. Must be one of: {', '.join(FOLDER_SORT_KEYS)}")
+        after = _decode_position(cursor, sort, descending) if cursor else None
+
+        _, relative = self.resolve(user_hash, relative)
+        entries = await self.listing(user_hash, relative)
+        sizes = await self.sizes(user_hash)
+        rows = [
+            {**entry, "size": sizes.get(os.path.join(relative, entry["name"]), 0)}
+            if entry["type"] == "folder" else entry
+            for entry in entries
+        ]
+        rows.sort(key=lambda row: _sort_key(row, sort))
+        keys = [_sort_key(row, sort) for row in rows]
+
+        if descending:
+            end = bisect.bisect_left(keys, after) if after is not None else len(rows)
+            selected = rows[max(0, end - limit):end][::-1]
+            has_more = end - limit > 0
+        else:
+            start = bisect.bisect_right(keys, after) if after is not None else 0
+            selected = rows[start:start + limit]
+            has_more = start + limit < len(rows)
+
+        items = [{
+            "name": row["name"],
+            "type": row["type"],
+            "size": row["size"],
+            "modified": datetime.fromtimestamp(row["mtime"]).isoformat(),
+            "path": os.path.join(relative, row["name"]) if relative else row["name"]
+        } for row in selected]
+        next_cursor = (
+            _encode_position(sort, descending, _sort_key(selected[-1], sort))
+            if has_more and selected else None
+        )
+        return items, next_cursor, len(rows)
+
+    def _drop_listings(self, user_hash: str, relative: str) -> None:
+        """Listings of relative, anything below it and every directory above it"""
+        for key in [key for key in self._listings if key[0] == user_hash and _under(key[1], relative)]:
+            del self._listings[key]
+        for directory in _ancestors(os.path.dirname(relative)):
+            self._listings.pop((user_hash, directory), None)
+        if user_hash in self._loading:
+            self._stale.add(user_hash)
+
+    async def file_added(self, user_hash: str, relative: str, size: int) -> None:
+        """A file of size bytes was written at relative (parents created as needed)"""
+        _, relative = self.resolve(user_hash, relative)
+        self._drop_listings(user_hash, relative)
+        sizes = self._sizes.get(user_hash)
+        if sizes is not None and visible(relative):
+            for directory in _ancestors(os.path.dirname(relative)):
+                sizes[directory] = sizes.get(directory, 0) + size
+        await self._broadcast(user_hash)
+
+    async def removed(self, user_hash: str, relative: str, size: Optional[int] = None) -> None:
+        """A file (size given) or a folder (size None, taken from the index) was deleted"""
+        _, relative = self.resolve(user_hash, relative)
+        self._drop_listings(user_hash, relative)
+        sizes = self._sizes.get(user_hash)
+        if sizes is not None and visible(relative):
+            if size is None:
+                size = sizes.get(relative, 0)
+            for key in [key for key in sizes if _under(key, relative)]:
+                del sizes[key]
+            for directory in _ancestors(os.path.dirname(relative)):
+                sizes[directory] = sizes.get(directory, 0) - size
+        await self._broadcast(user_hash)
+
+    async def renamed(self, user_hash: str, old_relative: str, new_relative: str) -> None:
+        """A file or folder was renamed within its directory"""
+        _, old_relative = self.resolve(user_hash, old_relative)
+        _, new_relative = self.resolve(user_hash, new_relative)
+        self._drop_listings(user_hash, old_relative)
+        self._drop_listings(user_hash, new_relative)
+        sizes = self._sizes.get(user_hash)
+        if sizes is not None:
+            if visible(old_relative) and visible(new_relative):
+                for key in [key for key in sizes if _under(key, old_relative)]:
+                    sizes[new_relative + key[len(old_relative):]] = sizes.pop(key)
+            else:
+                # Shown or hidden by the rename; count again when next needed
+                self._sizes.pop(user_hash, None)
+        await self._broadcast(user_hash)
+
+    def forget_all(self) -> None:
+        self._listings.clear()
+        self._sizes.clear()
+        self._stale.update(self._loading)
+
+    def forget(self, user_hash: str) -> None:
+        """Drop everything known about a user's folder"""
+        for key in [key for key in self._listings if key[0] == user_hash]:
+            del self._listings[key]
+        self._sizes.pop(user_hash, None)
+        if user_hash in self._loading:
+            self._stale.add(user_hash)
+
+    async def invalidate(self, user_hash: str) -> None:
+        """For writers that don't report what they changed"""
+        self.forget(user_hash)
+        await self._broadcast(user_hash)
+
+    async def _broadcast(self, user_hash: str) -> None:
+        # This worker's index is already current; only the others forget
+        await publish("user_folder", user_hash, local=False)
+
+
+folder_index = FolderIndex(BASE_PATH, FOLDER_CACHE_MAX_DIRS)
+
+
+@on_invalidate("user_folder")
+def _forget_user_folder(user_hash: Optional[str]) -> None:
+    if user_hash is None:
+        folder_index.forget_all()
+    else:
+        folder_index.forget(user_hash)
@@ -8,6 +8,7 @@ from datetime import datetime
 import os
 from dotenv import load_dotenv
 from .user_course_status import CourseStatusManager
+from course.course_rating import upsert_rating
 
 # Load environment variables
 load_dotenv()
@@ -224,4 +225,6 @@ async def rate_course(request, user_hash: str, course_hash: str):
     if not course:
         raise SanicException("User course enrollment not found", status_code=404)
     
+    await upsert_rating(user_hash, course_hash, float(rating))
+    
     return json(format_course_response(course))
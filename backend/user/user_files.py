@@ -6,6 +6,13 @@ from datetime import datetime
 import os
 import hashlib
 from dotenv import load_dotenv
+from utils.upload import receive_multipart, discard_files, MultipartError, UploadTooLarge
+from utils.blob_store import BLOB_UPLOAD_TMP_PATH, store_upload
+from utils.pagination import page_limit
+from utils.waveform import move_peaks, remove_peaks
+from user.folder_index import folder_index, run_io, FOLDER_SORT_KEYS
+from stat import S_ISDIR
+import shutil
 
 # Load environment variables
 load_dotenv()
@@ -16,37 +23,45 @@ user_files_bp = Blueprint("user_files", url_prefix="/api/v1/user-file")
 @user_files_bp.get("/folders")
 @openapi.summary("List folders for a user")
 @openapi.parameter("path", str, "query", description="Folder path (optional)")
+@openapi.parameter("sort", str, "query", description=f"One of {', '.join(FOLDER_SORT_KEYS)} (default: name)")
+@openapi.parameter("order", str, "query", description="asc (default) or desc")
+@openapi.parameter("limit", int, "query", description="Items per page")
+@openapi.parameter("cursor", str, "query", description="next_cursor of the previous page")
 @openapi.response(200, {"application/json": dict})
 async def list_folders(request):
-    """List folders and files in the specified path"""
+    """
+    List folders and files in the specified path, one page at a time.
+    Folder sizes are recursive; size is the usage of the listed folder.
+    """
     if not request.ctx.user:
         raise Unauthorized("User not authenticated")
     
     user_hash = request.ctx.user['hash']
     relative_path = request.args.get('path', '')
-    current_path = os.path.join(BASE_PATH, user_hash, relative_path)
-    
-    if not os.path.exists(current_path):
+    try:
+        limit = page_limit(request)
+        items, next_cursor, total = await folder_index.page(
+            user_hash, relative_path,
+            sort=request.args.get('sort', 'name'),
+            descending=request.args.get('order', 'asc').lower() == 'desc',
+            limit=limit,
+            cursor=request.args.get('cursor')
+        )
+        size = await folder_index.usage(user_hash, relative_path)
+    except (FileNotFoundError, NotADirectoryError):
         raise SanicException("Path not found", status_code=404)
-    
-    items = []
-    for item in os.listdir(current_path):
-        item_path = os.path.join(current_path, item)
-        item_stat = os.stat(item_path)
-        items.append({
-            "name": item,
-            "type": "folder" if os.path.isdir(item_path) else "file",
-            "size": item_stat.st_size,
-            "modified": datetime.fromtimestamp(item_stat.st_mtime).isoformat(),
-            "path": os.path.join(relative_path, item) if relative_path else item
-        })
+    except ValueError as e:
+        raise SanicException(str(e), status_code=400)
     
     return json({
         "items": items,
-        "current_path": relative_path
+        "current_path": relative_path,
+        "next_cursor": next_cursor,
+        "total": total,
+        "size": size
     })
 
-@user_files_bp.post("/upload-audio")
+@user_files_bp.post("/upload-audio", stream=True)
 @openapi.summary("Upload a file")
 @openapi.parameter("path", str, "form", description="Target folder path")
 @openapi.body({"multipart/form-data": {"file": "file"}})
@@ -58,33 +73,51 @@ async def upload_file(request):
         raise Unauthorized("User not authenticated")
     
     user_hash = request.ctx.user['hash']
-    if "file" not in request.files:
-        raise SanicException("No file part in the request", status_code=400)
-
-    file = request.files["file"][0]
-    relative_path = request.form.get("path", "")
-    
-    if not file.name:
-        raise SanicException("Invalid file", status_code=400)
-
-    # Create target directory
-    upload_dir = os.path.join(BASE_PATH, user_hash, relative_path)
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    # Generate unique filename
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    filename = f"{timestamp}_{file.name}"
-    file_path = os.path.join(upload_dir, filename)
-
-    # Save the file
-    with open(file_path, "wb") as f:
-        f.write(file.body)
+    # The body is streamed into the blob store's temp folder; the stored
+    # blob is then hard-linked into the user's folder
+    try:
+        form, files = await receive_multipart(request, BLOB_UPLOAD_TMP_PATH)
+    except UploadTooLarge as e:
+        raise SanicException(str(e), status_code=413)
+    except MultipartError as e:
+        raise SanicException(str(e), status_code=400)
+
+    try:
+        if "file" not in files:
+            raise SanicException("No file part in the request", status_code=400)
+
+        file = files["file"][0]
+        relative_path = form.get("path", "")
+        
+        if not file.name:
+            raise SanicException("Invalid file", status_code=400)
+
+        try:
+            upload_dir, relative_path = folder_index.resolve(user_hash, relative_path)
+        except ValueError as e:
+            raise SanicException(str(e), status_code=400)
+        
+        # Generate unique filename
+        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+        filename = f"{timestamp}_{file.name}"
+        file_path = os.path.join(upload_dir, filename)
+
+        # Identical content is stored once, however many times it is uploaded;
+        # a name already taken gets a numbered variant
+        blob = await store_upload(file, link_to=file_path, owner=user_hash)
+        filename = os.path.basename(blob["linked_path"])
+    finally:
+        await discard_files(files)
+
+    await folder_index.file_added(user_hash, os.path.join(relative_path, filename), file.size)
 
     return json({
         "message": "File uploaded successfully",
         "path": os.path.join(relative_path, filename),
         "name": filename,
-        "size": os.path.getsize(file_path),
+        "size": file.size,
+        "sha256": file.sha256,
+        "deduplicated": blob["deduplicated"],
         "created_at": datetime.utcnow().isoformat()
     }, status=201)
 
@@ -108,18 +141,30 @@ async def rename_item(request):
     if not old_path or not new_name:
         raise SanicException("Missing required parameters", status_code=400)
 
-    full_old_path = os.path.join(BASE_PATH, user_hash, old_path)
-    if not os.path.exists(full_old_path):
-        raise SanicException("File or folder not found", status_code=404)
-
     # Create new path with new name but same directory
-    dir_path = os.path.dirname(full_old_path)
-    full_new_path = os.path.join(dir_path, new_name)
+    if os.sep in new_name or new_name in (".", ".."):
+        raise SanicException("Invalid name", status_code=400)
+    try:
+        full_old_path, old_path = folder_index.resolve(user_hash, old_path)
+        full_new_path, new_path = folder_index.resolve(
+            user_hash, os.path.join(os.path.dirname(old_path), new_name)
+        )
+    except ValueError as e:
+        raise SanicException(str(e), status_code=400)
+    if not old_path:
+        raise SanicException("Cannot rename the root folder", status_code=400)
+
+    if not await run_io(os.path.lexists, full_old_path):
+        raise SanicException("File or folder not found", status_code=404)
 
-    if os.path.exists(full_new_path):
+    if await run_io(os.path.lexists, full_new_path):
         raise SanicException("A file or folder with this name already exists", status_code=409)
 
-    os.rename(full_old_path, full_new_path)
+    await run_io(os.rename, full_old_path, full_new_path)
+    # A folder takes its files' waveform sidecars with it; a file needs its own moved
+    if not await run_io(os.path.isdir, full_new_path):
+        await run_io(move_peaks, full_old_path, full_new_path)
+    await folder_index.renamed(user_hash, old_path, new_path)
     
     return json({
         "message": "Item renamed successfully",
@@ -140,14 +185,24 @@ async def delete_item(request):
     if not relative_path:
         raise SanicException("Path parameter is required", status_code=400)
 
-    full_path = os.path.join(BASE_PATH, user_hash, relative_path)
-    if not os.path.exists(full_path):
+    try:
+        full_path, relative_path = folder_index.resolve(user_hash, relative_path)
+    except ValueError as e:
+        raise SanicException(str(e), status_code=400)
+    if not relative_path:
+        raise SanicException("Cannot delete the root folder", status_code=400)
+
+    try:
+        stat = await run_io(os.lstat, full_path)
+    except FileNotFoundError:
         raise SanicException("File or folder not found", status_code=404)
 
-    if os.path.isdir(full_path):
-        import shutil
-        shutil.rmtree(full_path)
+    if S_ISDIR(stat.st_mode):
+        await run_io(shutil.rmtree, full_path)
+        await folder_index.removed(user_hash, relative_path)
     else:
-        os.remove(full_path)
+        await run_io(os.remove, full_path)
+        await run_io(remove_peaks, full_path)
+        await folder_index.removed(user_hash, relative_path, stat.st_size)
 
     return json({}, status=204) 
\ No newline at end of file
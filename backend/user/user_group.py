@@ -4,6 +4,7 @@ from datetime import datetime
 from models import hash1
 from sanic.exceptions import InvalidUsage, NotFound, SanicException
 from database import Database
+from utils.pagination import KeysetQuery, page_limit, select_fields, wants_stream
 import asyncpg
 
 import os
@@ -14,6 +15,11 @@ TABLE_PREFIX = os.getenv('DATABASE_TABLE_PREFIX', '')
 
 user_group_bp = Blueprint('user_group_bp', url_prefix='/api/v1/user-groups')
 
+GROUP_FIELDS = [
+    'hash', 'name', 'description', 'is_open', 'is_closed',
+    'created_at', 'created_by_hash'
+]
+
 def serialize_datetime(obj):
     """Helper function to serialize datetime objects"""
     if isinstance(obj, datetime):
@@ -151,7 +157,18 @@ async def leave_group(request, group_hash):
 
 @user_group_bp.get("/list")
 async def list_groups(request):
-    """List all user groups with optional filters"""
+    """
+    List user groups with optional filters, newest first.
+    
+    Paginated with ?limit=&cursor=, projected with ?fields=, or streamed
+    in full as NDJSON with ?format=ndjson.
+    """
+    try:
+        limit = page_limit(request)
+        fields = select_fields(request, GROUP_FIELDS, GROUP_FIELDS)
+    except ValueError as e:
+        raise InvalidUsage(str(e))
+    
     conditions = []
     params = []
     param_count = 1
@@ -176,20 +193,23 @@ async def list_groups(request):
         params.append(f"%{request.args.get('search')}%")
         param_count += 1
     
-    where_clause = " AND ".join(conditions)
-    where_clause = f"WHERE {where_clause}" if where_clause else ""
-    
-    query = f"""
-        SELECT hash, name, description, is_open, is_closed, 
-               created_at, created_by_hash
-        FROM {TABLE_PREFIX}_user_groups
-        {where_clause}
-        ORDER BY created_at DESC
-    """
+    keyset = KeysetQuery(
+        f"{TABLE_PREFIX}_user_groups",
+        fields,
+        keys=[("created_at", "timestamp"), ("hash", "text")],
+        conditions=conditions,
+        params=params
+    )
+    cursor = request.args.get('cursor')
     
-    results = await Database.fetch(query, *params)
+    try:
+        if wants_stream(request):
+            return await keyset.stream(request, serialize_row, cursor)
+        page = await keyset.fetch_page(cursor, limit, serialize_row)
+    except ValueError as e:
+        raise InvalidUsage(str(e))
     
-    return json([serialize_row(row) for row in results])
+    return json(page)
 
 @user_group_bp.get("/<group_hash>/members")
 async def get_group_members(request, group_hash):
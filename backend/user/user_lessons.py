@@ -2,7 +2,7 @@ from sanic import Blueprint
 from sanic.response import json
 from sanic.exceptions import SanicException, Unauthorized
 from sanic_ext import openapi
-from database import Database
+from database import Database, register_schema, column_compression
 from datetime import datetime
 import os
 from dotenv import load_dotenv
@@ -14,6 +14,7 @@ import uuid
 from typing import List, Optional
 
 from utils.encryption import simple_encrypt, simple_decrypt, url_encode, url_decode
+from lessons.lessons import CONTENT_FIELDS, content_url
 
 # Load environment variables
 load_dotenv()
@@ -22,6 +23,13 @@ USER_LESSONS_TABLE = f"{TABLE_PREFIX}_user_lessons"
 LESSONS_TABLE = f"lessons"
 USERS_TABLE = f"{TABLE_PREFIX}_users"
 USER_LESSON_RESULTS_TABLE = f"{TABLE_PREFIX}_user_lesson_results"
+
+# Learning logs are large, repetitive JSON; lz4 TOAST compression is cheaper
+# to read back than the default pglz
+register_schema(
+    column_compression(USER_LESSONS_TABLE, "learning_log"),
+    column_compression(USER_LESSON_RESULTS_TABLE, "learning_log"),
+)
 user_lessons_bp = Blueprint("user_lessons", url_prefix="/api/v1/user-lessons")
 
 VALID_STATUSES = {
@@ -40,12 +48,6 @@ def format_lesson_response(lesson, simple=True):
         lesson: The lesson record from database
         simple: If True, returns only essential fields
     """
-    # Parse learning_log if it's a string
-    try:
-        learning_log = json_lib.loads(lesson['learning_log']) if 'learning_log' in lesson and isinstance(lesson['learning_log'], str) else {}
-    except (json_lib.JSONDecodeError, TypeError):
-        learning_log = {}
-
     if simple:
         response = {
             "id": lesson['id'],
@@ -78,6 +80,12 @@ def format_lesson_response(lesson, simple=True):
         }
         return response
     
+    # Parse learning_log if it's a string; only the full response carries it
+    try:
+        learning_log = json_lib.loads(lesson['learning_log']) if 'learning_log' in lesson and isinstance(lesson['learning_log'], str) else {}
+    except (json_lib.JSONDecodeError, TypeError):
+        learning_log = {}
+
     full_response = {
         "id": lesson['id'],
         "user_hash": lesson['user_hash'],
@@ -274,20 +282,23 @@ async def create_user_lesson(request):
 
 @user_lessons_bp.get("/<lesson_hash:str>")
 @openapi.summary("Get a specific user lesson")
+@openapi.parameter("include_content", bool, "query", description="Inline lesson content instead of referencing it by content_hash (default: false)")
 @openapi.response(200, {"application/json": dict})
 async def get_user_lesson(request, lesson_hash: str):
     user = request.ctx.user
     if not user:
         raise Unauthorized("User not authenticated")
 
+    include_content = request.args.get('include_content', 'false').lower() == 'true'
+    content_columns = ", ".join(f"l.{field}" for field in CONTENT_FIELDS) + "," if include_content else ""
+
     query = f"""
         SELECT ul.id, ul.user_hash, ul.teacher_hash, ul.lesson_hash, ul.status, ul.progress,
                ul.last_accessed, ul.learning_log, ul.is_shared, ul.from_course, 
                ul.created_at, ul.updated_at, ul.score,
                l.title, l.description, l.duration_minutes, l.is_active,
                l.is_preview, l.is_published, l.file_path,
-               l.lesson_type, l.lesson_content,
-               l.target, l.base_knowledges, l.target_knowledges,
+               l.lesson_type, {content_columns} l.content_hash,
                l.created_by, l.thumbnail_path
         FROM {USER_LESSONS_TABLE} ul
         LEFT JOIN {LESSONS_TABLE} l ON ul.lesson_hash = l.hash
@@ -304,16 +315,23 @@ async def get_user_lesson(request, lesson_hash: str):
     # Add additional fields for detailed view
     response.update({
         "lesson_type": lesson['lesson_type'],
-        "lesson_content": lesson['lesson_content'],
-        "target": lesson['target'],
-        "base_knowledges": lesson['base_knowledges'],
-        "target_knowledges": lesson['target_knowledges'],
         "created_by": lesson['created_by'],
         "thumbnail_path": lesson['thumbnail_path']
     })
+    response.update(_lesson_content_fields(lesson, include_content))
     
     return json(response)
 
+def _lesson_content_fields(lesson, include_content):
+    """Inline content fields, or a reference to the content-addressed endpoint."""
+    fields = {
+        "content_hash": lesson['content_hash'],
+        "content_url": content_url(lesson['content_hash']) if lesson['content_hash'] else None
+    }
+    if include_content:
+        fields.update({field: lesson[field] for field in CONTENT_FIELDS})
+    return fields
+
 @user_lessons_bp.put("/<lesson_hash:str>")
 async def update_user_lesson(request, lesson_hash: str):
     user = request.ctx.user
@@ -360,9 +378,7 @@ async def update_user_lesson(request, lesson_hash: str):
         AND ul.lesson_hash = l.hash
         RETURNING ul.*, l.title, l.teacher_hash, l.description, l.duration_minutes, l.is_active, 
                   l.is_preview, l.is_published, l.file_path, l.lesson_type,
-                  l.lesson_content, l.target,
-                  l.base_knowledges, l.target_knowledges, l.created_by,
-                  l.thumbnail_path
+                  l.content_hash, l.created_by, l.thumbnail_path
     """
     
     lesson = await Database.fetchrow(query, *params)
@@ -489,9 +505,7 @@ async def update_lesson_progress(request, lesson_hash: str):
                      ul.created_at, ul.updated_at,
                      l.title, l.description, l.duration_minutes, l.is_active,
                      l.is_preview, l.is_published, l.file_path, l.lesson_type,
-                     l.lesson_content, l.target,
-                     l.base_knowledges, l.target_knowledges, l.created_by,
-                     l.thumbnail_path
+                     l.content_hash, l.created_by, l.thumbnail_path
         """
         
         lesson = await Database.fetchrow(
@@ -562,8 +576,14 @@ async def get_shared_lesson(request, share_token: str):
         user_hash, lesson_hash = decrypted.split(':', 1)
         print(f"Parsed values - user_hash: {user_hash}, lesson_hash: {lesson_hash}")  # Debug log
         
+        include_content = request.args.get('include_content', 'false').lower() == 'true'
+        content_columns = ", ".join(f"l.{field}" for field in CONTENT_FIELDS) + "," if include_content else ""
+        
         query = f"""
-            SELECT ul.*, l.*,
+            SELECT ul.*,
+                   l.title, l.description, l.duration_minutes, l.is_active,
+                   l.is_preview, l.is_published, l.file_path, l.thumbnail_path,
+                   l.lesson_type, l.created_by, {content_columns} l.content_hash,
                    u.full_name
             FROM {USER_LESSONS_TABLE} ul
             LEFT JOIN {LESSONS_TABLE} l ON ul.lesson_hash = l.hash
@@ -578,6 +598,7 @@ async def get_shared_lesson(request, share_token: str):
             raise SanicException("Shared lesson not found", status_code=404)
         
         response = format_lesson_response(lesson, simple=False)
+        response.update(_lesson_content_fields(lesson, include_content))
         response['user'] = {
             'full_name': lesson['full_name']
         }
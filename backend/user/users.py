@@ -5,6 +5,8 @@ from sanic_ext import openapi
 from models import User, UserCreate, UserUpdate, hash1
 from datetime import datetime
 from database import Database
+from utils.invalidation import publish
+from utils.pagination import KeysetQuery, page_limit, select_fields, wants_stream
 import os
 from dotenv import load_dotenv
 
@@ -14,28 +16,42 @@ USERS_TABLE = f"{TABLE_PREFIX}_users"
 USER_SHARES_TABLE = f"{TABLE_PREFIX}_user_shares"
 users_bp = Blueprint("users", url_prefix="api/v1/users")
 
+USER_FIELDS = [
+    'id', 'hash', 'mobile_phone', 'role', 'email', 'full_name',
+    'created_at', 'updated_at'
+]
+
+def serialize_user(user):
+    return {
+        key: value.isoformat() if isinstance(value, datetime) else value
+        for key, value in dict(user).items()
+    }
+
 @users_bp.get("/")
-@openapi.summary("Get all users")
-@openapi.response(200, {"application/json": list[User]})
+@openapi.summary("Get users, newest first")
+@openapi.description(
+    "Paginated with ?limit=&cursor= (next_cursor in the response), projected "
+    "with ?fields=, or streamed in full as NDJSON with ?format=ndjson."
+)
+@openapi.response(200, {"application/json": dict})
 async def get_users(request):
-    query = f"""
-        SELECT id, hash, mobile_phone, role, email, full_name, created_at, updated_at 
-        FROM {USERS_TABLE}
-    """
-    users = await Database.fetch(query)
-    return json([
-        {
-            'id': user['id'],
-            'hash': user['hash'],
-            'mobile_phone': user['mobile_phone'],
-            'role': user['role'],
-            'email': user['email'],
-            'full_name': user['full_name'],
-            'created_at': user['created_at'].isoformat(),
-            'updated_at': user['updated_at'].isoformat()
-        }
-        for user in users
-    ])
+    try:
+        limit = page_limit(request)
+        fields = select_fields(request, USER_FIELDS, USER_FIELDS)
+    except ValueError as e:
+        raise SanicException(str(e), status_code=400)
+
+    keyset = KeysetQuery(USERS_TABLE, fields, keys=[("id", "int")])
+    cursor = request.args.get('cursor')
+
+    try:
+        if wants_stream(request):
+            return await keyset.stream(request, serialize_user, cursor)
+        page = await keyset.fetch_page(cursor, limit, serialize_user)
+    except ValueError as e:
+        raise SanicException(str(e), status_code=400)
+
+    return json(page)
 
 @users_bp.post("/")
 @openapi.summary("Create a new user")
@@ -166,6 +182,7 @@ async def update_user(request, user_id: int):
     if user is None:
         raise SanicException("User not found", status_code=404)
 
+    await publish("user", user['hash'])
     return json({
         'id': user['id'],
         'hash': user['hash'],
@@ -181,10 +198,11 @@ async def update_user(request, user_id: int):
 @openapi.summary("Delete a user")
 @openapi.response(204, description="User deleted successfully")
 async def delete_user(request, user_id: int):
-    query = f"DELETE FROM {USERS_TABLE} WHERE id = $1 RETURNING id"
+    query = f"DELETE FROM {USERS_TABLE} WHERE id = $1 RETURNING id, hash"
     result = await Database.fetchrow(query, user_id)
     
     if result is None:
         raise SanicException("User not found", status_code=404)
     
+    await publish("user", result['hash'])
     return json({}, status=204)
\ No newline at end of file
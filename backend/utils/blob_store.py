@@ -0,0 +1,355 @@
+"""
+Content-addressed, deduplicated storage for uploaded media.
+
+Each distinct file is stored once under BLOB_STORE_PATH/<sha[:2]>/<sha[2:4]>/<sha>
+and described by a row in the blobs table. Resource rows hold a counted
+reference (refcount); user folder uploads are hard links to the blob, so
+they count through the file's link count instead and keep working with the
+plain filesystem operations user_files uses. A blob nobody references is
+removed by the garbage collector after BLOB_GC_GRACE_SECONDS.
+
+Knowing a hash is not enough to use a blob: blob_owners records who
+uploaded each one, and get_blob/acquire only hand a blob to one of them.
+
+Placing, linking and collecting a blob all hold the same per-hash advisory
+lock, so the collector can never remove a file someone is taking a reference on.
+Liveness is kept in the table (refcount, last_referenced_at), never on the
+file: user folder links share its inode, and touching it would change their
+mtime, ETag and Last-Modified.
+
+The store may sit under BASE_DATA_PATH so resource rows can name blobs by a
+data-relative path, but /data does not serve it (see is_blob_path): a blob is
+only handed out through routes that check who is asking.
+"""
+from database import Database, register_schema, logger
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+import asyncio
+import errno
+import os
+import re
+import shutil
+import time
+
+TABLE_PREFIX = os.getenv('DATABASE_TABLE_PREFIX', '')
+BLOBS_TABLE = f"{TABLE_PREFIX}_blobs"
+BLOB_OWNERS_TABLE = f"{TABLE_PREFIX}_blob_owners"
+
+BLOB_STORE_PATH = os.getenv(
+    'BLOB_STORE_PATH', os.path.join(os.getenv('BASE_DATA_PATH', 'data'), 'blobs')
+)
+# Uploads destined for the store are streamed here, on the same filesystem
+BLOB_UPLOAD_TMP_PATH = os.path.join(BLOB_STORE_PATH, '.uploads')
+BLOB_GC_INTERVAL = float(os.getenv('BLOB_GC_INTERVAL', 3600))
+BLOB_GC_GRACE_SECONDS = float(os.getenv('BLOB_GC_GRACE_SECONDS', 3600))
+
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+register_schema(
+    f"""
+    CREATE TABLE IF NOT EXISTS {BLOBS_TABLE} (
+        sha256 TEXT PRIMARY KEY,
+        size BIGINT NOT NULL,
+        mime_type TEXT,
+        refcount INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP NOT NULL,
+        last_referenced_at TIMESTAMP NOT NULL
+    )
+    """,
+    f"""
+    CREATE INDEX IF NOT EXISTS {BLOBS_TABLE}_unreferenced_idx
+    ON {BLOBS_TABLE} (last_referenced_at) WHERE refcount <= 0
+    """,
+    f"""
+    CREATE TABLE IF NOT EXISTS {BLOB_OWNERS_TABLE} (
+        sha256 TEXT NOT NULL REFERENCES {BLOBS_TABLE} (sha256) ON DELETE CASCADE,
+        user_hash TEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (sha256, user_hash)
+    )
+    """,
+)
+
+_gc_task = None
+
+
+def blob_relative_path(sha256: str) -> str:
+    return os.path.join(sha256[:2], sha256[2:4], sha256)
+
+
+def blob_path(sha256: str) -> str:
+    return os.path.join(BLOB_STORE_PATH, blob_relative_path(sha256))
+
+
+def blob_data_path(sha256: str) -> str:
+    """Path of the blob relative to BASE_DATA_PATH, as resource rows store it"""
+    return os.path.relpath(blob_path(sha256), os.getenv('BASE_DATA_PATH', 'data'))
+
+
+def is_blob_path(location: str) -> bool:
+    """Whether a resolved absolute path lies inside the blob store"""
+    root = os.path.realpath(BLOB_STORE_PATH)
+    return location == root or location.startswith(root + os.sep)
+
+
+async def _lock(conn, sha256: str) -> None:
+    await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", f"blob:{sha256}")
+
+
+def _place(source: str, destination: str) -> bool:
+    """Move source to destination unless the content is already there; True if it was"""
+    if os.path.exists(destination):
+        os.unlink(source)
+        return True
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    os.chmod(source, 0o444)
+    os.replace(source, destination)
+    return False
+
+
+def _copy_exclusive(source: str, destination: str) -> None:
+    """Copy source to a destination that must not exist yet"""
+    with open(source, "rb") as src, open(destination, "xb") as dst:
+        try:
+            shutil.copyfileobj(src, dst)
+        except BaseException:
+            os.unlink(destination)
+            raise
+
+
+def _link(source: str, destination: str) -> str:
+    """
+    Hard-link source at destination, or at "name (n).ext" if that is taken,
+    and return the path used. An existing file is never written to: it may
+    be another link to some blob.
+    """
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    stem, ext = os.path.splitext(destination)
+    for attempt in range(100):
+        path = f"{stem} ({attempt}){ext}" if attempt else destination
+        try:
+            os.link(source, path)
+            return path
+        except FileExistsError:
+            continue
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+        # Different filesystem: fall back to a private copy
+        try:
+            _copy_exclusive(source, path)
+            return path
+        except FileExistsError:
+            continue
+    raise FileExistsError(errno.EEXIST, "No free file name", destination)
+
+
+async def store_upload(upload, reference: bool = False, link_to: Optional[str] = None,
+                       owner: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Put a StreamedFile (received into BLOB_UPLOAD_TMP_PATH) in the store.
+    Identical content already stored is kept and the upload dropped, so a
+    repeated upload only costs metadata. reference=True counts a reference
+    for a database row; link_to hard-links the blob at that path, or at a
+    numbered variant if it is taken (returned as linked_path). owner, a
+    user hash, may use the blob by hash afterwards.
+    """
+    sha256 = upload.sha256
+    destination = blob_path(sha256)
+    loop = asyncio.get_event_loop()
+    now = datetime.utcnow()
+
+    async with Database.atomic() as conn:
+        await _lock(conn, sha256)
+        await conn.execute(
+            f"""
+            INSERT INTO {BLOBS_TABLE} (sha256, size, mime_type, refcount, created_at, last_referenced_at)
+            VALUES ($1, $2, $3, $4, $5, $5)
+            ON CONFLICT (sha256) DO UPDATE
+            SET refcount = {BLOBS_TABLE}.refcount + EXCLUDED.refcount,
+                last_referenced_at = EXCLUDED.last_referenced_at
+            """,
+            sha256, upload.size, upload.type, 1 if reference else 0, now
+        )
+        if owner:
+            await conn.execute(
+                f"""
+                INSERT INTO {BLOB_OWNERS_TABLE} (sha256, user_hash, created_at)
+                VALUES ($1, $2, $3)
+                ON CONFLICT DO NOTHING
+                """,
+                sha256, owner, now
+            )
+        deduplicated = await loop.run_in_executor(None, _place, upload.tmp_path, destination)
+        upload.tmp_path = None
+        linked_path = None
+        if link_to:
+            linked_path = await loop.run_in_executor(None, _link, destination, link_to)
+
+    return {
+        "sha256": sha256,
+        "size": upload.size,
+        "mime_type": upload.type,
+        "path": blob_data_path(sha256),
+        "linked_path": linked_path,
+        "deduplicated": deduplicated
+    }
+
+
+def _owned_by(param: str) -> str:
+    """SQL true when the blob was uploaded by the user in param, or param is NULL"""
+    return f"""({param}::text IS NULL OR EXISTS (
+        SELECT 1 FROM {BLOB_OWNERS_TABLE} o
+        WHERE o.sha256 = {BLOBS_TABLE}.sha256 AND o.user_hash = {param}
+    ))"""
+
+
+async def get_blob(sha256: str, owner: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """The blob, if it exists and (owner given) was uploaded by owner"""
+    if not SHA256_PATTERN.match(sha256 or ""):
+        return None
+    row = await Database.fetchrow(
+        f"SELECT * FROM {BLOBS_TABLE} WHERE sha256 = $1 AND {_owned_by('$2')}", sha256, owner
+    )
+    if not row or not os.path.exists(blob_path(sha256)):
+        return None
+    return {**dict(row), "path": blob_data_path(sha256)}
+
+
+async def acquire(conn, sha256: str, owner: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Count a reference to an existing blob within conn's transaction; None
+    if unknown or, with owner given, not uploaded by owner
+    """
+    await _lock(conn, sha256)
+    row = await conn.fetchrow(
+        f"""
+        UPDATE {BLOBS_TABLE}
+        SET refcount = refcount + 1, last_referenced_at = $2
+        WHERE sha256 = $1 AND {_owned_by('$3')}
+        RETURNING sha256, size, mime_type
+        """,
+        sha256, datetime.utcnow(), owner
+    )
+    if not row or not os.path.exists(blob_path(sha256)):
+        return None
+    return {**dict(row), "path": blob_data_path(sha256)}
+
+
+async def release(conn, sha256: Optional[str]) -> None:
+    """Drop a reference counted by store_upload or acquire"""
+    if not sha256:
+        return
+    await conn.execute(
+        f"""
+        UPDATE {BLOBS_TABLE}
+        SET refcount = GREATEST(refcount - 1, 0), last_referenced_at = $2
+        WHERE sha256 = $1
+        """,
+        sha256, datetime.utcnow()
+    )
+
+
+def _unlink_if_unlinked(path: str) -> bool:
+    """Remove the blob file unless a user folder still hard-links it"""
+    try:
+        if os.stat(path).st_nlink > 1:
+            return False
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+    return True
+
+
+def _orphan_files(cutoff: float):
+    """
+    Blob files older than cutoff, for matching against the table. Only files
+    without a row are swept, and the row is written under the blob's lock
+    before the file is placed, so a file's age is just a grace period here.
+    """
+    for dirpath, dirnames, filenames in os.walk(BLOB_STORE_PATH):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if SHA256_PATTERN.match(filename) and stat.st_mtime < cutoff and stat.st_nlink <= 1:
+                yield filename
+
+
+async def collect_garbage(grace_seconds: float = BLOB_GC_GRACE_SECONDS) -> Dict[str, int]:
+    """
+    Remove blobs without references: no counted reference, no hard link and
+    untouched for grace_seconds. Also sweeps files a crash left without a row.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=grace_seconds)
+    loop = asyncio.get_event_loop()
+    removed = 0
+    linked = 0
+
+    candidates = await Database.fetch(
+        f"SELECT sha256 FROM {BLOBS_TABLE} WHERE refcount <= 0 AND last_referenced_at < $1",
+        cutoff
+    )
+    for row in candidates:
+        sha256 = row['sha256']
+        async with Database.atomic() as conn:
+            await _lock(conn, sha256)
+            still_unreferenced = await conn.fetchval(
+                f"""
+                SELECT 1 FROM {BLOBS_TABLE}
+                WHERE sha256 = $1 AND refcount <= 0 AND last_referenced_at < $2
+                """,
+                sha256, cutoff
+            )
+            if not still_unreferenced:
+                continue
+            if await loop.run_in_executor(None, _unlink_if_unlinked, blob_path(sha256)):
+                await conn.execute(f"DELETE FROM {BLOBS_TABLE} WHERE sha256 = $1", sha256)
+                removed += 1
+            else:
+                # Still in a user folder; look again after another grace period
+                await conn.execute(
+                    f"UPDATE {BLOBS_TABLE} SET last_referenced_at = $2 WHERE sha256 = $1",
+                    sha256, datetime.utcnow()
+                )
+                linked += 1
+
+    orphan_cutoff = time.time() - grace_seconds
+    orphans = await loop.run_in_executor(None, lambda: list(_orphan_files(orphan_cutoff)))
+    swept = 0
+    for sha256 in orphans:
+        async with Database.atomic() as conn:
+            await _lock(conn, sha256)
+            known = await conn.fetchval(f"SELECT 1 FROM {BLOBS_TABLE} WHERE sha256 = $1", sha256)
+            if not known and await loop.run_in_executor(None, _unlink_if_unlinked, blob_path(sha256)):
+                swept += 1
+
+    return {"removed": removed, "hard_linked": linked, "orphans_removed": swept}
+
+
+async def _blob_gc_loop():
+    while True:
+        await asyncio.sleep(BLOB_GC_INTERVAL)
+        try:
+            result = await collect_garbage()
+            if any(result.values()):
+                logger.info(f"Blob garbage collection: {result}")
+        except Exception as e:
+            logger.error(f"Blob garbage collection failed: {str(e)}")
+
+
+def start_blob_gc():
+    """Start the periodic garbage collection task on the running loop"""
+    global _gc_task
+    if _gc_task is None:
+        _gc_task = asyncio.get_event_loop().create_task(_blob_gc_loop())
+
+
+def stop_blob_gc():
+    global _gc_task
+    if _gc_task is not None:
+        _gc_task.cancel()
+        _gc_task = None
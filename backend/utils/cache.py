@@ -0,0 +1,413 @@
+"""
+Two-tier response cache for read endpoints.
+
+L1 is a per-process LRU held by each CacheRegion. L2 is an optional shared
+CacheBackend consulted on an L1 miss. Entries hold the enveloped response
+bytes, so a hit is served without touching the handler or re-serializing.
+
+Entries are dropped by tag through the invalidation bus. A tag is either an
+entity ("course:ab12cd34") or a whole kind ("course"). publish("course", h)
+drops entries tagged "course:h" or "course"; publish("course") drops every
+course tag.
+"""
+from sanic.response import HTTPResponse, JSONResponse
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+from database import logger
+from utils.http_cache import strong_etag, bytes_response, wrap_envelope
+from utils.invalidation import INVALIDATION_KINDS, on_invalidate
+import asyncio
+import json as json_lib
+import os
+import time
+
+
+class CacheEntry:
+    __slots__ = ("body", "etag", "headers", "tags", "stored_at")
+
+    def __init__(self, body: bytes, headers: Dict[str, str], tags: Tuple[str, ...], stored_at: float = None):
+        self.body = body
+        self.headers = headers
+        self.tags = tags
+        self.etag = headers.get("ETag") or strong_etag(body)
+        self.stored_at = time.time() if stored_at is None else stored_at
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+    def encode(self) -> bytes:
+        """Serialize for an L2 backend: one JSON header line, then the body"""
+        header = json_lib.dumps({
+            "headers": self.headers,
+            "tags": list(self.tags),
+            "stored_at": self.stored_at
+        }, separators=(",", ":"))
+        return header.encode("utf-8") + b"\n" + self.body
+
+    @classmethod
+    def decode(cls, raw: bytes) -> "CacheEntry":
+        header, body = raw.split(b"\n", 1)
+        meta = json_lib.loads(header)
+        return cls(body, meta["headers"], tuple(meta["tags"]), meta["stored_at"])
+
+
+class CacheBackend(ABC):
+    """Interface for a shared L2 store (Redis, memcached, ...) behind the L1 LRUs"""
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        ...
+
+    @abstractmethod
+    async def delete(self, *keys: str) -> None:
+        ...
+
+
+class LocalBackend(CacheBackend):
+    """In-process stand-in for a shared L2 backend, for tests and single-node setups"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[float, bytes]] = {}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.time():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self._data[key] = (time.time() + ttl, value)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self._data.pop(key, None)
+
+
+_l2_backend: Optional[CacheBackend] = None
+_regions: Dict[str, "CacheRegion"] = {}
+# Process start; L2 entries written before it may predate invalidations this
+# worker never received
+_started_at = time.time()
+
+
+def set_l2_backend(backend: Optional[CacheBackend]) -> None:
+    """Install the shared L2 backend used by every region (None disables L2)"""
+    global _l2_backend
+    _l2_backend = backend
+
+
+class CacheRegion:
+    """
+    A named L1 LRU with its own TTL and size bounds.
+
+    ttl: seconds an entry is served as fresh.
+    stale_ttl: further seconds a stale entry is still served while one
+        background request refreshes it (stale-while-revalidate).
+    max_entries / max_bytes: LRU bounds; the least recently used entries
+        are evicted first.
+    """
+
+    def __init__(self, name: str, ttl: float, stale_ttl: float = 0,
+                 max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._bytes = 0
+        self._tags: Dict[str, set] = {}
+        self._tag_invalidated_at: Dict[str, float] = {}
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._refreshing: set = set()
+        # Bumped on every invalidation; loads that straddle one are not stored
+        self._generation = 0
+        self.metrics = {
+            "hits": 0, "stale_hits": 0, "l2_hits": 0, "misses": 0,
+            "coalesced": 0, "evictions": 0, "invalidations": 0
+        }
+
+    def _l2_key(self, key: str) -> str:
+        return f"{self.name}:{key}"
+
+    def _remove(self, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry.size
+            for tag in entry.tags:
+                keys = self._tags.get(tag)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self._tags[tag]
+        return entry
+
+    def _store(self, key: str, entry: CacheEntry) -> None:
+        if entry.size > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = entry
+        self._bytes += entry.size
+        for tag in entry.tags:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.metrics["evictions"] += 1
+
+    def _invalidated_since(self, entry: CacheEntry) -> bool:
+        """Whether this worker saw an invalidation of entry's tags after it was stored"""
+        if entry.stored_at < _started_at:
+            return True
+        for tag in entry.tags:
+            kind = tag.split(":", 1)[0]
+            invalidated_at = max(
+                self._tag_invalidated_at.get(tag, 0),
+                self._tag_invalidated_at.get(kind + ":*", 0)
+            )
+            if invalidated_at > entry.stored_at:
+                return True
+        return False
+
+    async def _get_l2(self, key: str) -> Optional[CacheEntry]:
+        if _l2_backend is None:
+            return None
+        try:
+            raw = await _l2_backend.get(self._l2_key(key))
+            if raw is None:
+                return None
+            entry = CacheEntry.decode(raw)
+        except Exception as e:
+            logger.error(f"L2 cache read failed for {self.name}:{key}: {str(e)}")
+            return None
+        if self._invalidated_since(entry) or time.time() - entry.stored_at > self.ttl + self.stale_ttl:
+            return None
+        return entry
+
+    async def _set_l2(self, key: str, entry: CacheEntry) -> None:
+        if _l2_backend is None:
+            return
+        try:
+            await _l2_backend.set(self._l2_key(key), entry.encode(), self.ttl + self.stale_ttl)
+        except Exception as e:
+            logger.error(f"L2 cache write failed for {self.name}:{key}: {str(e)}")
+
+    async def get_or_load(self, key: str, loader: Callable[[], Any]) -> Tuple[Optional[CacheEntry], bool]:
+        """
+        Return (entry, loaded_here). loader() produces a CacheEntry, or None
+        when the result must not be cached (errors, 404s).
+        """
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is not None:
+            age = now - entry.stored_at
+            if age < self.ttl:
+                self._entries.move_to_end(key)
+                self.metrics["hits"] += 1
+                return entry, False
+            if age < self.ttl + self.stale_ttl:
+                self._entries.move_to_end(key)
+                self.metrics["stale_hits"] += 1
+                self._refresh_in_background(key, loader)
+                return entry, False
+            self._remove(key)
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.metrics["coalesced"] += 1
+            return await asyncio.shield(future), False
+
+        entry = await self._get_l2(key)
+        if entry is not None:
+            self.metrics["l2_hits"] += 1
+            self._store(key, entry)
+            return entry, False
+
+        self.metrics["misses"] += 1
+        return await self._load(key, loader), True
+
+    async def _load(self, key: str, loader: Callable[[], Any]) -> Optional[CacheEntry]:
+        future = asyncio.get_event_loop().create_future()
+        # Waiters see a failed load through their own await; don't warn if nobody was waiting
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            entry = await loader()
+            if entry is not None and generation == self._generation:
+                self._store(key, entry)
+                await self._set_l2(key, entry)
+            future.set_result(entry)
+            return entry
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def _refresh_in_background(self, key: str, loader: Callable[[], Any]) -> None:
+        if key in self._refreshing or key in self._inflight:
+            return
+        self._refreshing.add(key)
+
+        async def refresh():
+            try:
+                await self._load(key, loader)
+            except Exception as e:
+                logger.error(f"Background refresh of {self.name}:{key} failed: {str(e)}")
+            finally:
+                self._refreshing.discard(key)
+
+        asyncio.ensure_future(refresh())
+
+    def invalidate_tags(self, kind: str, key: Optional[str]) -> None:
+        if key is None:
+            tags = [tag for tag in self._tags if tag == kind or tag.startswith(kind + ":")]
+            tags.append(kind)
+        else:
+            tags = [kind, f"{kind}:{key}"]
+
+        now = time.time()
+        keys = set()
+        for tag in tags:
+            self._tag_invalidated_at[tag] = now
+            keys |= self._tags.get(tag, set())
+        # A kind-wide invalidation also covers every entity tag of that kind
+        if key is None:
+            self._tag_invalidated_at[kind + ":*"] = now
+
+        self._generation += 1
+        for cache_key in keys:
+            self._remove(cache_key)
+        self.metrics["invalidations"] += len(keys)
+
+        if keys and _l2_backend is not None:
+            asyncio.ensure_future(self._delete_l2([self._l2_key(k) for k in keys]))
+
+    async def _delete_l2(self, keys: List[str]) -> None:
+        try:
+            await _l2_backend.delete(*keys)
+        except Exception as e:
+            logger.error(f"L2 cache delete failed for {self.name}: {str(e)}")
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._tags.clear()
+        self._bytes = 0
+        self._generation += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = sum(self.metrics[name] for name in ("hits", "stale_hits", "l2_hits", "coalesced", "misses"))
+        served = lookups - self.metrics["misses"]
+        return {
+            **self.metrics,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hit_ratio": round(served / lookups, 4) if lookups else None,
+            "ttl": self.ttl,
+            "stale_ttl": self.stale_ttl,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes
+        }
+
+
+def cache_region(name: str, ttl: float, stale_ttl: float = 0,
+                 max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024) -> CacheRegion:
+    """
+    Create (or return) the named region. CACHE_<NAME>_TTL and
+    CACHE_<NAME>_STALE_TTL override the defaults given here.
+    """
+    if name not in _regions:
+        env = f"CACHE_{name.upper()}"
+        _regions[name] = CacheRegion(
+            name,
+            ttl=float(os.getenv(f"{env}_TTL", ttl)),
+            stale_ttl=float(os.getenv(f"{env}_STALE_TTL", stale_ttl)),
+            max_entries=max_entries,
+            max_bytes=max_bytes
+        )
+    return _regions[name]
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: region.stats() for name, region in _regions.items()}
+
+
+def _invalidate_all_regions(kind: str):
+    def handler(key: Optional[str]) -> None:
+        for region in _regions.values():
+            region.invalidate_tags(kind, key)
+    return handler
+
+
+for _kind in INVALIDATION_KINDS:
+    on_invalidate(_kind, _invalidate_all_regions(_kind))
+
+
+def _respond(request, entry: CacheEntry) -> HTTPResponse:
+    if "ETag" in entry.headers:
+        # The handler chose its own ETag (e.g. a version for If-Match); it does
+        # not identify these bytes, so it can't answer a conditional GET
+        return HTTPResponse(entry.body, headers=entry.headers, content_type="application/json")
+    return bytes_response(request, entry.body, etag=entry.etag)
+
+
+def cached(region: CacheRegion, key: Union[str, Callable[..., str]],
+           tags: Iterable[str] = ()):
+    """
+    Cache a GET handler's successful JSON responses in region.
+
+    key and tags are format strings over the handler's path parameters
+    (e.g. "{course_hash}", "course:{course_hash}"); key may also be a
+    callable taking (request, **kwargs). Only 200 JSONResponses are cached;
+    anything else is passed through untouched.
+    """
+    tags = tuple(tags)
+
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(request, *args, **kwargs):
+            if request.method != "GET":
+                return await handler(request, *args, **kwargs)
+
+            cache_key = key(request, **kwargs) if callable(key) else key.format(**kwargs)
+            entry_tags = tuple(tag.format(**kwargs) for tag in tags)
+            own_response = {}
+
+            async def load():
+                response = await handler(request, *args, **kwargs)
+                own_response["response"] = response
+                if not isinstance(response, JSONResponse) or response.status != 200:
+                    return None
+                headers = {
+                    name: value for name, value in response.headers.items()
+                    if name.lower() not in ("content-type", "content-length")
+                }
+                return CacheEntry(wrap_envelope(response.body), headers, entry_tags)
+
+            entry, loaded_here = await region.get_or_load(cache_key, load)
+            if entry is None:
+                if loaded_here:
+                    return own_response["response"]
+                # Coalesced onto a load that wasn't cacheable; answer this request directly
+                return await handler(request, *args, **kwargs)
+            return _respond(request, entry)
+
+        return wrapper
+
+    return decorator
+
+
+if os.getenv("CACHE_L2_BACKEND", "").lower() == "local":
+    set_l2_backend(LocalBackend())
@@ -0,0 +1,127 @@
+"""
+Content-Encoding negotiation for dynamic responses.
+
+gzip is always available; brotli is used when the optional `brotli` package
+is installed and the client prefers it. Bodies under COMPRESS_MIN_SIZE are
+sent as-is since the framing overhead outweighs the saving.
+"""
+from sanic.response import HTTPResponse
+from typing import Optional
+import asyncio
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+# Dynamic responses favour speed over ratio
+GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', 6))
+BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', 5))
+# Bigger bodies are compressed in a worker thread so the event loop keeps serving
+COMPRESS_THREAD_SIZE = 256 * 1024
+
+COMPRESSIBLE_TYPES = (
+    "application/json", "application/x-ndjson", "application/javascript",
+    "application/xml", "image/svg+xml", "text/"
+)
+
+
+def _parse_accept_encoding(header: str) -> dict:
+    """{coding: q} from an Accept-Encoding header"""
+    codings = {}
+    for part in header.split(","):
+        fields = part.strip().split(";")
+        coding = fields[0].strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in fields[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding] = q
+    return codings
+
+
+def negotiate_encoding(request, available=("br", "gzip")) -> Optional[str]:
+    """Best coding in available the client accepts, or None for identity"""
+    header = request.headers.get("Accept-Encoding")
+    if not header:
+        return None
+    codings = _parse_accept_encoding(header)
+    wildcard = codings.get("*", 0.0)
+    best, best_q = None, 0.0
+    for coding in available:
+        if coding == "br" and brotli is None:
+            continue
+        q = codings.get(coding, wildcard)
+        if q > best_q:
+            best, best_q = coding, q
+    return best
+
+
+def compress_bytes(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def encoded_etag(etag: str, encoding: str) -> str:
+    """
+    ETag for the encoded representation. A strong ETag must differ between
+    codings; etag_matches strips the suffix again when comparing.
+    """
+    if etag.endswith('"'):
+        return f'{etag[:-1]}-{encoding}"'
+    return etag
+
+
+def _compressible(response: HTTPResponse) -> bool:
+    if response.status < 200 or response.status in (204, 206, 304):
+        return False
+    if "content-encoding" in response.headers:
+        return False
+    # Streamed responses (file_stream, NDJSON) have no body to encode here
+    body = getattr(response, "body", None)
+    if not body or len(body) < COMPRESS_MIN_SIZE:
+        return False
+    content_type = (response.content_type or "").lower()
+    return content_type.startswith(COMPRESSIBLE_TYPES)
+
+
+async def compress_response(request, response: HTTPResponse) -> HTTPResponse:
+    """Encode response's body in place when the client and content allow it"""
+    if request.method == "HEAD" or not _compressible(response):
+        return response
+
+    vary = response.headers.get("Vary")
+    if not vary:
+        response.headers["Vary"] = "Accept-Encoding"
+    elif "accept-encoding" not in vary.lower():
+        response.headers["Vary"] = f"{vary}, Accept-Encoding"
+
+    encoding = negotiate_encoding(request)
+    if encoding is None:
+        return response
+
+    body = response.body
+    if len(body) >= COMPRESS_THREAD_SIZE:
+        loop = asyncio.get_event_loop()
+        encoded = await loop.run_in_executor(None, compress_bytes, body, encoding)
+    else:
+        encoded = compress_bytes(body, encoding)
+    if len(encoded) >= len(body):
+        return response
+
+    response.body = encoded
+    response.headers["Content-Encoding"] = encoding
+    etag = response.headers.get("ETag")
+    if etag:
+        response.headers["ETag"] = encoded_etag(etag, encoding)
+    return response
@@ -0,0 +1,98 @@
+from sanic.response import HTTPResponse
+import hashlib
+import json as json_lib
+from typing import Any, Optional
+
+
+def envelope_bytes(data: Any, status: int = 200, message: Optional[str] = None) -> bytes:
+    """
+    Serialize data wrapped in the same envelope that app.custom_json_response
+    applies to JSONResponse objects, so pre-serialized bodies look identical
+    to regular handler output.
+    """
+    return json_lib.dumps(
+        {
+            "status": "success" if status < 400 else "error",
+            "data": data,
+            "message": message,
+            "code": status
+        },
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str
+    ).encode("utf-8")
+
+
+def wrap_envelope(body: bytes, status: int = 200) -> bytes:
+    """
+    Envelope an already-serialized JSON body by splicing bytes, without
+    parsing and re-serializing the payload.
+    """
+    state = b"success" if status < 400 else b"error"
+    return (
+        b'{"status":"' + state + b'","data":' + body +
+        b',"message":null,"code":' + str(status).encode() + b'}'
+    )
+
+
+def strong_etag(body: bytes) -> str:
+    """Strong ETag derived from the exact response bytes."""
+    return '"' + hashlib.sha1(body).hexdigest() + '"'
+
+
+def _normalize_etag(tag: str) -> str:
+    if tag.startswith("W/"):
+        tag = tag[2:]
+    for suffix in ('-gzip"', '-br"'):
+        if tag.endswith(suffix):
+            return tag[:-len(suffix)] + '"'
+    return tag
+
+
+def etag_matches(request, etag: str) -> bool:
+    """Check the request's If-None-Match header against etag."""
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses weak comparison, and a tag the client got for a
+    # compressed representation names the same content
+    bare = _normalize_etag(etag)
+    return any(_normalize_etag(tag.strip()) == bare for tag in header.split(","))
+
+
+def version_etag(version) -> str:
+    """ETag for a row-level version counter."""
+    return f'"{version}"'
+
+
+def if_match_version(request) -> Optional[str]:
+    """Return the version named by If-Match, or None when the header is absent."""
+    header = request.headers.get("If-Match")
+    if not header or header.strip() == "*":
+        return None
+    return _normalize_etag(header.split(",")[0].strip()).strip('"')
+
+
+def bytes_response(
+    request,
+    body: bytes,
+    etag: Optional[str] = None,
+    cache_control: str = "no-cache",
+    status: int = 200,
+    content_type: str = "application/json"
+) -> HTTPResponse:
+    """
+    Return pre-serialized bytes, answering 304 when the client already holds
+    the current representation.
+    """
+    etag = etag or strong_etag(body)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": cache_control,
+        "Access-Control-Allow-Origin": "*"
+    }
+    if etag_matches(request, etag):
+        return HTTPResponse(status=304, headers=headers)
+    return HTTPResponse(body, status=status, headers=headers, content_type=content_type)
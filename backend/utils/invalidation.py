@@ -0,0 +1,91 @@
+from database import Database, logger
+from typing import Any, Callable, Dict, List, Optional
+import inspect
+import json as json_lib
+import uuid
+
+# Every worker LISTENs on this channel through Database's dedicated listener
+# connection. Messages are JSON: {"kind": ..., "key": ..., "origin": ...}
+CACHE_INVALIDATION_CHANNEL = "cache_invalidation"
+
+# Entity kinds a write handler can invalidate. A None key means "all of them".
+INVALIDATION_KINDS = ("course", "lesson", "user", "lesson_type", "page", "resource", "user_folder")
+
+# Identifies this worker so it can ignore its own NOTIFYs; local handlers have
+# already run by the time the message comes back.
+_instance_id = uuid.uuid4().hex
+_handlers: Dict[str, List[Callable[[Optional[str]], Any]]] = {kind: [] for kind in INVALIDATION_KINDS}
+_listening = False
+
+
+def on_invalidate(kind: str, handler: Callable[[Optional[str]], Any] = None):
+    """
+    Register handler(key) for invalidations of kind. Handlers may be plain
+    functions or coroutines. Usable directly or as a decorator.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"Unknown invalidation kind: {kind}")
+
+    def register(func):
+        _handlers[kind].append(func)
+        return func
+
+    return register(handler) if handler is not None else register
+
+
+async def _dispatch(kind: str, key: Optional[str]) -> None:
+    for handler in _handlers.get(kind, []):
+        try:
+            result = handler(key)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            logger.error(f"Invalidation handler for {kind}:{key} failed: {str(e)}")
+
+
+async def publish(kind: str, key: Optional[str] = None, local: bool = True) -> None:
+    """
+    Invalidate kind/key in this worker, then broadcast it to the others.
+    local=False only broadcasts, for writers that already brought this
+    worker's state up to date themselves.
+
+    Called after a write has succeeded, so failures are logged rather than
+    raised: the write must not be reported as failed because a NOTIFY was lost.
+    """
+    if kind not in _handlers:
+        raise ValueError(f"Unknown invalidation kind: {kind}")
+
+    if local:
+        await _dispatch(kind, key)
+
+    payload = json_lib.dumps({"kind": kind, "key": key, "origin": _instance_id})
+    try:
+        await Database.notify(CACHE_INVALIDATION_CHANNEL, payload)
+    except Exception as e:
+        logger.error(f"Failed to publish invalidation {kind}:{key}: {str(e)}")
+
+
+async def _on_message(payload: str) -> None:
+    try:
+        message = json_lib.loads(payload)
+    except ValueError:
+        logger.error(f"Ignoring malformed invalidation message: {payload}")
+        return
+    if message.get("origin") == _instance_id:
+        return
+    await _dispatch(message.get("kind"), message.get("key"))
+
+
+async def _on_reconnect() -> None:
+    # Whatever was published while the listener was down never arrived
+    for kind in INVALIDATION_KINDS:
+        await _dispatch(kind, None)
+
+
+async def start_invalidation_listener() -> None:
+    """Subscribe this worker to invalidations published by other workers"""
+    global _listening
+    if not _listening:
+        await Database.listen(CACHE_INVALIDATION_CHANNEL, _on_message)
+        Database.on_reconnect(_on_reconnect)
+        _listening = True
@@ -0,0 +1,264 @@
+"""
+Audio clips cut from lesson media with ffmpeg and cached on disk.
+
+A clip is identified by its source file (path and mtime), the [start, end)
+range in seconds and the output format, so replacing a lesson's media
+invalidates its clips without any bookkeeping. At most CLIP_WORKERS ffmpeg
+processes run at once, and concurrent requests for the same clip share one
+run. The cache directory is bounded by CLIP_CACHE_MAX_BYTES, evicting the
+least recently served clips first.
+"""
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from database import logger
+from utils.static_files import resolve_path
+from typing import AsyncIterator, Dict, Iterable, Optional, Tuple
+import asyncio
+import hashlib
+import mimetypes
+import os
+import tempfile
+
+CLIP_CACHE_PATH = os.getenv('CLIP_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'bamboo_clips'))
+CLIP_CACHE_MAX_BYTES = int(os.getenv('CLIP_CACHE_MAX_BYTES', 1024 * 1024 * 1024))
+CLIP_WORKERS = int(os.getenv('CLIP_WORKERS', os.cpu_count() or 2))
+CLIP_MAX_SECONDS = float(os.getenv('CLIP_MAX_SECONDS', 120))
+CLIP_TIMEOUT_SECONDS = 60
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+
+# Dubbing lessons keep their source track next to index.json
+DUBBING_SOURCE = "index.mp4"
+
+# Low bitrates on purpose: clips are speech, mostly fetched over mobile networks
+CLIP_FORMATS = {
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "64k"],
+    "m4a": ["-c:a", "aac", "-b:a", "64k", "-f", "ipod"],
+    "ogg": ["-c:a", "libopus", "-b:a", "32k"],
+}
+DEFAULT_CLIP_FORMAT = "mp3"
+
+mimetypes.add_type("audio/mp4", ".m4a")
+mimetypes.add_type("audio/ogg", ".ogg")
+
+
+class ClipError(Exception):
+    """ffmpeg could not produce the clip"""
+
+
+def lesson_source_path(file_path: str, source: Optional[str] = None) -> str:
+    """Media file of a synced lesson; NotFound if it does not exist"""
+    base = os.getenv('BASE_COURSE_DATA_PATH', 'data/course')
+    return resolve_path(os.path.join(base, file_path), source or DUBBING_SOURCE)
+
+
+def normalize_range(start, end) -> Tuple[float, float]:
+    """[start, end) rounded to milliseconds; ValueError if unusable"""
+    try:
+        start, end = round(float(start), 3), round(float(end), 3)
+    except (TypeError, ValueError):
+        raise ValueError("start and end must be numbers of seconds")
+    if start < 0 or end <= start:
+        raise ValueError("Clip range must satisfy 0 <= start < end")
+    if end - start > CLIP_MAX_SECONDS:
+        raise ValueError(f"Clips are limited to {CLIP_MAX_SECONDS:g} seconds")
+    return start, end
+
+
+def clip_key(source: str, start: float, end: float, fmt: str) -> str:
+    mtime_ns = os.stat(source).st_mtime_ns
+    return hashlib.sha1(f"{source}|{mtime_ns}|{start:.3f}|{end:.3f}|{fmt}".encode()).hexdigest()
+
+
+async def _run_ffmpeg(source: str, start: float, end: float, fmt: str, target: str) -> None:
+    args = [
+        FFMPEG_BINARY, "-nostdin", "-hide_banner", "-loglevel", "error",
+        # -ss before -i seeks by index instead of decoding from the start
+        "-ss", f"{start:.3f}", "-i", source, "-t", f"{end - start:.3f}",
+        "-vn", "-map_metadata", "-1", *CLIP_FORMATS[fmt], "-y", target
+    ]
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(), CLIP_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise ClipError(f"ffmpeg timed out after {CLIP_TIMEOUT_SECONDS}s")
+    if process.returncode != 0:
+        raise ClipError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()[-500:]}")
+
+
+class ClipCache:
+    """
+    Clips on disk under root/<key[:2]>/<key>.<format>. Each worker keeps its
+    own recency index, seeded from file mtimes (bumped on every hit), so
+    eviction order survives restarts. A clip evicted by another worker is
+    simply cut again. Clips being served are pinned and never evicted by
+    this worker.
+    """
+
+    def __init__(self, root: str, max_bytes: int, workers: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._slots = asyncio.Semaphore(workers)
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._scanned = False
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._pins: Dict[str, int] = {}
+
+    def relative_path(self, key: str, fmt: str) -> str:
+        return os.path.join(key[:2], f"{key}.{fmt}")
+
+    def _scan(self):
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.startswith('.'):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, os.path.relpath(path, self.root), stat.st_size))
+        return sorted(found)
+
+    async def _ensure_scanned(self) -> None:
+        if self._scanned:
+            return
+        self._scanned = True
+        loop = asyncio.get_event_loop()
+        for _, relative, size in await loop.run_in_executor(None, self._scan):
+            self._add(relative, size)
+
+    def _add(self, relative: str, size: int) -> None:
+        previous = self._entries.pop(relative, 0)
+        self._entries[relative] = size
+        self._total_bytes += size - previous
+        if self._total_bytes <= self.max_bytes:
+            return
+        # Least recently served first, keeping the clip just added and any in use
+        for evicted in list(self._entries):
+            if self._total_bytes <= self.max_bytes:
+                break
+            if evicted == relative or self._pins.get(evicted):
+                continue
+            self._total_bytes -= self._entries.pop(evicted)
+            try:
+                os.unlink(os.path.join(self.root, evicted))
+            except FileNotFoundError:
+                pass
+
+    def _pin(self, relative: str) -> None:
+        self._pins[relative] = self._pins.get(relative, 0) + 1
+
+    def _unpin(self, relative: str) -> None:
+        count = self._pins.pop(relative, 0) - 1
+        if count > 0:
+            self._pins[relative] = count
+
+    def _hit(self, relative: str) -> bool:
+        path = os.path.join(self.root, relative)
+        try:
+            os.utime(path)
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            if relative in self._entries:
+                self._total_bytes -= self._entries.pop(relative)
+            return False
+        self._add(relative, size)
+        return True
+
+    async def _cut(self, source: str, start: float, end: float, fmt: str, relative: str) -> None:
+        target = os.path.join(self.root, relative)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".clip-", suffix=f".{fmt}")
+        os.close(fd)
+        try:
+            async with self._slots:
+                await _run_ffmpeg(source, start, end, fmt, tmp_path)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, target)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._add(relative, os.path.getsize(target))
+
+    async def get(self, source: str, start, end, fmt: str = DEFAULT_CLIP_FORMAT,
+                  pin: bool = False) -> str:
+        """
+        Path, relative to root, of the clip [start, end) of source, cutting it
+        if needed. ValueError for a bad range or format, ClipError if ffmpeg fails.
+        pin=True keeps the clip from eviction until _unpin; see pinned().
+        """
+        if fmt not in CLIP_FORMATS:
+            raise ValueError(f"Unsupported clip format. Must be one of: {', '.join(CLIP_FORMATS)}")
+        start, end = normalize_range(start, end)
+        await self._ensure_scanned()
+
+        relative = self.relative_path(clip_key(source, start, end, fmt), fmt)
+        if pin:
+            # Before any await, so a cut finishing elsewhere can't evict it first
+            self._pin(relative)
+        try:
+            if self._hit(relative):
+                return relative
+
+            pending = self._pending.get(relative)
+            if pending is None:
+                pending = asyncio.ensure_future(self._cut(source, start, end, fmt, relative))
+                self._pending[relative] = pending
+                pending.add_done_callback(lambda _: self._pending.pop(relative, None))
+            # Shielded so one client disconnecting does not cancel the others' clip
+            await asyncio.shield(pending)
+            return relative
+        except BaseException:
+            if pin:
+                self._unpin(relative)
+            raise
+
+    @asynccontextmanager
+    async def pinned(self, source: str, start, end, fmt: str = DEFAULT_CLIP_FORMAT
+                     ) -> AsyncIterator[str]:
+        """get() whose clip stays on disk until the block exits"""
+        relative = await self.get(source, start, end, fmt, pin=True)
+        try:
+            yield relative
+        finally:
+            self._unpin(relative)
+
+
+clip_cache = ClipCache(CLIP_CACHE_PATH, CLIP_CACHE_MAX_BYTES, CLIP_WORKERS)
+
+
+def dubbing_segments(lesson_content: dict) -> Iterable[Tuple[float, float]]:
+    """(start, end) of each sentence in a dubbing lesson's index.json"""
+    for sentence in (lesson_content or {}).get('sentences') or []:
+        try:
+            yield normalize_range(sentence['start'], sentence['end'])
+        except (KeyError, TypeError, ValueError):
+            continue
+
+
+async def prewarm_clips(lessons: Iterable[Tuple[str, dict]], fmt: str = DEFAULT_CLIP_FORMAT) -> None:
+    """
+    Cut every sentence clip of the given (file_path, lesson_content) dubbing
+    lessons. Runs in the background after a sync; failures are logged.
+    """
+    for file_path, lesson_content in lessons:
+        try:
+            source = lesson_source_path(file_path)
+        except Exception:
+            continue
+        segments = list(dubbing_segments(lesson_content))
+        # One lesson at a time; its segments share the CLIP_WORKERS slots
+        results = await asyncio.gather(
+            *(clip_cache.get(source, start, end, fmt) for start, end in segments),
+            return_exceptions=True
+        )
+        for (start, end), result in zip(segments, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to prewarm clip {file_path} [{start}, {end}): {str(result)}")
@@ -0,0 +1,112 @@
+"""
+Ownership-checked writes in a single statement.
+
+Instead of reading a row's owner and then writing it (two round trips, and
+the owner can change in between), the ownership predicate goes into the
+UPDATE/DELETE itself and the same statement reports, from the row as it was
+before the write, whether it existed and whether the user may change it:
+
+    result = await owned_write(
+        conn, "lessons", lesson_hash, request.ctx.user,
+        "UPDATE lessons SET title = $1 WHERE hash = $2 AND {owner} RETURNING hash",
+        [title, lesson_hash]
+    )
+    if not result.written:
+        return write_error(result, "lesson")
+
+Admins may write any row; everyone else only rows whose owner column holds
+their hash.
+"""
+from sanic import json
+from functools import wraps
+from typing import Any, Dict, List, Optional, Sequence
+
+
+class OwnedWrite:
+    """Outcome of owned_write"""
+
+    def __init__(self, found: bool, allowed: bool, row: Optional[Dict[str, Any]],
+                 current: Dict[str, Any]):
+        self.found = found
+        self.allowed = allowed
+        # Columns of the write's RETURNING clause, None if nothing was written
+        self.row = row
+        # current_columns of the row as it was before the write
+        self.current = current
+
+    @property
+    def written(self) -> bool:
+        return self.row is not None
+
+
+def owner_predicate(user: Dict[str, Any], owner_column: str, params: List[Any]) -> str:
+    """SQL limiting a write to rows user may change; appends its parameter to params"""
+    if user['role'] == 'admin':
+        return "TRUE"
+    params.append(user['hash'])
+    return f"{owner_column} = ${len(params)}"
+
+
+async def owned_write(executor, table: str, key: Any, user: Dict[str, Any], write: str,
+                      params: Sequence[Any], key_column: str = "hash",
+                      owner_column: str = "created_by",
+                      current_columns: Sequence[str] = ()) -> OwnedWrite:
+    """
+    Run write, an UPDATE or DELETE on table with a RETURNING clause whose
+    WHERE includes {owner}, in one round trip. executor is Database or a
+    transaction's connection; params are write's own parameters.
+    """
+    params = list(params)
+    owner = owner_predicate(user, owner_column, params)
+    params.append(key)
+    key_param = f"${len(params)}"
+    allowed = "TRUE" if owner == "TRUE" else f"target.{owner}"
+    current = "".join(f", target.{column} AS current__{column}" for column in current_columns)
+
+    # All parts of the statement see the same snapshot, so target is the
+    # row as it was before the write
+    query = f"""
+        WITH written AS (
+            {write.replace("{owner}", owner)}
+        )
+        SELECT target.{key_column} IS NOT NULL AS found__,
+               COALESCE({allowed}, FALSE) AS allowed__,
+               EXISTS (SELECT 1 FROM written) AS written__
+               {current},
+               written.*
+        FROM (SELECT 1) AS one
+        LEFT JOIN {table} target ON target.{key_column} = {key_param}
+        LEFT JOIN written ON TRUE
+    """
+    record = dict(await executor.fetchrow(query, *params))
+
+    found = record.pop('found__')
+    allowed_write = record.pop('allowed__')
+    written = record.pop('written__')
+    current_values = {column: record.pop(f"current__{column}") for column in current_columns}
+    return OwnedWrite(found, found and allowed_write, record if written else None, current_values)
+
+
+def write_error(result: OwnedWrite, noun: str):
+    """
+    404 or 403 JSON response for a write that did not happen. A row that was
+    there and allowed but not written was changed or deleted by a concurrent
+    write after the snapshot; that is a 409. Callers whose write has further
+    conditions (a version, a second key) check found and allowed themselves.
+    """
+    if not result.found:
+        return json({"error": f"{noun.capitalize()} not found"}, status=404)
+    if not result.allowed:
+        return json({"error": f"You don't have permission to modify this {noun}"}, status=403)
+    return json({"error": f"The {noun} was changed by someone else, try again"}, status=409)
+
+
+def authenticated(func):
+    """Reject requests without a user; ownership is left to owned_write"""
+    @wraps(func)
+    async def wrapper(request, *args, **kwargs):
+        if not getattr(request.ctx, 'user', None):
+            return json({"error": "Authentication required"}, status=401)
+        return await func(request, *args, **kwargs)
+
+    return wrapper
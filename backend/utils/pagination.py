@@ -0,0 +1,179 @@
+"""
+Keyset pagination, column projection and NDJSON streaming for list endpoints.
+
+A page is requested with ?limit=&cursor=&fields=a,b,c and answered with
+{"items": [...], "next_cursor": ...}. ?format=ndjson streams every matching
+row instead, one JSON object per line, through a server-side cursor.
+"""
+from database import Database
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+import base64
+import json as json_lib
+
+DEFAULT_PAGE_LIMIT = 50
+MAX_PAGE_LIMIT = 200
+# Rows fetched per round trip by the server-side cursor when streaming
+STREAM_PREFETCH = 500
+# Lines are buffered up to this many bytes before each write to the socket
+STREAM_CHUNK_BYTES = 64 * 1024
+# JSON type a cursor must hold for each key type
+CURSOR_VALUE_TYPES = {"int": int, "text": str, "timestamp": str}
+INT4_RANGE = (-2 ** 31, 2 ** 31 - 1)
+
+
+def encode_cursor(values) -> str:
+    return base64.urlsafe_b64encode(json_lib.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    """Values an encode_cursor string holds; ValueError if it is malformed"""
+    return json_lib.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+
+
+def page_limit(request, default: int = DEFAULT_PAGE_LIMIT, maximum: int = MAX_PAGE_LIMIT) -> int:
+    """?limit= clamped to [1, maximum]; ValueError if not an integer"""
+    return min(max(1, int(request.args.get('limit', default))), maximum)
+
+
+def select_fields(request, allowed: Sequence[str], default: Sequence[str]) -> List[str]:
+    """Columns named by ?fields=a,b,c, checked against allowed"""
+    fields = request.args.get('fields')
+    if not fields:
+        return list(default)
+    selected = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = [field for field in selected if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(allowed)}")
+    return selected
+
+
+def wants_stream(request) -> bool:
+    return request.args.get('format') == 'ndjson'
+
+
+class KeysetQuery:
+    """
+    SELECT fields FROM table WHERE conditions, ordered by keys descending.
+
+    keys are (column, type) pairs forming a unique sort key, e.g.
+    [("created_at", "timestamp"), ("hash", "text")]. Key columns are always
+    selected so the next cursor can be built, and dropped from the output
+    when they were not asked for.
+    """
+
+    def __init__(self, table: str, fields: Sequence[str], keys: Sequence[Tuple[str, str]],
+                 conditions: Sequence[str] = (), params: Sequence[Any] = ()):
+        self.table = table
+        self.fields = list(fields)
+        self.keys = list(keys)
+        self.conditions = list(conditions)
+        self.params = list(params)
+
+    @property
+    def key_columns(self) -> List[str]:
+        return [column for column, _ in self.keys]
+
+    def _select_list(self) -> str:
+        columns = self.fields + [c for c in self.key_columns if c not in self.fields]
+        return ", ".join(columns)
+
+    def _order_by(self) -> str:
+        return ", ".join(f"{column} DESC" for column in self.key_columns)
+
+    @staticmethod
+    def _key_value(type_: str, value: Any) -> Any:
+        """value as a parameter for a key of type_; ValueError if it can't be one"""
+        if isinstance(value, bool) or not isinstance(value, CURSOR_VALUE_TYPES[type_]):
+            raise ValueError
+        if type_ == "int" and not INT4_RANGE[0] <= value <= INT4_RANGE[1]:
+            raise ValueError
+        return datetime.fromisoformat(value) if type_ == "timestamp" else value
+
+    def _cursor_values(self, cursor: str) -> List[Any]:
+        """
+        The key values a cursor continues after. Anything a client could have
+        tampered with is checked here, so a bad cursor is a ValueError (400)
+        rather than a database error (500).
+        """
+        try:
+            values = decode_cursor(cursor)
+            if not isinstance(values, list) or len(values) != len(self.keys):
+                raise ValueError
+            return [self._key_value(type_, value) for (_, type_), value in zip(self.keys, values)]
+        except (TypeError, ValueError):
+            raise ValueError("Invalid cursor")
+
+    def build(self, cursor: Optional[str] = None, limit: Optional[int] = None) -> Tuple[str, List[Any]]:
+        conditions = list(self.conditions)
+        params = list(self.params)
+        if cursor:
+            placeholders = []
+            for (column, type_), value in zip(self.keys, self._cursor_values(cursor)):
+                params.append(value)
+                placeholders.append(f"${len(params)}::{type_}")
+            conditions.append(f"({', '.join(self.key_columns)}) < ({', '.join(placeholders)})")
+
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        limit_clause = ""
+        if limit is not None:
+            params.append(limit + 1)
+            limit_clause = f"LIMIT ${len(params)}"
+
+        query = f"""
+            SELECT {self._select_list()}
+            FROM {self.table}
+            {where_clause}
+            ORDER BY {self._order_by()}
+            {limit_clause}
+        """
+        return query, params
+
+    def project(self, row) -> Dict[str, Any]:
+        return {field: row[field] for field in self.fields}
+
+    async def fetch_page(self, cursor: Optional[str], limit: int,
+                         serialize: Callable[[Dict[str, Any]], Dict[str, Any]]) -> Dict[str, Any]:
+        """One page of serialized rows plus the cursor for the next one"""
+        query, params = self.build(cursor, limit)
+        rows = await Database.fetch(query, *params)
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = encode_cursor([last[column] for column in self.key_columns])
+
+        return {
+            "items": [serialize(self.project(row)) for row in rows],
+            "next_cursor": next_cursor
+        }
+
+    async def stream(self, request, serialize: Callable[[Dict[str, Any]], Dict[str, Any]],
+                     cursor: Optional[str] = None):
+        """
+        Write every matching row as NDJSON. Rows come from a server-side
+        cursor STREAM_PREFETCH at a time, so memory stays flat however big
+        the table is.
+        """
+        query, params = self.build(cursor)
+        response = await request.respond(
+            content_type="application/x-ndjson",
+            headers={"Access-Control-Allow-Origin": "*"}
+        )
+
+        buffer = []
+        buffered = 0
+        async with Database.atomic() as conn:
+            async for row in conn.cursor(query, *params, prefetch=STREAM_PREFETCH):
+                line = json_lib.dumps(serialize(self.project(row)), ensure_ascii=False, default=str) + "\n"
+                buffer.append(line)
+                buffered += len(line)
+                if buffered >= STREAM_CHUNK_BYTES:
+                    await response.send("".join(buffer))
+                    buffer = []
+                    buffered = 0
+
+        if buffer:
+            await response.send("".join(buffer))
+        await response.eof()
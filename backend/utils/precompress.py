@@ -0,0 +1,129 @@
+"""
+Build step that writes .gz and .br siblings next to compressible static files,
+so utils.static_files can serve them without compressing per request.
+
+    python3 backend/utils/precompress.py frontend/dist /data/course
+
+Files are compressed at maximum effort since it is paid once. A sibling is
+only kept when it is smaller than the original, and is rewritten whenever
+the original is newer. Stdlib only (brotli optional) so it runs from the
+frontend build without the backend's environment.
+"""
+from typing import Dict, Iterable, Optional
+import gzip
+import os
+import sys
+import tempfile
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+PRECOMPRESS_EXTENSIONS = (
+    ".js", ".mjs", ".css", ".html", ".json", ".svg", ".txt", ".xml",
+    ".map", ".vtt", ".srt", ".webmanifest"
+)
+PRECOMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+
+# Sibling suffix per Content-Encoding, in order of preference when serving
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def _encode(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    # mtime=0 keeps the output byte-identical across builds
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def _is_fresh(path: str, source_mtime: float) -> bool:
+    try:
+        return os.stat(path).st_mtime >= source_mtime
+    except FileNotFoundError:
+        return False
+
+
+def _write_atomic(path: str, data: bytes, mode: int) -> None:
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".precompress-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp creates 0600; the server must be able to read what it could before
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def precompress_file(path: str, force: bool = False) -> Dict[str, str]:
+    """Refresh path's compressed siblings; returns {encoding: written|fresh|skipped}"""
+    result = {}
+    stat = os.stat(path)
+    data = None
+    for encoding, suffix in ENCODING_SUFFIXES.items():
+        target = path + suffix
+        if encoding == "br" and brotli is None:
+            continue
+        if not force and _is_fresh(target, stat.st_mtime):
+            result[encoding] = "fresh"
+            continue
+        if data is None:
+            with open(path, "rb") as f:
+                data = f.read()
+        encoded = _encode(data, encoding)
+        if len(encoded) >= len(data):
+            # Not worth serving; drop a stale sibling so it is not picked up
+            if os.path.exists(target):
+                os.unlink(target)
+            result[encoding] = "skipped"
+            continue
+        _write_atomic(target, encoded, stat.st_mode & 0o777)
+        result[encoding] = "written"
+    return result
+
+
+def _candidates(root: str) -> Iterable[str]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for filename in filenames:
+            if filename.startswith('.') or not filename.lower().endswith(PRECOMPRESS_EXTENSIONS):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                if os.path.getsize(path) >= PRECOMPRESS_MIN_SIZE:
+                    yield path
+            except OSError:
+                continue
+
+
+def precompress_tree(root: str, force: bool = False) -> Dict[str, int]:
+    """Precompress every eligible file under root; returns counts per outcome"""
+    counts = {"written": 0, "fresh": 0, "skipped": 0, "failed": 0}
+    for path in _candidates(root):
+        try:
+            for outcome in precompress_file(path, force).values():
+                counts[outcome] += 1
+        except OSError:
+            counts["failed"] += 1
+    return counts
+
+
+def main(argv: Optional[list] = None) -> int:
+    args = list(sys.argv[1:] if argv is None else argv)
+    force = "--force" in args
+    roots = [arg for arg in args if arg != "--force"]
+    if not roots:
+        print("usage: precompress.py [--force] DIR [DIR ...]", file=sys.stderr)
+        return 2
+    if brotli is None:
+        print("brotli not installed, writing .gz only", file=sys.stderr)
+    for root in roots:
+        counts = precompress_tree(root, force)
+        print(f"{root}: " + ", ".join(f"{k} {v}" for k, v in counts.items()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
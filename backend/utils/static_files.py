@@ -0,0 +1,157 @@
+"""
+File serving for the frontend bundle (/, /static) and course data (/data).
+
+Every response carries a strong ETag and Last-Modified so clients can
+revalidate with a 304, and the .br/.gz siblings written by
+utils/precompress.py are sent instead of the original when the client
+accepts them. Hashed bundle assets never change under the same name, so
+they are marked immutable; everything else must be revalidated.
+
+Single byte ranges (Range/If-Range) are answered with 206 so media players
+can seek without downloading the whole file.
+"""
+from sanic.exceptions import NotFound
+from sanic.handlers import ContentRangeHandler
+from sanic.response import HTTPResponse, file, file_stream
+from datetime import timezone
+from email.utils import formatdate, parsedate_to_datetime
+from utils.compression import encoded_etag, negotiate_encoding
+from utils.http_cache import etag_matches
+from utils.precompress import ENCODING_SUFFIXES
+from typing import Optional
+import mimetypes
+import os
+import re
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# vite names bundle files static/{js,css,assets}/[name].[hash].[ext] with an
+# 8 character hash (see frontend/vite.config.js); public/ files keep their names
+HASHED_ASSET = re.compile(r"(^|/)(js|css|assets)/[^/]+\.[A-Za-z0-9_-]{8}\.[A-Za-z0-9]+$")
+
+# Files (or requested ranges) at least this big are streamed rather than
+# read into memory, STREAM_CHUNK_SIZE bytes per read
+STREAM_FILE_SIZE = 1024 * 1024
+STREAM_CHUNK_SIZE = 256 * 1024
+
+
+def resolve_path(root: str, path: str) -> str:
+    """Absolute path of path under root; NotFound if it escapes root or is not a file"""
+    root = os.path.realpath(root)
+    location = os.path.realpath(os.path.join(root, path))
+    if not location.startswith(root + os.sep) or not os.path.isfile(location):
+        raise NotFound("File not found")
+    return location
+
+
+def file_etag(stat: os.stat_result) -> str:
+    """Strong ETag from size and mtime, which change whenever the file is rewritten"""
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def cache_control_for(path: str, hashed_immutable: bool) -> str:
+    if hashed_immutable and HASHED_ASSET.search(path):
+        return IMMUTABLE_CACHE_CONTROL
+    return REVALIDATE_CACHE_CONTROL
+
+
+def not_modified(request, etag: str, mtime: float) -> bool:
+    """
+    Whether the client's copy is current. If-None-Match takes precedence over
+    If-Modified-Since, as RFC 9110 requires.
+    """
+    if request.headers.get("If-None-Match"):
+        return etag_matches(request, etag)
+    since = request.headers.get("If-Modified-Since")
+    if not since:
+        return False
+    try:
+        since_date = parsedate_to_datetime(since)
+    except (TypeError, ValueError):
+        return False
+    if since_date.tzinfo is None:
+        since_date = since_date.replace(tzinfo=timezone.utc)
+    # Last-Modified has one-second resolution
+    return int(mtime) <= since_date.timestamp()
+
+
+def range_applies(request, etag: str, last_modified: str) -> bool:
+    """
+    Whether the Range header should be honoured. If-Range makes it
+    conditional on the client's copy still being current: an entity tag must
+    match strongly, a date must equal Last-Modified exactly. Otherwise the
+    whole file is sent.
+    """
+    if not request.headers.get("Range"):
+        return False
+    if_range = request.headers.get("If-Range")
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith(('"', 'W/')):
+        return if_range == etag
+    return if_range == last_modified
+
+
+def _precompressed_encodings(location: str, mtime: float) -> list:
+    """Encodings with a sibling at least as new as the original"""
+    available = []
+    for encoding, suffix in ENCODING_SUFFIXES.items():
+        try:
+            if os.stat(location + suffix).st_mtime >= mtime:
+                available.append(encoding)
+        except FileNotFoundError:
+            continue
+    return available
+
+
+async def send_file(request, root: str, path: str, hashed_immutable: bool = True,
+                    cache_control: Optional[str] = None):
+    """Serve root/path with validators, picking a precompressed sibling when accepted"""
+    location = resolve_path(root, path)
+    stat = os.stat(location)
+    etag = file_etag(stat)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        # Lowercase: sanic's file() setdefaults "cache-control: no-cache" by
+        # that exact key, which would otherwise be sent alongside ours
+        "cache-control": cache_control or cache_control_for(path, hashed_immutable),
+        "Accept-Ranges": "bytes"
+    }
+
+    served, served_stat, encoding = location, stat, None
+    available = _precompressed_encodings(location, stat.st_mtime)
+    if available:
+        headers["Vary"] = "Accept-Encoding"
+        encoding = negotiate_encoding(request, available)
+        if encoding:
+            served = location + ENCODING_SUFFIXES[encoding]
+            served_stat = os.stat(served)
+            headers["ETag"] = encoded_etag(etag, encoding)
+
+    if not_modified(request, headers["ETag"], stat.st_mtime):
+        return HTTPResponse(status=304, headers=headers)
+
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    # Content type follows the original name, not the .br/.gz sibling
+    mime_type = mimetypes.guess_type(location)[0] or "application/octet-stream"
+
+    # Ranges address the bytes actually sent, i.e. the encoded sibling if any.
+    # ContentRangeHandler raises RangeNotSatisfiable (416) for bad ranges.
+    _range = None
+    size = served_stat.st_size
+    if range_applies(request, headers["ETag"], headers["Last-Modified"]):
+        _range = ContentRangeHandler(request, served_stat)
+        size = _range.size
+
+    if size >= STREAM_FILE_SIZE:
+        # Each reader gets its own handle and a bounded buffer, so concurrent
+        # seeks into one large file share only the OS page cache
+        headers["Content-Length"] = str(size)
+        return await file_stream(served, chunk_size=STREAM_CHUNK_SIZE, mime_type=mime_type,
+                                 headers=headers, _range=_range)
+    return await file(served, mime_type=mime_type, headers=headers, last_modified=None,
+                      _range=_range)
@@ -0,0 +1,257 @@
+"""
+Streaming multipart/form-data uploads for routes declared with stream=True.
+
+The body is parsed as it arrives: file parts go straight to a temp file
+through a small thread pool, with their size and SHA-256 computed on the
+way, and plain fields are kept in memory up to UPLOAD_FIELD_MAX_BYTES.
+Memory per upload is bounded by the write buffer whatever the file size.
+Handlers move the temp file into place with StreamedFile.save, an atomic
+rename, so a half-written upload is never visible.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import hashlib
+import os
+import tempfile
+
+UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', 200 * 1024 * 1024))
+UPLOAD_FIELD_MAX_BYTES = 1024 * 1024
+UPLOAD_HEADER_MAX_BYTES = 16 * 1024
+# File data is handed to the pool in blocks of this size
+UPLOAD_WRITE_BUFFER = 256 * 1024
+
+_io_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv('UPLOAD_IO_WORKERS', 4)),
+    thread_name_prefix="upload-io"
+)
+
+
+class MultipartError(ValueError):
+    """The request body is not valid multipart/form-data"""
+
+
+class UploadTooLarge(Exception):
+    """A file part exceeded the allowed size"""
+
+
+def multipart_boundary(content_type: Optional[str]) -> bytes:
+    message = Message()
+    message["content-type"] = content_type or ""
+    if message.get_content_type() != "multipart/form-data":
+        raise MultipartError("Expected multipart/form-data")
+    boundary = message.get_param("boundary")
+    if not boundary:
+        raise MultipartError("Missing multipart boundary")
+    return str(boundary).encode("latin-1")
+
+
+class MultipartParser:
+    """
+    Incremental multipart parser. feed() returns events:
+    ("part", headers), ("data", bytes), ("end", None) per part.
+    Enough of a delimiter is held back that one split across chunks is
+    still recognised.
+    """
+
+    def __init__(self, boundary: bytes):
+        self.delimiter = b"--" + boundary
+        self.part_delimiter = b"\r\n--" + boundary
+        self.buffer = bytearray()
+        self.state = "preamble"
+
+    @property
+    def done(self) -> bool:
+        return self.state == "done"
+
+    def feed(self, chunk: bytes) -> List[Tuple[str, object]]:
+        events = []
+        self.buffer.extend(chunk)
+        while True:
+            if self.state == "preamble":
+                index = self.buffer.find(self.delimiter)
+                if index < 0:
+                    del self.buffer[:max(0, len(self.buffer) - len(self.delimiter))]
+                    break
+                del self.buffer[:index + len(self.delimiter)]
+                self.state = "delimiter"
+            elif self.state == "delimiter":
+                if len(self.buffer) < 2:
+                    break
+                if self.buffer[:2] == b"--":
+                    self.state = "done"
+                elif self.buffer[:2] == b"\r\n":
+                    del self.buffer[:2]
+                    self.state = "headers"
+                else:
+                    raise MultipartError("Malformed multipart delimiter")
+            elif self.state == "headers":
+                index = self.buffer.find(b"\r\n\r\n")
+                if index < 0:
+                    if len(self.buffer) > UPLOAD_HEADER_MAX_BYTES:
+                        raise MultipartError("Multipart headers too large")
+                    break
+                events.append(("part", self._parse_headers(bytes(self.buffer[:index]))))
+                del self.buffer[:index + 4]
+                self.state = "body"
+            elif self.state == "body":
+                index = self.buffer.find(self.part_delimiter)
+                if index < 0:
+                    safe = len(self.buffer) - len(self.part_delimiter) + 1
+                    if safe > 0:
+                        events.append(("data", bytes(self.buffer[:safe])))
+                        del self.buffer[:safe]
+                    break
+                if index:
+                    events.append(("data", bytes(self.buffer[:index])))
+                events.append(("end", None))
+                del self.buffer[:index + len(self.part_delimiter)]
+                self.state = "delimiter"
+            else:
+                # Epilogue
+                self.buffer.clear()
+                break
+        return events
+
+    @staticmethod
+    def _parse_headers(raw: bytes) -> Message:
+        headers = Message()
+        for line in raw.decode("utf-8", "replace").split("\r\n"):
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip()] = value.strip()
+        return headers
+
+
+def _open_temp(tmp_dir: str):
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=tmp_dir, prefix="upload-")
+    return os.fdopen(fd, "wb"), path
+
+
+def _write(handle, hasher, data: bytes) -> None:
+    handle.write(data)
+    hasher.update(data)
+
+
+def _move(source: str, destination: str) -> None:
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    os.chmod(source, 0o644)
+    os.replace(source, destination)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class StreamedFile:
+    """A received file part. name and type mirror sanic's request.files entries."""
+
+    def __init__(self, field: str, name: str, type: str, tmp_path: str):
+        self.field = field
+        self.name = name
+        self.type = type
+        self.tmp_path = tmp_path
+        self.size = 0
+        self.sha256 = None
+
+    async def save(self, destination: str) -> str:
+        """Atomically move the upload to destination (same filesystem as the temp dir)"""
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(_io_pool, _move, self.tmp_path, destination)
+        self.tmp_path = None
+        return destination
+
+    async def discard(self) -> None:
+        if self.tmp_path:
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(_io_pool, _remove, self.tmp_path)
+            self.tmp_path = None
+
+
+async def discard_files(files: Dict[str, List[StreamedFile]]) -> None:
+    """Remove every temp file that was not saved"""
+    for parts in files.values():
+        for part in parts:
+            await part.discard()
+
+
+async def receive_multipart(request, tmp_dir: str, max_size: int = UPLOAD_MAX_BYTES
+                            ) -> Tuple[Dict[str, str], Dict[str, List[StreamedFile]]]:
+    """
+    Read a streamed multipart body. Returns (fields, files), files keyed by
+    form field like request.files. tmp_dir must be on the filesystem the
+    files will be saved to. Raises MultipartError or UploadTooLarge, having
+    removed any temp files.
+    """
+    parser = MultipartParser(multipart_boundary(request.headers.get("content-type")))
+    loop = asyncio.get_event_loop()
+    fields: Dict[str, str] = {}
+    files: Dict[str, List[StreamedFile]] = {}
+
+    current: Optional[StreamedFile] = None
+    handle = hasher = None
+    field_name, field_value = None, None
+    pending = bytearray()
+
+    async def flush():
+        if pending:
+            data = bytes(pending)
+            pending.clear()
+            await loop.run_in_executor(_io_pool, _write, handle, hasher, data)
+
+    try:
+        while True:
+            chunk = await request.stream.read()
+            if chunk is None:
+                break
+            for event, value in parser.feed(chunk):
+                if event == "part":
+                    name = value.get_param("name", header="content-disposition")
+                    filename = value.get_filename()
+                    if not name:
+                        raise MultipartError("Multipart part without a name")
+                    if filename is not None:
+                        handle, tmp_path = await loop.run_in_executor(_io_pool, _open_temp, tmp_dir)
+                        hasher = hashlib.sha256()
+                        current = StreamedFile(
+                            name, os.path.basename(filename),
+                            value.get("content-type", "application/octet-stream"), tmp_path
+                        )
+                        files.setdefault(name, []).append(current)
+                    else:
+                        field_name, field_value = name, bytearray()
+                elif event == "data":
+                    if current is not None:
+                        current.size += len(value)
+                        if current.size > max_size:
+                            raise UploadTooLarge(f"File exceeds the {max_size / (1024 * 1024):g} MB limit")
+                        pending.extend(value)
+                        if len(pending) >= UPLOAD_WRITE_BUFFER:
+                            await flush()
+                    else:
+                        field_value.extend(value)
+                        if len(field_value) > UPLOAD_FIELD_MAX_BYTES:
+                            raise MultipartError(f"Form field {field_name} is too large")
+                elif event == "end":
+                    if current is not None:
+                        await flush()
+                        await loop.run_in_executor(_io_pool, handle.close)
+                        current.sha256 = hasher.hexdigest()
+                        current, handle = None, None
+                    else:
+                        fields[field_name] = field_value.decode("utf-8", "replace")
+                        field_name, field_value = None, None
+        if not parser.done:
+            raise MultipartError("Incomplete multipart body")
+    except BaseException:
+        if handle is not None:
+            handle.close()
+        await discard_files(files)
+        raise
+
+    return fields, files
@@ -0,0 +1,310 @@
+"""
+Precomputed waveform peaks for lesson audio and student recordings.
+
+Audio is decoded once (ffmpeg to mono 16-bit PCM at PEAKS_SAMPLE_RATE) and
+reduced with NumPy to min/max pairs per bucket of PEAKS_BASE_SAMPLES_PER_PIXEL
+samples; each coarser level halves the previous one, so every zoom level
+comes from the same decode. Values are quantised to 8 bits, as audiowaveform
+does, and all levels are stored in one binary sidecar next to the audio
+(<audio>.peaks) - a few kilobytes per minute of speech.
+
+The waveform endpoint returns one level as an audiowaveform .dat (or JSON)
+document, which peaks.js loads directly through its waveformData option.
+"""
+from sanic import Blueprint
+from sanic.exceptions import NotFound
+from sanic.response import json
+from sanic_ext import openapi
+from database import logger
+from utils.http_cache import bytes_response
+from utils.static_files import resolve_path, file_etag
+from typing import Dict, Iterable, List, Optional, Tuple
+import asyncio
+import json as json_lib
+import numpy as np
+import os
+import struct
+import subprocess
+import tempfile
+
+waveform_bp = Blueprint("waveform", url_prefix="/api/v1/waveform")
+
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+PEAKS_TIMEOUT_SECONDS = int(os.getenv('PEAKS_TIMEOUT_SECONDS', 600))
+PEAKS_WORKERS = int(os.getenv('PEAKS_WORKERS', 2))
+
+PEAKS_SUFFIX = ".peaks"
+PEAKS_SAMPLE_RATE = 8000
+# Finest level: 125 pairs per second, enough to pick out single syllables
+PEAKS_BASE_SAMPLES_PER_PIXEL = 64
+PEAKS_MAX_LEVELS = 8
+PEAKS_AUDIO_EXTENSIONS = (".mp3", ".m4a", ".aac", ".wav", ".ogg", ".oga", ".opus", ".webm", ".flac", ".mp4")
+
+# Sidecar layout, little-endian:
+#   header  magic, version, bits, sample_rate, level_count
+#   levels  (samples_per_pixel, length) per level, finest first
+#   data    per level, length interleaved int8 (min, max) pairs
+_HEADER = struct.Struct("<4sBBIH")
+_LEVEL = struct.Struct("<II")
+_MAGIC = b"PEAK"
+_VERSION = 1
+# audiowaveform .dat version 1: version, flags (1 = 8-bit), sample_rate,
+# samples_per_pixel, length
+_DAT_HEADER = struct.Struct("<iIiiI")
+
+_slots: Optional[asyncio.Semaphore] = None
+_pending: Dict[str, asyncio.Future] = {}
+
+
+class PeaksError(Exception):
+    """The audio could not be decoded into peaks"""
+
+
+def peaks_path(audio_path: str) -> str:
+    return audio_path + PEAKS_SUFFIX
+
+
+def move_peaks(audio_path: str, new_audio_path: str) -> None:
+    """Carry a file's sidecar along when it is renamed; no-op without one"""
+    try:
+        os.replace(peaks_path(audio_path), peaks_path(new_audio_path))
+    except FileNotFoundError:
+        pass
+
+
+def remove_peaks(audio_path: str) -> None:
+    try:
+        os.unlink(peaks_path(audio_path))
+    except FileNotFoundError:
+        pass
+
+
+def decode(source: str) -> np.ndarray:
+    """Mono int16 samples of source at PEAKS_SAMPLE_RATE"""
+    try:
+        completed = subprocess.run([
+            FFMPEG_BINARY, "-nostdin", "-hide_banner", "-loglevel", "error", "-i", source,
+            "-vn", "-ac", "1", "-ar", str(PEAKS_SAMPLE_RATE), "-f", "s16le", "-"
+        ], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            timeout=PEAKS_TIMEOUT_SECONDS, check=False)
+    except subprocess.TimeoutExpired:
+        raise PeaksError("ffmpeg timed out")
+    if completed.returncode != 0:
+        raise PeaksError(completed.stderr.decode(errors='replace').strip()[-500:])
+    pcm = completed.stdout
+    return np.frombuffer(pcm[:len(pcm) - len(pcm) % 2], dtype="<i2")
+
+
+def compute_levels(samples: np.ndarray) -> List[Tuple[int, np.ndarray]]:
+    """
+    (samples_per_pixel, interleaved int8 min/max) per level, finest first,
+    stopping once a level fits in a single pair.
+    """
+    if not len(samples):
+        raise PeaksError("No audio samples")
+    spp = PEAKS_BASE_SAMPLES_PER_PIXEL
+    # Repeat the last sample so the final partial bucket doesn't read as silence
+    buckets = -(-len(samples) // spp)
+    padded = np.pad(samples, (0, buckets * spp - len(samples)), mode="edge").reshape(buckets, spp)
+    mins = padded.min(axis=1)
+    maxs = padded.max(axis=1)
+
+    levels = []
+    while True:
+        pairs = np.empty(len(mins) * 2, dtype=np.int8)
+        # Arithmetic shift floors, so quantised peaks never shrink below the signal
+        pairs[0::2] = mins >> 8
+        pairs[1::2] = np.minimum(-((-maxs.astype(np.int32)) >> 8), 127)
+        levels.append((spp, pairs))
+        if len(mins) <= 1 or len(levels) >= PEAKS_MAX_LEVELS:
+            break
+        if len(mins) % 2:
+            mins = np.append(mins, mins[-1])
+            maxs = np.append(maxs, maxs[-1])
+        mins = mins.reshape(-1, 2).min(axis=1)
+        maxs = maxs.reshape(-1, 2).max(axis=1)
+        spp *= 2
+    return levels
+
+
+def write_peaks(source: str, target: Optional[str] = None) -> str:
+    """Decode source and write its peaks sidecar atomically; returns its path"""
+    target = target or peaks_path(source)
+    levels = compute_levels(decode(source))
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target) or ".", prefix=".peaks-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, _VERSION, 8, PEAKS_SAMPLE_RATE, len(levels)))
+            for spp, pairs in levels:
+                f.write(_LEVEL.pack(spp, len(pairs) // 2))
+            for _, pairs in levels:
+                f.write(pairs.tobytes())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return target
+
+
+def read_levels(path: str) -> Tuple[int, List[Tuple[int, int, int]]]:
+    """sample_rate and (samples_per_pixel, length, data offset) of each level in a sidecar"""
+    with open(path, "rb") as f:
+        head = f.read(_HEADER.size)
+        if len(head) < _HEADER.size:
+            raise PeaksError("Truncated peaks file")
+        magic, version, bits, sample_rate, count = _HEADER.unpack(head)
+        if magic != _MAGIC or version != _VERSION or bits != 8:
+            raise PeaksError("Unsupported peaks file")
+        table = f.read(_LEVEL.size * count)
+    offset = _HEADER.size + _LEVEL.size * count
+    levels = []
+    for index in range(count):
+        spp, length = _LEVEL.unpack_from(table, index * _LEVEL.size)
+        levels.append((spp, length, offset))
+        offset += length * 2
+    return sample_rate, levels
+
+
+def read_level(path: str, zoom: Optional[int] = None, samples_per_pixel: Optional[int] = None
+               ) -> Tuple[int, int, bytes]:
+    """
+    (sample_rate, samples_per_pixel, interleaved pairs) of one level: zoom
+    counts from 0 (finest), samples_per_pixel picks the finest level at
+    least that coarse. IndexError for a zoom that doesn't exist.
+    """
+    sample_rate, levels = read_levels(path)
+    if samples_per_pixel is not None:
+        level = next((lv for lv in levels if lv[0] >= samples_per_pixel), levels[-1])
+    else:
+        level = levels[zoom or 0]
+    spp, length, offset = level
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read(length * 2)
+    return sample_rate, spp, data
+
+
+def is_fresh(audio_path: str) -> bool:
+    try:
+        return os.stat(peaks_path(audio_path)).st_mtime >= os.stat(audio_path).st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def _stale_audio(root: str) -> List[str]:
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for filename in filenames:
+            if filename.startswith('.') or not filename.lower().endswith(PEAKS_AUDIO_EXTENSIONS):
+                continue
+            path = os.path.join(dirpath, filename)
+            if not is_fresh(path):
+                found.append(path)
+    return found
+
+
+async def ensure_peaks(audio_path: str) -> str:
+    """
+    Sidecar path for audio_path, generating it first if missing or older
+    than the audio. Concurrent calls for one file share the work, and at
+    most PEAKS_WORKERS decodes run at once.
+    """
+    global _slots
+    if is_fresh(audio_path):
+        return peaks_path(audio_path)
+    if _slots is None:
+        _slots = asyncio.Semaphore(PEAKS_WORKERS)
+
+    async def generate():
+        async with _slots:
+            loop = asyncio.get_event_loop()
+            return await loop.run_in_executor(None, write_peaks, audio_path)
+
+    pending = _pending.get(audio_path)
+    if pending is None:
+        pending = asyncio.ensure_future(generate())
+        _pending[audio_path] = pending
+        pending.add_done_callback(lambda _: _pending.pop(audio_path, None))
+    return await asyncio.shield(pending)
+
+
+async def generate_peaks(paths: Iterable[str]) -> None:
+    """Background generation after uploads and syncs; failures are logged"""
+    for path in paths:
+        try:
+            await ensure_peaks(path)
+        except Exception as e:
+            logger.error(f"Failed to generate peaks for {path}: {str(e)}")
+
+
+async def generate_tree_peaks(root: str) -> None:
+    """Peaks for every audio file under root that has none or an outdated one"""
+    loop = asyncio.get_event_loop()
+    await generate_peaks(await loop.run_in_executor(None, _stale_audio, root))
+
+
+def _int_arg(request, name: str) -> Optional[int]:
+    value = request.args.get(name)
+    if value is None:
+        return None
+    number = int(value)
+    if number < 0:
+        raise ValueError
+    return number
+
+
+@waveform_bp.get("/<path:path>")
+@openapi.summary("Waveform peaks of an audio file served under /data")
+@openapi.parameter("zoom", int, "query", description="Level, 0 being the finest")
+@openapi.parameter("samples_per_pixel", int, "query", description="Finest level at least this coarse")
+@openapi.parameter("format", str, "query", description="dat (default) or json")
+async def get_waveform(request, path: str):
+    try:
+        try:
+            zoom = _int_arg(request, "zoom")
+            samples_per_pixel = _int_arg(request, "samples_per_pixel")
+        except ValueError:
+            return json({"error": "zoom and samples_per_pixel must be non-negative integers"}, status=400)
+        fmt = request.args.get("format", "dat")
+        if fmt not in ("dat", "json"):
+            return json({"error": "format must be dat or json"}, status=400)
+
+        try:
+            audio_path = resolve_path(os.getenv('BASE_DATA_PATH', 'data'), path)
+        except NotFound:
+            return json({"error": "Audio file not found"}, status=404)
+        if not audio_path.lower().endswith(PEAKS_AUDIO_EXTENSIONS):
+            return json({"error": "Not an audio file"}, status=400)
+
+        try:
+            sidecar = await ensure_peaks(audio_path)
+        except PeaksError as e:
+            return json({"error": f"Could not decode audio: {str(e)}"}, status=422)
+
+        loop = asyncio.get_event_loop()
+        try:
+            sample_rate, spp, data = await loop.run_in_executor(
+                None, read_level, sidecar, zoom, samples_per_pixel
+            )
+        except IndexError:
+            return json({"error": "Zoom level not available"}, status=404)
+
+        etag = f'{file_etag(os.stat(sidecar))[:-1]}-{spp}-{fmt}"'
+        if fmt == "json":
+            body = json_lib.dumps({
+                "version": 2,
+                "channels": 1,
+                "sample_rate": sample_rate,
+                "samples_per_pixel": spp,
+                "bits": 8,
+                "length": len(data) // 2,
+                "data": np.frombuffer(data, dtype=np.int8).tolist()
+            }, separators=(",", ":")).encode()
+            return bytes_response(request, body, etag=etag)
+        body = _DAT_HEADER.pack(1, 1, sample_rate, spp, len(data) // 2) + data
+        return bytes_response(request, body, etag=etag, content_type="application/octet-stream")
+    except Exception as e:
+        return json({"error": str(e)}, status=500)
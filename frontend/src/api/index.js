@@ -4,6 +4,12 @@ import Storage from '../storage/index';
 export const BASE_URL = '/api/v1';
 export const BASE_DATA_PATH = '/data';
 
+// Precomputed waveform peaks of audio served under BASE_DATA_PATH, or null
+export const waveformUrl = (audioUrl) => {
+    if (!audioUrl || !audioUrl.startsWith(`${BASE_DATA_PATH}/`)) return null;
+    return `${BASE_URL}/waveform/${audioUrl.slice(BASE_DATA_PATH.length + 1).split(/[?#]/)[0]}`;
+};
+
 const handleResponse = async (response) => {
     if (!response.ok) {
         if (response.status === 401) {
@@ -47,6 +53,20 @@ export const get = async (endpoint) => {
 };
 // {{ edit_2 }}
 
+// Collect every item from a cursor-paginated list endpoint ({items, next_cursor})
+export const getAll = async (endpoint, limit = 200) => {
+    const separator = endpoint.includes('?') ? '&' : '?';
+    let items = [];
+    let cursor = null;
+    do {
+        const cursorParam = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+        const result = await get(`${endpoint}${separator}limit=${limit}${cursorParam}`);
+        items = items.concat(result.data.items);
+        cursor = result.data.next_cursor;
+    } while (cursor);
+    return items;
+};
+
 export const postSimple = async (endpoint, data) => {
     const token = await Storage.get('token');
     const response = await fetch(`${BASE_URL}${endpoint}`, {
@@ -152,8 +152,8 @@ const LessonUsers = ({ lessonHash }) => {
 
     const fetchAvailableUsers = async () => {
         try {
-            const response = await api.get('/users');
-            const filteredUsers = response.data.filter(
+            const allUsers = await api.getAll('/users');
+            const filteredUsers = allUsers.filter(
                 user => !users.some(existingUser => existingUser.user_hash === user.hash)
             );
             setAvailableUsers(filteredUsers);
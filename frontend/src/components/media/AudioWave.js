@@ -1,7 +1,8 @@
 import React, { useEffect, useRef, useState } from 'react';
 import Peaks from 'peaks.js';
+import { waveformUrl } from '../../api/index';
 
-const AudioWave = ({ audioUrl, autoPlay = false }) => {
+const AudioWave = ({ audioUrl, peaksUrl, autoPlay = false }) => {
   const audioRef = useRef(null);
   const zoomviewRef = useRef(null);
   const overviewRef = useRef(null);
@@ -15,6 +16,8 @@ const AudioWave = ({ audioUrl, autoPlay = false }) => {
 
     const audio = new Audio(audioUrl);
     audioRef.current = audio;
+    // Audio from /data has peaks on the server; blobs are decoded in the browser
+    const peaksSource = peaksUrl || waveformUrl(audioUrl);
     audio.crossOrigin = 'anonymous';
 
     const options = {
@@ -40,9 +43,14 @@ const AudioWave = ({ audioUrl, autoPlay = false }) => {
         responsive: true
       },
       mediaElement: audio,
-      webAudio: {
-        audioContext: new (window.AudioContext || window.webkitAudioContext)(),
-      },
+      // Precomputed peaks (/api/v1/waveform/...) spare decoding the whole file
+      ...(peaksSource
+        ? { dataUri: { arraybuffer: peaksSource } }
+        : {
+            webAudio: {
+              audioContext: new (window.AudioContext || window.webkitAudioContext)(),
+            },
+          }),
       height: 100,
       keyboard: true,
       pointMarkerColor: '#006eb0',
@@ -93,7 +101,7 @@ const AudioWave = ({ audioUrl, autoPlay = false }) => {
       audio.pause();
       window.removeEventListener('resize', handleResize);
     };
-  }, [audioUrl, autoPlay]);
+  }, [audioUrl, peaksUrl, autoPlay]);
 
   const togglePlay = () => {
     if (!audioRef.current || !peaksInstance) return;
@@ -59,8 +59,7 @@ const Page = ({
                 page_title: '',
                 page_content: "New page content",
                 page_type: pageType, // Using one of the valid PAGE_TYPES from backend
-                page_version: 'bamboo0.6',
-                page_history: [{ content: "New page content", timestamp: new Date().toISOString() }]
+                page_version: 'bamboo0.6'
               };
 
               const createResponse = await post_json('/pages', pageData);
@@ -101,8 +100,7 @@ const Page = ({
         page_content: content,
         page_description: description,
         page_type: 'lesson',
-        page_version: 'bamboo0.6',
-        page_history: [{ content: content, timestamp: new Date().toISOString() }]
+        page_version: 'bamboo0.6'
       };
 
       let response;
@@ -84,6 +84,11 @@ const CourseLesson = () => {
         result = await get(`/lessons/${lessonHash}`);
       } else {
         result = await get(`/user-lessons/${lessonHash}`);
+        // Lesson content is served separately by content hash and cached by the browser
+        if (result.data && result.data.content_hash && !('lesson_content' in result.data)) {
+          const content = await get(`/lessons/content/${result.data.content_hash}`);
+          Object.assign(result.data, content.data);
+        }
       }
       if (result.data) {
         if (!('hash' in result.data) && ('lesson_hash' in result.data)) {
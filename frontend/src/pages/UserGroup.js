@@ -23,7 +23,7 @@ import {
   IconButton
 } from '@mui/material';
 import { Edit as EditIcon, Delete as DeleteIcon, Add as AddIcon, Search as SearchIcon } from '@mui/icons-material';
-import { get, post, put, post_json } from '../api';
+import { get, getAll, post, put, post_json } from '../api';
 import InputAdornment from '@mui/material/InputAdornment';
 
 const UserGroup = () => {
@@ -116,8 +116,8 @@ const UserGroup = () => {
 
   const fetchAvailableUsers = async () => {
     try {
-      const response = await get('/users');
-      const filteredUsers = response.data.filter(
+      const allUsers = await getAll('/users');
+      const filteredUsers = allUsers.filter(
         user => !members.some(member => member.user_hash === user.hash)
       );
       setAvailableUsers(filteredUsers);
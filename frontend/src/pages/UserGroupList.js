@@ -24,7 +24,7 @@ import {
   Switch
 } from '@mui/material';
 import { Add as AddIcon, Edit as EditIcon, Visibility as ViewIcon } from '@mui/icons-material';
-import { get, post_json } from '../api';
+import { getAll, post_json } from '../api';
 
 const UserGroupList = () => {
   const navigate = useNavigate();
@@ -54,8 +54,7 @@ const UserGroupList = () => {
   const fetchGroups = async () => {
     try {
       setLoading(true);
-      const response = await get('/user-groups/list');
-      setGroups(response.data);
+      setGroups(await getAll('/user-groups/list'));
     } catch (err) {
       showSnackbar('Failed to load groups', 'error');
     } finally {
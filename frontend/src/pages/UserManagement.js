@@ -22,7 +22,7 @@ import {
   MenuItem
 } from '@mui/material';
 import { Edit as EditIcon, Delete as DeleteIcon } from '@mui/icons-material';
-import { get, post_json, put, del } from '../api';
+import { getAll, post_json, put, del } from '../api';
 
 const ROLE_CHOICES = [
   { value: 'user', label: 'User' },
@@ -54,8 +54,7 @@ const UserManagement = () => {
   const fetchUsers = async () => {
     try {
       setLoading(true);
-      const response = await get('/users');
-      setUsers(response.data);
+      setUsers(await getAll('/users'));
     } catch (error) {
       showSnackbar('Failed to fetch users', 'error');
     } finally {